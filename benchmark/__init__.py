@@ -0,0 +1,11 @@
+"""
+benchmark
+
+Performance measurements for extract_http.
+
+- benchmark.generators : synthetic pages, tables, JSON payloads and transforms of scalable size
+- benchmark.micro      : times individual pipeline functions over the generated inputs
+
+Run from the repository root:
+    python -m benchmark.micro --output micro.json
+"""
@@ -0,0 +1,155 @@
+"""
+compression.py
+
+Decode cost against bytes saved, for each Content-Encoding that extract_http.fetch can negotiate.
+
+Usage:
+    python -m benchmark.compression [--scale 1.0] [--repeat 5] [--label release-x] [--output results.json]
+
+Pages are synthetic listing pages and the test/data fixtures, compressed at the levels servers commonly use.
+Decoding is timed through extract_http.fetch.decode_stream(), in chunks as received from the network.
+
+Results are emitted as JSON:
+{
+    "meta": {...},
+    "results": [
+        {
+            "page", "encoding", "level", "bytes", "compressed", "ratio", "bytes_saved",
+            "decode", "decode_per_mb", "break_even_bandwidth"
+        },
+    ]
+}
+decode is in seconds per page, and decode_per_mb in seconds per MB of decoded content.
+break_even_bandwidth is bytes_saved / decode, in bytes per second: on links slower than this,
+fetching the compressed page and decoding it takes less time than fetching the page uncompressed.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import zlib
+from typing import Any, Callable, Dict, List, Tuple
+
+from extract_http import fetch
+from extract_http.fetch import decode_stream, FETCH_CHUNK_SIZE
+
+from benchmark import generators
+from benchmark.micro import get_meta, time_it
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test", "data")
+
+def get_encoders()->List[Tuple[str, Any, Callable[[bytes], bytes]]]:
+    """
+    (encoding, level, encode) for every encoding available.
+    """
+
+    _encoders = [
+        ("gzip", 6, lambda data: gzip.compress(data, compresslevel=6)),
+        ("gzip", 9, lambda data: gzip.compress(data, compresslevel=9)),
+        ("deflate", 6, lambda data: zlib.compress(data, 6)),
+    ]
+
+    if (fetch.brotli is not None):
+        _encoders += [
+            ("br", 5, lambda data: fetch.brotli.compress(data, quality=5)),
+            ("br", 11, lambda data: fetch.brotli.compress(data, quality=11)),
+        ]
+
+    if (fetch.zstandard is not None):
+        _encoders += [
+            ("zstd", 3, lambda data: fetch.zstandard.ZstdCompressor(level=3).compress(data)),
+            ("zstd", 19, lambda data: fetch.zstandard.ZstdCompressor(level=19).compress(data)),
+        ]
+
+    return _encoders
+
+def get_pages(
+    scale:float=1.,
+)->Dict[str, bytes]:
+    _pages = {
+        f"listing_{_records}": generators.listing_page(_records).encode("utf-8") \
+            for _records in (max(1, int(10 * scale)), max(1, int(1000 * scale)))
+    }
+
+    for _file_name in ("intel_alderlake_table.html", "erco_article_11130.json"):
+        _path = os.path.join(FIXTURE_DIR, _file_name)
+        if (os.path.exists(_path)):
+            with open(_path, "rb") as _fHnd:
+                _pages[_file_name] = _fHnd.read()
+
+    return _pages
+
+def chunked(
+    data:bytes,
+    size:int=FETCH_CHUNK_SIZE,
+)->List[bytes]:
+    return [ data[_start:_start+size] for _start in range(0, len(data), size) ] or [ b"", ]
+
+def bench_decode(
+    page:str,
+    data:bytes,
+    encoding:str,
+    level:Any,
+    encode:Callable[[bytes], bytes],
+    repeat:int=5,
+)->Dict[str, Any]:
+    _compressed = encode(data)
+    _chunks = chunked(_compressed)
+
+    _timing = time_it(
+        "decode",
+        lambda: decode_stream(_chunks, encoding),
+        repeat=repeat,
+    )
+
+    _decode = _timing["min"]
+    _bytes_saved = len(data) - len(_compressed)
+
+    return {
+        "page": page,
+        "encoding": encoding,
+        "level": level,
+        "bytes": len(data),
+        "compressed": len(_compressed),
+        "ratio": len(_compressed) / len(data) if (data) else None,
+        "bytes_saved": _bytes_saved,
+        "decode": _decode,
+        "decode_per_mb": _decode / (len(data) / 1024 / 1024) if (data) else None,
+        "break_even_bandwidth": _bytes_saved / _decode if (_decode > 0) else None,
+    }
+
+def run(
+    scale:float=1.,
+    repeat:int=5,
+)->List[Dict[str, Any]]:
+    _results = []
+
+    for _page, _data in get_pages(scale).items():
+        for _encoding, _level, _encode in get_encoders():
+            _results.append(bench_decode(_page, _data, _encoding, _level, _encode, repeat=repeat))
+
+    return _results
+
+def main(argv:List[str]=None):
+    _parser = argparse.ArgumentParser(description="Decode cost against bytes saved for each Content-Encoding.")
+    _parser.add_argument("--scale", type=float, default=1., help="Multiplier of the size of synthetic pages.")
+    _parser.add_argument("--repeat", type=int, default=5, help="Number of repeats per benchmark.")
+    _parser.add_argument("--label", type=str, default=None, help="Label to identify this run, e.g. release or backend.")
+    _parser.add_argument("--output", type=str, default=None, help="Path to write JSON results to; stdout if not supplied.")
+    _args = _parser.parse_args(argv)
+
+    _output = {
+        "meta": get_meta(_args.label),
+        "results": run(scale=_args.scale, repeat=_args.repeat),
+    }
+
+    if (_args.output):
+        with open(_args.output, "w") as _fHnd:
+            json.dump(_output, _fHnd, indent=4)
+    else:
+        json.dump(_output, sys.stdout, indent=4)
+
+if __name__ == "__main__":
+    main()
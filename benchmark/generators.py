@@ -0,0 +1,185 @@
+"""
+generators.py
+
+Synthetic inputs of scalable size for benchmarking.
+
+Every generator is deterministic for the same arguments, so that results are comparable between runs.
+"""
+
+from typing import Dict, List, Tuple
+
+def listing_page(
+    records:int,
+)->str:
+    """
+    HTML listing page with the requested number of product records, e.g.
+        <div class="item">
+            <h4 class="art-no">A0000001</h4>
+            <span class="name">Product 1</span>
+            ...
+        </div>
+    Use listing_locate() as the matching "locate" configuration.
+    """
+
+    _items = "\n".join((
+        f"""        <div class="item">
+            <h4 class="art-no">A{_id:07d}</h4>
+            <span class="name">Product {_id} with a moderately long descriptive name</span>
+            <img class="product-image" src="/images/A{_id:07d}.png" alt="Product {_id}">
+            <span class="price">{(_id * 37) % 100000:,d}.{_id % 100:02d}</span>
+            <span class="weight">{(_id % 50) / 10 + 0.1:.1f} kg</span>
+            <a class="specsheet" href="/specsheets/A{_id:07d}.pdf">Specification</a>
+        </div>"""
+        for _id in range(records)
+    ))
+
+    return f"""<!DOCTYPE html>
+<html>
+<head><title>Listing of {records} products</title></head>
+<body>
+    <div class="header"><h1>Products</h1></div>
+    <div class="listing">
+{_items}
+    </div>
+    <div class="footer">Generated for benchmarking.</div>
+</body>
+</html>"""
+
+def listing_locate()->List[dict]:
+    """
+    "locate" configuration matching listing_page().
+    """
+    return [
+        {
+            "search_root": [
+                "div.listing",
+            ],
+            "values": {
+                "art_no": "div.item>h4.art-no$innerText",
+                "name": "div.item>span.name$stripText",
+                "img_src": "div.item>img.product-image$attr[src]",
+                "price": "div.item>span.price$innerText",
+                "weight": "div.item>span.weight$innerText",
+                "specsheet": "div.item>a.specsheet$attr[href]",
+            },
+            "transform": {
+                "description": {
+                    "source": "{art_no}: {name}",
+                },
+            },
+        },
+    ]
+
+def spec_table(
+    rows:int,
+    cols:int,
+    span:int=3,
+)->str:
+    """
+    HTML table of rows x cols cells, including the header row.
+
+    Every span-th cell (except those in the header row and first column) spans 2 rows and/or 2 columns,
+    so that the rowspan/colspan resolution of html_table is exercised.
+    """
+
+    _occupied = [ [False] * cols for _ in range(rows) ]
+    _html_rows = []
+
+    for _row in range(rows):
+        _cells = []
+
+        for _col in range(cols):
+            if (_occupied[_row][_col]):
+                continue
+
+            _rowspan = 1
+            _colspan = 1
+
+            if (_row > 0 and _col > 0 and (_row * cols + _col) % span == 0):
+                if (_row + 1 < rows and not _occupied[_row + 1][_col]):
+                    _rowspan = 2
+                if (_col + 1 < cols and not _occupied[_row][_col + 1] and \
+                    (_rowspan == 1 or not _occupied[_row + 1][_col + 1])):
+                    _colspan = 2 if ((_row + _col) % 2) else 1
+
+            for _r in range(_row, _row + _rowspan):
+                for _c in range(_col, _col + _colspan):
+                    _occupied[_r][_c] = True
+
+            _attrs = (f' rowspan="{_rowspan}"' if (_rowspan > 1) else "") + \
+                     (f' colspan="{_colspan}"' if (_colspan > 1) else "")
+
+            if (_row == 0):
+                _cells.append(f"<th{_attrs}>Column {_col}</th>")
+            else:
+                _cells.append(f'<td{_attrs}><a href="/cell/{_row}/{_col}">Value {_row}.{_col}</a></td>')
+
+        _html_rows.append("<tr>" + "".join(_cells) + "</tr>")
+
+    return "<table class=\"specs-table\">\n" + "\n".join(_html_rows) + "\n</table>"
+
+def deep_json(
+    depth:int,
+    breadth:int,
+)->Tuple[dict, str]:
+    """
+    Nested dict of the given depth, where every level contains breadth records, each having a "value" key.
+
+    Returns (dict, key) where key is the record_dict Key String reaching the deepest "value" through all levels.
+    """
+
+    def _level(_depth:int):
+        if (_depth <= 0):
+            return { "value": "leaf", "number": str(_depth) }
+
+        return {
+            "value": f"level {_depth}",
+            "number": str(_depth * breadth),
+            "children": [ _level(_depth - 1) for _ in range(breadth) ],
+        }
+
+    _key = ">>>".join([ "root", ] + [ "children", ] * depth + [ "value", ])
+
+    return { "root": _level(depth) }, _key
+
+def wide_record(
+    keys:int,
+)->Tuple[dict, Dict[str, dict]]:
+    """
+    A record with the requested number of keys, and a transform dict applying
+    source, substitute and type transformations to each of them.
+
+    Returns (record, transform).
+    """
+
+    _record = {
+        f"field_{_id}": f"{_id * 3} units" for _id in range(keys)
+    }
+
+    _transform = {}
+    for _id in range(keys):
+        _transform[f"field_{_id}"] = {
+            "substitute": {
+                "pattern": r"^(?P<number>\d+)\s*units$",
+                "rep": r"\g<number>",
+            },
+            "type": "int",
+        }
+        _transform[f"label_{_id}"] = {
+            "source": f"Field {_id}: {{field_{_id}}}",
+        }
+
+    return _record, _transform
+
+def format_string(
+    fields:int,
+)->str:
+    """
+    Format string referencing the requested number of fields, some with format specs and manipulations.
+    """
+    return " ".join((
+        f"{{field_{_id}:s$upper}}" if (_id % 3 == 0) else \
+        f"{{field_{_id}>>>sub:,d$mul(2)}}" if (_id % 3 == 1) else \
+        f"{{field_{_id}}}"
+        for _id in range(fields)
+    ))
@@ -0,0 +1,284 @@
+"""
+micro.py
+
+Micro benchmarks of individual pipeline functions over synthetic inputs.
+
+Usage:
+    python -m benchmark.micro [--scale 1.0] [--repeat 5] [--label release-x] [--output results.json]
+
+Results are emitted as JSON:
+{
+    "meta": { "label", "timestamp", "python", "platform", "versions": {...} },
+    "results": [
+        { "name", "params", "repeat", "number", "min", "median", "mean", "items", "per_item" },
+    ]
+}
+All times are in seconds per call; per_item is min divided by the number of items processed per call.
+"""
+
+import argparse
+import copy
+from datetime import datetime
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from bs4 import BeautifulSoup
+
+from extract_http.bin import formatters
+from extract_http.extract import do_locate_html
+from extract_http.html_node import get_value_table
+from extract_http.numeric import parse_numbers
+from extract_http.record_dict import record_dict
+from extract_http.transform import transform_record
+
+from benchmark import generators
+
+def get_versions()->Dict[str, str]:
+    """
+    Versions of extract_http and the backends it depends on.
+    """
+
+    from importlib import metadata
+
+    _versions = {}
+    for _package in ("extract_http", "beautifulsoup4", "pandas", "numpy", "requests"):
+        try:
+            _versions[_package] = metadata.version(_package)
+        except metadata.PackageNotFoundError:
+            _versions[_package] = None
+
+    return _versions
+
+def get_meta(
+    label:str=None,
+)->Dict[str, Any]:
+    return {
+        "label": label,
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "versions": get_versions(),
+    }
+
+def time_it(
+    name:str,
+    func:Callable[[], Any],
+    params:dict=None,
+    items:int=1,
+    repeat:int=5,
+    number:int=1,
+    setup:Callable[[], Any]=None,
+)->Dict[str, Any]:
+    """
+    Time func() repeat times, each being number calls.
+
+    If setup is supplied, it is called before each repeat and its return value passed to func;
+    setup time is excluded.
+    """
+
+    _timings = []
+
+    for _ in range(repeat):
+        _args = (setup(), ) if (callable(setup)) else ()
+
+        _start = time.perf_counter()
+        for _ in range(number):
+            func(*_args)
+        _timings.append((time.perf_counter() - _start) / number)
+
+    return {
+        "name": name,
+        "params": params or {},
+        "repeat": repeat,
+        "number": number,
+        "min": min(_timings),
+        "median": statistics.median(_timings),
+        "mean": statistics.mean(_timings),
+        "items": items,
+        "per_item": min(_timings) / max(items, 1),
+    }
+
+def bench_do_locate_html(
+    records:int,
+    repeat:int=5,
+)->Dict[str, Any]:
+    _html = generators.listing_page(records)
+    _locate = generators.listing_locate()
+
+    return time_it(
+        "do_locate_html",
+        lambda: do_locate_html(_locate, _html, url="https://www.example.com/"),
+        params={ "records": records, "bytes": len(_html) },
+        items=records,
+        repeat=repeat,
+    )
+
+def bench_get_value_table(
+    rows:int,
+    cols:int,
+    tables:int=1,
+    repeat:int=5,
+)->Dict[str, Any]:
+    # Tables share their columns, but not their values
+    _html = "\n".join(
+        generators.spec_table(rows, cols).replace("Value ", f"Table {_table_id} Value ") for _table_id in range(tables)
+    )
+    _nodes = BeautifulSoup(_html, "html.parser").select("table")
+    _settings = {
+        "orient": "rows",
+        "key_index": 0,
+        "keys": {
+            "Column 1": "a$attr[href]",
+        },
+    }
+
+    return time_it(
+        "get_value_table",
+        lambda: get_value_table(copy.deepcopy(_settings), _nodes),
+        params={ "rows": rows, "cols": cols, "tables": tables },
+        items=rows * cols * tables,
+        repeat=repeat,
+    )
+
+def bench_record_dict_get(
+    depth:int,
+    breadth:int,
+    repeat:int=5,
+    number:int=10,
+)->Dict[str, Any]:
+    _dict, _key = generators.deep_json(depth, breadth)
+    _record = record_dict(_dict)
+
+    return time_it(
+        "record_dict.get",
+        lambda: _record.get(_key, delimiter=">>>"),
+        params={ "depth": depth, "breadth": breadth },
+        items=breadth ** depth,
+        repeat=repeat,
+        number=number,
+    )
+
+def bench_record_dict_put(
+    depth:int,
+    breadth:int,
+    repeat:int=5,
+)->Dict[str, Any]:
+    _dict, _key = generators.deep_json(depth, breadth)
+    _values = [ f"new value {_id}" for _id in range(breadth ** depth) ]
+
+    return time_it(
+        "record_dict.put",
+        lambda _record: _record.put(_key, _values.copy(), delimiter=">>>"),
+        params={ "depth": depth, "breadth": breadth },
+        items=breadth ** depth,
+        repeat=repeat,
+        setup=lambda: record_dict(copy.deepcopy(_dict)),
+    )
+
+def bench_transform_record(
+    keys:int,
+    repeat:int=5,
+)->Dict[str, Any]:
+    _record, _transform = generators.wide_record(keys)
+
+    return time_it(
+        "transform_record",
+        lambda: transform_record(_transform, _record.copy()),
+        params={ "keys": keys, "transform_keys": len(_transform) },
+        items=len(_transform),
+        repeat=repeat,
+    )
+
+def bench_formatters(
+    fields:int,
+    repeat:int=5,
+    number:int=100,
+)->Dict[str, Any]:
+    _format = generators.format_string(fields)
+
+    return time_it(
+        "formatters",
+        lambda: tuple(formatters(_format)),
+        params={ "fields": fields },
+        items=fields,
+        repeat=repeat,
+        number=number,
+    )
+
+def bench_parse_numbers(
+    values:int,
+    repeat:int=5,
+)->Dict[str, Any]:
+    _texts = [
+        _format.format(_id) for _id in range(values) for _format in ("{0}", "{0},{0:03d}.5 kg", "{0}.5 %", "EUR {0}.{0:03d},25")
+    ][:values]
+
+    return time_it(
+        "parse_numbers",
+        lambda: parse_numbers(_texts),
+        params={ "values": values },
+        items=values,
+        repeat=repeat,
+    )
+
+def run(
+    scale:float=1.,
+    repeat:int=5,
+)->List[Dict[str, Any]]:
+    """
+    Run all micro benchmarks; scale multiplies the size of all generated inputs.
+    """
+
+    _scaled = lambda size: max(1, int(size * scale))
+
+    _results = []
+
+    for _records in (_scaled(10), _scaled(100), _scaled(1000)):
+        _results.append(bench_do_locate_html(_records, repeat=repeat))
+
+    for _rows, _cols in ((_scaled(10), 5), (_scaled(50), 10), (_scaled(100), 20)):
+        _results.append(bench_get_value_table(_rows, _cols, repeat=repeat))
+
+    for _tables in (2, _scaled(10), _scaled(30)):
+        _results.append(bench_get_value_table(10, 5, tables=_tables, repeat=repeat))
+
+    for _depth, _breadth in ((2, _scaled(10)), (4, _scaled(5)), (8, 2)):
+        _results.append(bench_record_dict_get(_depth, _breadth, repeat=repeat))
+        _results.append(bench_record_dict_put(_depth, _breadth, repeat=repeat))
+
+    for _keys in (_scaled(10), _scaled(100)):
+        _results.append(bench_transform_record(_keys, repeat=repeat))
+
+    for _values in (_scaled(100), _scaled(10000)):
+        _results.append(bench_parse_numbers(_values, repeat=repeat))
+
+    for _fields in (_scaled(10), _scaled(100), _scaled(1000)):
+        _results.append(bench_formatters(_fields, repeat=repeat))
+
+    return _results
+
+def main(argv:List[str]=None):
+    _parser = argparse.ArgumentParser(description="Micro benchmarks for extract_http.")
+    _parser.add_argument("--scale", type=float, default=1., help="Multiplier of all input sizes.")
+    _parser.add_argument("--repeat", type=int, default=5, help="Number of repeats per benchmark.")
+    _parser.add_argument("--label", type=str, default=None, help="Label to identify this run, e.g. release or backend.")
+    _parser.add_argument("--output", type=str, default=None, help="Path to write JSON results to; stdout if not supplied.")
+    _args = _parser.parse_args(argv)
+
+    _output = {
+        "meta": get_meta(_args.label),
+        "results": run(scale=_args.scale, repeat=_args.repeat),
+    }
+
+    if (_args.output):
+        with open(_args.output, "w") as _fHnd:
+            json.dump(_output, _fHnd, indent=4)
+    else:
+        json.dump(_output, sys.stdout, indent=4)
+
+if __name__ == "__main__":
+    main()
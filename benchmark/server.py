@@ -0,0 +1,231 @@
+"""
+server.py
+
+Local HTTP server simulating the latency, bandwidth and error rate of real sites.
+
+Routes:
+- /fixture/<file_name>       : a file from test/data
+- /listing/<records>         : benchmark.generators.listing_page(records)
+- /table/<rows>/<cols>       : benchmark.generators.spec_table(rows, cols), inside a HTML page
+
+Every setting can be overridden per request in the query string, e.g.
+    /listing/100?latency=0.2&bandwidth=100000&error_rate=0.1&content_type=text/html
+
+The server runs in a child process, so that it does not consume the CPU time or memory of the client being measured.
+
+Example:
+    with simulation_server(latency=0.05) as server:
+        extract(config, url=server.url("/listing/100"))
+"""
+
+import mimetypes
+import multiprocessing
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+from benchmark import generators
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test", "data")
+
+DEFAULT_SETTINGS = {
+    "latency": 0.,          # seconds before the response starts
+    "jitter": 0.,           # additional uniformly random latency, in seconds
+    "bandwidth": 0,         # bytes per second; 0 is unlimited
+    "error_rate": 0.,       # probability of responding 500
+    "content_type": None,   # overrides the Content-Type of all responses
+}
+
+class SimulationRouteNotFound(LookupError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+def get_content(
+    path:str,
+)->Tuple[bytes, str]:
+    """
+    Return (body, content_type) for a route.
+    """
+
+    _parts = [ _part for _part in path.split("/") if _part ]
+
+    if (len(_parts) == 2 and _parts[0] == "fixture"):
+        _file_path = os.path.join(FIXTURE_DIR, os.path.basename(_parts[1]))
+
+        if (not os.path.isfile(_file_path)):
+            return SimulationRouteNotFound(f"Fixture {_parts[1]} not found.")
+
+        with open(_file_path, "rb") as _fHnd:
+            _body = _fHnd.read()
+
+        _content_type, _ = mimetypes.guess_type(_file_path)
+        if (_content_type and _content_type.startswith("text/")):
+            _content_type += "; charset=utf-8"
+
+        return _body, (_content_type or "application/octet-stream")
+
+    elif (len(_parts) == 2 and _parts[0] == "listing"):
+        return generators.listing_page(int(_parts[1])).encode("utf-8"), "text/html; charset=utf-8"
+
+    elif (len(_parts) == 3 and _parts[0] == "table"):
+        _table = generators.spec_table(int(_parts[1]), int(_parts[2]))
+        return f"<html><body>{_table}</body></html>".encode("utf-8"), "text/html; charset=utf-8"
+
+    else:
+        return SimulationRouteNotFound(f"Route {path} not found.")
+
+
+class simulation_handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format:str, *args):
+        # Silence per request logging
+        pass
+
+    def get_settings(
+        self,
+        query:str,
+    )->Dict[str, Any]:
+        _settings = self.server.settings.copy()
+
+        for _key, _values in parse_qs(query).items():
+            if (_key in _settings and _values):
+                _type = type(DEFAULT_SETTINGS[_key]) if (DEFAULT_SETTINGS[_key] is not None) else str
+                _settings[_key] = _type(_values[-1])
+
+        return _settings
+
+    def send_body(
+        self,
+        status:int,
+        body:bytes,
+        content_type:str,
+        bandwidth:int=0,
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if (bandwidth > 0):
+            # Send in chunks of 1/20 second worth of data
+            _chunk_size = max(1, bandwidth // 20)
+            for _start in range(0, len(body), _chunk_size):
+                _chunk = body[_start:_start + _chunk_size]
+                self.wfile.write(_chunk)
+                self.wfile.flush()
+                time.sleep(len(_chunk) / bandwidth)
+        else:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        _url = urlparse(self.path)
+        _settings = self.get_settings(_url.query)
+
+        _latency = _settings["latency"] + random.uniform(0., _settings["jitter"])
+        if (_latency > 0):
+            time.sleep(_latency)
+
+        if (random.random() < _settings["error_rate"]):
+            return self.send_body(500, b"Simulated error", "text/plain; charset=utf-8")
+
+        _content = get_content(_url.path)
+
+        if (isinstance(_content, Exception)):
+            return self.send_body(404, str(_content).encode("utf-8"), "text/plain; charset=utf-8")
+
+        _body, _content_type = _content
+
+        return self.send_body(
+            200,
+            _body,
+            _settings["content_type"] or _content_type,
+            bandwidth=_settings["bandwidth"],
+        )
+
+
+def serve(
+    settings:dict,
+    port_queue:multiprocessing.Queue,
+    host:str="127.0.0.1",
+    port:int=0,
+    seed:int=None,
+):
+    """
+    Start a server and block forever; the bound port is put into port_queue.
+    """
+
+    random.seed(seed)
+
+    _server = ThreadingHTTPServer((host, port), simulation_handler)
+    _server.daemon_threads = True
+    _server.settings = settings
+
+    port_queue.put(_server.server_address[1])
+    _server.serve_forever()
+
+
+class simulation_server():
+    """
+    Context manager running serve() in a child process.
+    """
+
+    def __init__(
+        self,
+        host:str="127.0.0.1",
+        port:int=0,
+        seed:int=None,
+        **settings,
+    ):
+        _unknown = set(settings) - set(DEFAULT_SETTINGS)
+        if (_unknown):
+            raise ValueError(f"Unknown simulation settings: {', '.join(sorted(_unknown))}")
+
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.settings = { **DEFAULT_SETTINGS, **settings }
+        self.process = None
+
+    def start(self):
+        _port_queue = multiprocessing.Queue()
+
+        self.process = multiprocessing.Process(
+            target=serve,
+            args=(self.settings, _port_queue),
+            kwargs={ "host": self.host, "port": self.port, "seed": self.seed },
+            daemon=True,
+        )
+        self.process.start()
+        self.port = _port_queue.get(timeout=30)
+
+        return self
+
+    def stop(self):
+        if (self.process is not None):
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def url(
+        self,
+        path:str="/",
+        **settings:Union[int, float, str],
+    )->str:
+        """
+        Absolute URL of path on this server; settings are added as per request overrides.
+        """
+
+        _query = "&".join(f"{_key}={_value}" for _key, _value in settings.items())
+        return f"http://{self.host}:{self.port}/{path.lstrip('/')}" + (f"?{_query}" if _query else "")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,297 @@
+"""
+throughput.py
+
+End-to-end load harness, driving extract() against a local benchmark.server.simulation_server.
+
+Usage:
+    python -m benchmark.throughput [--scenario listing] [--concurrency 1,4,16] [--requests 100]
+                                   [--latency 0.05] [--jitter 0] [--bandwidth 0] [--error-rate 0]
+                                   [--content-type text/html] [--label release-x] [--output results.json]
+
+Results are emitted as JSON:
+{
+    "meta": {...},
+    "settings": {...},
+    "results": [
+        {
+            "scenario", "driver", "concurrency", "requests", "errors", "elapsed", "pages_per_sec",
+            "p50", "p99", "mean", "cpu", "cpu_per_page", "peak_rss"
+        },
+    ]
+}
+Latencies are in seconds per page; cpu is the CPU time of the client process in seconds; peak_rss is in bytes.
+peak_rss is the high-water mark of the whole client process, hence it never decreases between results.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import resource
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from extract_http.batch import iter_extract
+from extract_http.extract import extract
+
+from benchmark import generators
+from benchmark.micro import get_meta
+from benchmark.server import simulation_server
+
+# Each scenario is a path on the simulation_server and the configuration to extract it with.
+# "{url}" in the config is substituted with the absolute URL at runtime.
+SCENARIOS = {
+    "listing": {
+        "path": "/listing/100",
+        "config": {
+            "type": "html",
+            "url": "{url}",
+            "locate": generators.listing_locate(),
+        },
+    },
+    "table": {
+        "path": "/table/40/10",
+        "config": {
+            "type": "html",
+            "url": "{url}",
+            "locate": [
+                {
+                    "search_root": [ "table", ],
+                    "table": {
+                        "orient": "rows",
+                        "key_index": 0,
+                        "keys": {},
+                    },
+                },
+            ],
+        },
+    },
+    "intel_alderlake_table": {
+        "path": "/fixture/intel_alderlake_table.html",
+        "config": {
+            "type": "html",
+            "url": "{url}",
+            "locate": [
+                {
+                    "search_root": [ "table", ],
+                    "table": {
+                        "orient": "rows",
+                        "key_index": 0,
+                        "keys": {
+                            "CPU": "$innerText",
+                            "URL": "a$attr[href]",
+                        },
+                    },
+                },
+            ],
+        },
+    },
+    "erco_article_11130": {
+        "path": "/fixture/erco_article_11130.json",
+        "config": {
+            "type": "json",
+            "url": "{url}",
+        },
+    },
+    "ridi_sku_list_zug": {
+        "path": "/fixture/ridi_sku_list_zug.json",
+        "config": {
+            "type": "json",
+            "url": "{url}",
+            "transform": {
+                "description": {
+                    "source": "{Product} {Version}",
+                },
+            },
+        },
+    },
+}
+
+def percentile(
+    values:List[float],
+    q:float,
+)->float:
+    """
+    Nearest-rank percentile, q being within 0-100.
+    """
+    if (not values):
+        return None
+
+    _sorted = sorted(values)
+    _rank = max(1, math.ceil(q / 100 * len(_sorted)))
+    return _sorted[min(_rank, len(_sorted)) - 1]
+
+def get_peak_rss()->int:
+    """
+    Peak resident set size of this process in bytes.
+    """
+    _maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    return _maxrss if (sys.platform == "darwin") else _maxrss * 1024
+
+def timed_extract(
+    config:dict,
+    **kwargs,
+)->Dict[str, Any]:
+    """
+    Call extract(config, **kwargs), returning { "latency", "error" } instead of the extracted data.
+    """
+
+    _start = time.perf_counter()
+    try:
+        extract(config, **kwargs)
+        _error = None
+    except Exception as e:
+        _error = f"{type(e).__name__}: {e}"
+
+    return {
+        "latency": time.perf_counter() - _start,
+        "error": _error,
+    }
+
+def drive_extract(
+    config:dict,
+    jobs:List[dict],
+    concurrency:int,
+)->List[Dict[str, Any]]:
+    """
+    Call extract(config, **kwargs) for each kwargs in jobs, with concurrency threads.
+
+    Returns a list of { "latency", "error" }, one per job.
+    """
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda kwargs: timed_extract(config, **kwargs), jobs))
+
+def drive_iter_extract(
+    config:dict,
+    jobs:List[dict],
+    concurrency:int,
+)->List[Dict[str, Any]]:
+    """
+    Run jobs through extract_http.batch.iter_extract() with concurrency workers.
+
+    Returns a list of { "latency", "error" }, one per job.
+    """
+
+    return [
+        _outcome for _kwargs, _outcome in iter_extract(config, jobs, workers=concurrency, func=timed_extract)
+    ]
+
+# Ways of driving extraction; each is called as driver(config, jobs, concurrency).
+DRIVERS = {
+    "extract": drive_extract,
+    "iter_extract": drive_iter_extract,
+}
+
+def run_level(
+    driver:Callable[[dict, List[dict], int], List[Dict[str, Any]]],
+    config:dict,
+    jobs:List[dict],
+    concurrency:int,
+)->Dict[str, Any]:
+    _cpu_start = time.process_time()
+    _start = time.perf_counter()
+
+    _outcomes = driver(config, jobs, concurrency)
+
+    _elapsed = time.perf_counter() - _start
+    _cpu = time.process_time() - _cpu_start
+
+    _latencies = [ _outcome["latency"] for _outcome in _outcomes ]
+    _errors = [ _outcome["error"] for _outcome in _outcomes if _outcome["error"] ]
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(jobs),
+        "errors": len(_errors),
+        "elapsed": _elapsed,
+        "pages_per_sec": (len(jobs) - len(_errors)) / _elapsed if (_elapsed > 0) else None,
+        "p50": percentile(_latencies, 50),
+        "p99": percentile(_latencies, 99),
+        "mean": sum(_latencies) / len(_latencies) if (_latencies) else None,
+        "cpu": _cpu,
+        "cpu_per_page": _cpu / len(jobs) if (jobs) else None,
+        "peak_rss": get_peak_rss(),
+    }
+
+def run(
+    scenarios:List[str],
+    concurrency:List[int],
+    requests:int,
+    drivers:List[str]=None,
+    **settings,
+)->List[Dict[str, Any]]:
+    """
+    Start a simulation_server with settings, and run every driver and scenario at every level of concurrency.
+    """
+
+    _results = []
+
+    with simulation_server(seed=0, **settings) as _server:
+        for _scenario_name in scenarios:
+            _scenario = SCENARIOS[_scenario_name]
+            _jobs = [ { "url": _server.url(_scenario["path"]) } ] * requests
+
+            for _driver_name in (drivers or list(DRIVERS)):
+                for _concurrency in concurrency:
+                    _result = run_level(
+                        DRIVERS[_driver_name],
+                        _scenario["config"],
+                        _jobs,
+                        _concurrency,
+                    )
+
+                    _results.append({
+                        "scenario": _scenario_name,
+                        "driver": _driver_name,
+                        **_result,
+                    })
+
+    return _results
+
+def main(argv:List[str]=None):
+    _parser = argparse.ArgumentParser(description="End-to-end throughput harness for extract_http.")
+    _parser.add_argument("--scenario", type=str, default="listing", help=f"Comma separated scenarios out of: {', '.join(SCENARIOS)}.")
+    _parser.add_argument("--driver", type=str, default=None, help=f"Comma separated drivers out of: {', '.join(DRIVERS)}; all if not supplied.")
+    _parser.add_argument("--concurrency", type=str, default="1,4,16", help="Comma separated levels of concurrency.")
+    _parser.add_argument("--requests", type=int, default=100, help="Number of pages per level.")
+    _parser.add_argument("--latency", type=float, default=0.05, help="Server latency in seconds.")
+    _parser.add_argument("--jitter", type=float, default=0., help="Additional random server latency in seconds.")
+    _parser.add_argument("--bandwidth", type=int, default=0, help="Server bandwidth in bytes per second per request; 0 is unlimited.")
+    _parser.add_argument("--error-rate", type=float, default=0., help="Probability of the server responding 500.")
+    _parser.add_argument("--content-type", type=str, default=None, help="Override the Content-Type of all responses.")
+    _parser.add_argument("--label", type=str, default=None, help="Label to identify this run, e.g. release or backend.")
+    _parser.add_argument("--output", type=str, default=None, help="Path to write JSON results to; stdout if not supplied.")
+    _args = _parser.parse_args(argv)
+
+    _settings = {
+        "latency": _args.latency,
+        "jitter": _args.jitter,
+        "bandwidth": _args.bandwidth,
+        "error_rate": _args.error_rate,
+        "content_type": _args.content_type,
+    }
+
+    _output = {
+        "meta": get_meta(_args.label),
+        "settings": _settings,
+        "results": run(
+            scenarios=_args.scenario.split(","),
+            concurrency=[ int(_level) for _level in _args.concurrency.split(",") ],
+            requests=_args.requests,
+            drivers=_args.driver.split(",") if (_args.driver) else None,
+            **_settings,
+        ),
+    }
+
+    if (_args.output):
+        with open(_args.output, "w") as _fHnd:
+            json.dump(_output, _fHnd, indent=4)
+    else:
+        json.dump(_output, sys.stdout, indent=4)
+
+if __name__ == "__main__":
+    main()
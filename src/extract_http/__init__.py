@@ -1,8 +1,20 @@
+import extract_http.archive as archive
+import extract_http.batch as batch
 import extract_http.bin as bin
 import extract_http.exceptions as exceptions
+import extract_http.export as export
 import extract_http.extract as extract
+import extract_http.fetch as fetch
+import extract_http.files as files
 import extract_http.html_node as html_node
+import extract_http.instrument as instrument
+import extract_http.metrics as metrics
+import extract_http.numeric as numeric
+import extract_http.projection as projection
 import extract_http.record_dict as record_dict
+import extract_http.record_group as record_group
+import extract_http.sink as sink
 import extract_http.transform as transform
+import extract_http.work_queue as work_queue
 
 import extract_http.defaults as defaults
\ No newline at end of file
@@ -0,0 +1,568 @@
+"""
+archive.py
+
+Web archives as a source of documents, in place of fetching them: WARC files, plain or gzipped per record, and HAR files.
+
+- warc_archive  : index of url to record offset, with payloads read lazily by seeking to the record
+- har_archive   : the same over the entries of a HAR file, which is loaded whole
+- open_archive(): either of the above, depending on the file name
+- get_archive() : open_archive(), cached per path
+
+See extract_http.extract.iter_extract_archive() to apply configurations to all the matching records of an archive in one pass.
+"""
+
+import base64
+import json
+import os
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from extract_http.bin import document_bytes, sniff_encoding
+from extract_http.exceptions import HTTPRequestError
+from extract_http.fetch import decode_stream, FETCH_CHUNK_SIZE
+
+# WARC-Type of records that hold a payload
+WARC_PAYLOAD_TYPES = ("response", "resource")
+
+class ArchiveFormatInvalid(ValueError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class ArchiveRecordNotFound(KeyError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class archive_response():
+    """
+    A payload read from an archive, along with the HTTP status and headers it was served with.
+
+    offset is the position of the record in the archive file, or the entry index for HAR.
+    """
+
+    __slots__ = ("url", "status", "headers", "content", "offset")
+
+    def __init__(
+        self,
+        url:str,
+        status:int,
+        headers:CaseInsensitiveDict,
+        content:bytes,
+        offset:int=None,
+    ):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.offset = offset
+
+    def __repr__(self)->str:
+        return f"{type(self).__name__}({self.url!r}, status={self.status}, bytes={len(self.content)})"
+
+def normalise_url(
+    url:str,
+)->str:
+    """
+    url without its fragment, which is never sent to the server, and with "<" ">" from WARC 1.0 removed.
+    """
+
+    _url = url.strip().strip("<>")
+    _parts = urlsplit(_url)
+    return urlunsplit(_parts._replace(fragment=""))
+
+def parse_headers(
+    lines:List[bytes],
+)->CaseInsensitiveDict:
+    _headers = CaseInsensitiveDict()
+
+    for _line in lines:
+        _name, _sep, _value = _line.decode("latin-1").partition(":")
+        if (_sep):
+            _headers[_name.strip()] = _value.strip()
+
+    return _headers
+
+def dechunk(
+    body:bytes,
+)->bytes:
+    """
+    Body of a response sent with Transfer-Encoding: chunked, as archived; a truncated body is returned as far as it goes.
+    """
+
+    _chunks = []
+    _position = 0
+
+    while (True):
+        _end = body.find(b"\r\n", _position)
+        if (_end < 0):
+            break
+
+        try:
+            _size = int(body[_position:_end].split(b";")[0], 16)
+        except ValueError as e:
+            break
+
+        if (_size == 0):
+            break
+
+        _chunks.append(body[_end+2:_end+2+_size])
+        _position = _end + 2 + _size + 2
+
+    return b"".join(_chunks)
+
+def parse_http_response(
+    url:str,
+    block:bytes,
+    offset:int=None,
+)->archive_response:
+    """
+    archive_response of the block of a WARC "response" record, i.e. an HTTP response as received.
+    Transfer and content encodings are undone.
+    """
+
+    _head, _sep, _body = block.partition(b"\r\n\r\n")
+    if (not _sep):
+        _head, _sep, _body = block.partition(b"\n\n")
+
+    _lines = _head.splitlines()
+    _status_line = _lines[0].split(None, 2) if (_lines) else []
+
+    try:
+        _status = int(_status_line[1])
+    except (IndexError, ValueError) as e:
+        _exception = ArchiveFormatInvalid(f"Record of {url} does not hold an HTTP response.")
+        raise _exception
+
+    _headers = parse_headers(_lines[1:])
+
+    if ("chunked" in _headers.get("Transfer-Encoding", "").lower()):
+        _body = dechunk(_body)
+
+    if (_headers.get("Content-Encoding")):
+        try:
+            _body, _ = decode_stream([ _body, ], _headers["Content-Encoding"])
+        except Exception as e:
+            # Left as archived if it cannot be decoded
+            pass
+
+    return archive_response(url, _status, _headers, _body, offset)
+
+def get_document(
+    response:archive_response,
+    type:str="html",
+)->Any:
+    """
+    Document of response, as curl() would have returned it for an extraction of that type:
+    parsed JSON for "json", otherwise document_bytes in the declared or sniffed encoding.
+
+    Responses other than 200 are returned as HTTPRequestError.
+    """
+
+    if (response.status != 200):
+        return HTTPRequestError(
+            f"Generic HTTP Error {response.status}",
+            err_code=response.status,
+            headers=response.headers,
+            content=response.content,
+        )
+
+    if (type == "json"):
+        return json.loads(response.content)
+
+    _charset = None
+    for _param in response.headers.get("Content-Type", "").split(";")[1:]:
+        _name, _sep, _value = _param.partition("=")
+        if (_name.strip().lower() == "charset"):
+            _charset = _value.strip().strip("\"'")
+
+    return document_bytes(response.content, sniff_encoding(response.content, _charset))
+
+class base_archive():
+    """
+    Common interface of archives.
+
+    index is { url: [ offset, ] } of all the payloads, in the order they appear; get() returns the last one.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.index = None
+        self.lock = threading.Lock()
+
+    def build_index(self)->Dict[str, List[int]]:
+        raise NotImplementedError()
+
+    def get_index(self)->Dict[str, List[int]]:
+        with self.lock:
+            if (self.index is None):
+                self.index = self.build_index()
+
+            return self.index
+
+    def urls(self)->List[str]:
+        return list(self.get_index())
+
+    def read(self, offset:int, url:str=None)->archive_response:
+        raise NotImplementedError()
+
+    def get(
+        self,
+        url:str,
+    )->archive_response:
+        """
+        Latest payload of url; raises ArchiveRecordNotFound if there is none.
+        """
+
+        _offsets = self.get_index().get(normalise_url(url))
+
+        if (not _offsets):
+            _exception = ArchiveRecordNotFound(f"{url} is not in {self.path}.")
+            raise _exception
+
+        return self.read(_offsets[-1], url)
+
+    def iter_responses(
+        self,
+        want:Callable[[str], bool]=None,
+    )->Iterator[archive_response]:
+        """
+        Every payload in the archive in one sequential pass, in the order they appear.
+
+        If want is supplied, only payloads of urls for which want(url) is True are read; the others are skipped.
+        """
+
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class bytes_reader():
+    """
+    Minimal binary stream over bytes, with the readline(), read() and seek() that warc_archive.read_record() needs.
+    """
+
+    def __init__(self, data:bytes):
+        self.data = data
+        self.position = 0
+
+    def readline(self)->bytes:
+        _end = self.data.find(b"\n", self.position)
+        _end = len(self.data) if (_end < 0) else _end + 1
+        _line = self.data[self.position:_end]
+        self.position = _end
+        return _line
+
+    def read(self, size:int)->bytes:
+        _data = self.data[self.position:self.position+size]
+        self.position += len(_data)
+        return _data
+
+    def seek(self, offset:int, whence:int=os.SEEK_SET):
+        self.position = offset if (whence == os.SEEK_SET) else self.position + offset
+
+class warc_archive(base_archive):
+    """
+    A WARC file, either plain or gzipped; gzipped WARC files have each record in a gzip member of its own,
+    so that any record can be read by seeking to the start of its member.
+
+    Only "response" and "resource" records are indexed.
+    If index_path is supplied, the index is kept there as JSON, and only built from the WARC file if it does not exist yet.
+    """
+
+    def __init__(
+        self,
+        path:str,
+        index_path:str=None,
+    ):
+        super().__init__(path)
+        self.index_path = index_path
+
+        with open(path, "rb") as _fHnd:
+            self.compressed = _fHnd.read(2) == b"\x1f\x8b"
+
+    def build_index(self)->Dict[str, List[int]]:
+        if (self.index_path and os.path.exists(self.index_path)):
+            with open(self.index_path, "r", encoding="utf-8") as _fHnd:
+                return json.load(_fHnd)
+
+        _index = {}
+        for _offset, _headers, _ in self.iter_records(want=lambda url: False):
+            if (_headers.get("WARC-Type") in WARC_PAYLOAD_TYPES and _headers.get("WARC-Target-URI")):
+                _index.setdefault(normalise_url(_headers["WARC-Target-URI"]), []).append(_offset)
+
+        if (self.index_path):
+            with open(self.index_path, "w", encoding="utf-8") as _fHnd:
+                json.dump(_index, _fHnd)
+
+        return _index
+
+    def read_record(
+        self,
+        stream,
+        want:Callable[[str], bool]=None,
+    )->Tuple[CaseInsensitiveDict, bytes]:
+        """
+        (headers, block) of the next record in stream, or None at the end.
+
+        If want(url) is False for the url of the record, its block is skipped and returned as None.
+        """
+
+        _line = stream.readline()
+        while (_line in (b"\r\n", b"\n")):
+            _line = stream.readline()
+
+        if (not _line):
+            return None
+
+        if (not _line.startswith(b"WARC/")):
+            _exception = ArchiveFormatInvalid(f"Expected a WARC record in {self.path}, found {_line[:32]!r}.")
+            raise _exception
+
+        _lines = []
+        _line = stream.readline()
+        while (_line and _line not in (b"\r\n", b"\n")):
+            _lines.append(_line)
+            _line = stream.readline()
+
+        _headers = parse_headers(_lines)
+        _length = int(_headers.get("Content-Length", 0))
+
+        if (
+            _headers.get("WARC-Type") in WARC_PAYLOAD_TYPES and \
+            (want is None or want(normalise_url(_headers.get("WARC-Target-URI", ""))))
+        ):
+            _block = stream.read(_length)
+        else:
+            stream.seek(_length, os.SEEK_CUR)
+            _block = None
+
+        return _headers, _block
+
+    def iter_members(
+        self,
+        stream,
+        offset:int=0,
+    )->Iterator[Tuple[int, bytes_reader]]:
+        """
+        (offset, decompressed stream) of each gzip member of stream, starting at offset.
+        """
+
+        stream.seek(offset)
+        _offset = offset
+        _pending = b""
+
+        while (True):
+            _decompressor = zlib.decompressobj(wbits=31)
+            _start = _offset
+            _content = []
+
+            while (not _decompressor.eof):
+                _chunk = _pending or stream.read(FETCH_CHUNK_SIZE)
+                _pending = b""
+
+                if (not _chunk):
+                    break
+
+                _content.append(_decompressor.decompress(_chunk))
+                _offset += len(_chunk) - len(_decompressor.unused_data)
+                _pending = _decompressor.unused_data
+
+            if (not _decompressor.eof):
+                if (_offset > _start):
+                    _exception = ArchiveFormatInvalid(f"Truncated gzip member at {_start} in {self.path}.")
+                    raise _exception
+                return
+
+            yield _start, bytes_reader(b"".join(_content))
+
+    def iter_records(
+        self,
+        want:Callable[[str], bool]=None,
+        offset:int=0,
+        limit:int=None,
+    )->Iterator[Tuple[int, CaseInsensitiveDict, bytes]]:
+        """
+        (offset, headers, block) of each record from offset onwards, in one sequential pass; see read_record() for want.
+
+        limit is the maximum number of records, or gzip members, to read.
+        """
+
+        with open(self.path, "rb") as _fHnd:
+            _count = 0
+
+            if (self.compressed):
+                for _offset, _member in self.iter_members(_fHnd, offset):
+                    _record = self.read_record(_member, want)
+                    while (_record is not None):
+                        yield (_offset, ) + _record
+                        _record = self.read_record(_member, want)
+
+                    _count += 1
+                    if (limit is not None and _count >= limit):
+                        return
+            else:
+                _fHnd.seek(offset)
+
+                while (limit is None or _count < limit):
+                    _offset = _fHnd.tell()
+                    _record = self.read_record(_fHnd, want)
+
+                    if (_record is None):
+                        return
+
+                    yield (_offset, ) + _record
+                    _count += 1
+
+    def get_response(
+        self,
+        offset:int,
+        headers:CaseInsensitiveDict,
+        block:bytes,
+    )->archive_response:
+        _url = normalise_url(headers.get("WARC-Target-URI", ""))
+
+        if (headers.get("WARC-Type") == "resource"):
+            _headers = CaseInsensitiveDict({ "Content-Type": headers.get("Content-Type", "") })
+            return archive_response(_url, 200, _headers, block, offset)
+        else:
+            return parse_http_response(_url, block, offset)
+
+    def read(
+        self,
+        offset:int,
+        url:str=None,
+    )->archive_response:
+        """
+        Payload of the record at offset; with gzip members holding more than one record, the one of url.
+        """
+
+        _url = normalise_url(url) if (url) else None
+
+        for _offset, _headers, _block in self.iter_records(
+            want=lambda url: (_url is None or url == _url),
+            offset=offset,
+            limit=1,
+        ):
+            if (_block is not None):
+                return self.get_response(_offset, _headers, _block)
+
+        _exception = ArchiveRecordNotFound(f"No payload of {url} at {offset} in {self.path}.")
+        raise _exception
+
+    def iter_responses(
+        self,
+        want:Callable[[str], bool]=None,
+    )->Iterator[archive_response]:
+        for _offset, _headers, _block in self.iter_records(want=want):
+            if (_block is not None):
+                yield self.get_response(_offset, _headers, _block)
+
+class har_archive(base_archive):
+    """
+    A HAR file, as exported by browsers; offsets are entry indices.
+
+    JSON cannot be read in parts, so the whole file is loaded on first use.
+    """
+
+    def __init__(
+        self,
+        path:str,
+    ):
+        super().__init__(path)
+        self.entries = None
+
+    def get_entries(self)->List[dict]:
+        if (self.entries is None):
+            with open(self.path, "r", encoding="utf-8-sig") as _fHnd:
+                try:
+                    self.entries = json.load(_fHnd)["log"]["entries"]
+                except (ValueError, KeyError, TypeError) as e:
+                    _exception = ArchiveFormatInvalid(f"{self.path} is not a HAR file: {e}")
+                    raise _exception
+
+        return self.entries
+
+    def build_index(self)->Dict[str, List[int]]:
+        _index = {}
+        for _id, _entry in enumerate(self.get_entries()):
+            _index.setdefault(normalise_url(_entry["request"]["url"]), []).append(_id)
+
+        return _index
+
+    def read(
+        self,
+        offset:int,
+        url:str=None,
+    )->archive_response:
+        _entry = self.get_entries()[offset]
+        _response = _entry.get("response", {})
+        _content = _response.get("content", {})
+
+        _headers = CaseInsensitiveDict({ _header["name"]: _header["value"] for _header in _response.get("headers", []) })
+        if (_content.get("mimeType")):
+            _headers["Content-Type"] = _content["mimeType"]
+
+        _text = _content.get("text", "")
+        if (_content.get("encoding") == "base64"):
+            _body = base64.b64decode(_text)
+        else:
+            _body = _text.encode("utf-8")
+            # The text is already decoded, so its declared charset no longer applies
+            _headers["Content-Type"] = _headers.get("Content-Type", "").split(";")[0] + "; charset=utf-8"
+
+        return archive_response(
+            normalise_url(_entry["request"]["url"]),
+            _response.get("status", 0),
+            _headers,
+            _body,
+            offset,
+        )
+
+    def iter_responses(
+        self,
+        want:Callable[[str], bool]=None,
+    )->Iterator[archive_response]:
+        for _id, _entry in enumerate(self.get_entries()):
+            if (want is None or want(normalise_url(_entry["request"]["url"]))):
+                yield self.read(_id)
+
+def open_archive(
+    path:str,
+    **kwargs,
+)->base_archive:
+    """
+    har_archive for ".har" files, otherwise warc_archive.
+    """
+
+    if (path.lower().endswith(".har")):
+        return har_archive(path, **kwargs)
+    else:
+        return warc_archive(path, **kwargs)
+
+_ARCHIVES = {}
+_ARCHIVES_LOCK = threading.Lock()
+
+def get_archive(
+    path:str,
+)->base_archive:
+    """
+    open_archive() of path, kept open so that its index is only built once per process.
+    """
+
+    with _ARCHIVES_LOCK:
+        if (path not in _ARCHIVES):
+            _ARCHIVES[path] = open_archive(path)
+
+        return _ARCHIVES[path]
@@ -0,0 +1,375 @@
+"""
+batch.py
+
+Extraction of one configuration over many sets of kwargs.
+
+- iter_extract()  : generator yielding results as they complete, with a bounded number of jobs in flight
+- extract_batch() : iter_extract() written straight into a sink, see extract_http.sink
+- batch_journal   : on-disk journal of completed jobs, so that an interrupted extract_batch() can be resumed
+
+Only a bounded number of jobs are ever submitted ahead of the consumer,
+so if the consumer (e.g. a sink whose disk has fallen behind) stops taking results,
+fetching and parsing stop too, and memory stays flat regardless of the number of jobs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import json
+import os
+import time
+import warnings
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+from extract_http.extract import extract
+from extract_http.record_group import record_group
+from extract_http.sink import base_sink, json_default
+
+def iter_extract(
+    config:dict,
+    jobs:Iterable[dict],
+    workers:int=8,
+    prefetch:int=None,
+    func:Callable[..., Any]=extract,
+)->Iterator[Tuple[dict, Any]]:
+    """
+    Call func(config, **kwargs) for each kwargs in jobs, using workers threads.
+
+    Yields (kwargs, result) in order of completion.
+    Exceptions are not raised, but yielded in place of the result; all of them bool() as False.
+
+    prefetch is the maximum number of jobs submitted but not yet yielded; defaults to 2 * workers.
+    jobs is consumed lazily, so it can be a generator of any length.
+    """
+
+    if (prefetch is None):
+        prefetch = workers * 2
+
+    prefetch = max(prefetch, 1)
+
+    _jobs = iter(jobs)
+    _futures = {}
+
+    def _call(kwargs:dict):
+        try:
+            return func(config, **kwargs)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        _exhausted = False
+
+        while (True):
+            # Top up the jobs in flight
+            while (not _exhausted and len(_futures) < prefetch):
+                try:
+                    _kwargs = next(_jobs)
+                except StopIteration:
+                    _exhausted = True
+                    break
+
+                _futures[executor.submit(_call, _kwargs)] = _kwargs
+
+            if (not _futures):
+                return
+
+            _done, _ = wait(_futures, return_when=FIRST_COMPLETED)
+
+            for _future in _done:
+                _kwargs = _futures.pop(_future)
+                yield _kwargs, _future.result()
+
+def get_job_key(
+    kwargs:dict,
+)->str:
+    """
+    Identity of a job, being its kwargs as canonical JSON.
+    """
+
+    return json.dumps(kwargs, sort_keys=True, separators=(",", ":"), default=json_default, ensure_ascii=False)
+
+class batch_journal():
+    """
+    Append-only journal of the jobs of batch runs, one JSON line per run, and per completed or failed job:
+        { "status": "run", "time": timestamp }
+        { "status": "run", "time": timestamp, "records": first }
+        { "job": key, "status": "done", "records": [ first, count ] }
+        { "job": key, "status": "failed", "error": "..." }
+    records locates the output of the job in the sink: count records, starting from the first-th record of the sink, counted from 0
+    across all the runs appending to it. Positions carry on from the end of the last job in the journal;
+    if records were written after the last sync of an interrupted run, supply the actual number of records in the sink as records.
+
+    Entries are buffered in memory, and written and fsynced in batches of sync_every entries, or every sync_interval seconds,
+    whichever comes first. Before each batch is written, the sink is flushed to disk,
+    so that the journal never claims a job whose records may not have been written.
+    A job can be recorded as done while its records are not, if the process dies between the two;
+    on resume, it is extracted again, so its records may appear twice in the output.
+
+    The latest entry of a job wins; a partially written last line, e.g. after a crash, is ignored.
+    """
+
+    def __init__(
+        self,
+        path:str,
+        sync_every:int=1000,
+        sync_interval:float=5.,
+        records:int=None,
+    ):
+        """
+        records is the number of records already in the sink; defaults to the end of the last job in the journal.
+        """
+
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self.status = {}
+        self.runs = 0
+        self.records = 0
+        self.load()
+
+        if (records is not None):
+            self.records = records
+
+        self.buffer = []
+        self.last_sync = time.monotonic()
+        self.file = open(path, "ab")
+
+        # Terminate a partially written last line, so that it does not swallow the next entry
+        if (self.file.tell() > 0):
+            with open(path, "rb") as _fHnd:
+                _fHnd.seek(-1, os.SEEK_END)
+                if (_fHnd.read(1) != b"\n"):
+                    self.buffer.append(b"\n")
+
+    def load(self):
+        """
+        Read the status of all jobs from the journal, if it exists.
+        """
+
+        if (not os.path.exists(self.path)):
+            return
+
+        with open(self.path, "rb") as _fHnd:
+            for _line in _fHnd:
+                try:
+                    _entry = json.loads(_line)
+                except ValueError as e:
+                    # Partially written line
+                    continue
+
+                if (_entry.get("status", None) == "run"):
+                    self.runs += 1
+                    self.records = max(self.records, _entry.get("records", 0))
+                else:
+                    self.status[_entry["job"]] = _entry["status"]
+
+                    if (_entry["status"] == "done"):
+                        _first, _count = _entry["records"]
+                        self.records = max(self.records, _first + _count)
+
+    def is_done(
+        self,
+        kwargs:dict,
+    )->bool:
+        return self.status.get(get_job_key(kwargs), None) == "done"
+
+    def counts(self)->Dict[str, int]:
+        _counts = { "done": 0, "failed": 0, }
+        for _status in self.status.values():
+            _counts[_status] += 1
+        return _counts
+
+    def append(
+        self,
+        entry:dict,
+    ):
+        self.buffer.append(json.dumps(entry, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n")
+
+        if (entry.get("job", None) is not None):
+            self.status[entry["job"]] = entry["status"]
+
+    def start(self):
+        """
+        Mark the start of a run; the records of its jobs follow those already in the sink.
+        """
+
+        self.runs += 1
+        self.append({ "status": "run", "time": time.time(), "records": self.records })
+
+    def done(
+        self,
+        kwargs:dict,
+        count:int,
+    ):
+        """
+        Record a job whose count records have just been written, after all those before it.
+        """
+
+        self.append({ "job": get_job_key(kwargs), "status": "done", "records": [ self.records, count ] })
+        self.records += count
+
+    def failed(
+        self,
+        kwargs:dict,
+        error:Exception,
+    ):
+        self.append({ "job": get_job_key(kwargs), "status": "failed", "error": f"{type(error).__name__}: {error}" })
+
+    def is_due(self)->bool:
+        return (len(self.buffer) >= self.sync_every) or \
+            (self.buffer and (time.monotonic() - self.last_sync) >= self.sync_interval)
+
+    def sync(
+        self,
+        sink:base_sink=None,
+    ):
+        """
+        Flush sink to disk, then write and fsync all buffered entries.
+        """
+
+        if (sink is not None):
+            sink.flush()
+
+        if (self.buffer):
+            self.file.write(b"".join(self.buffer))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.buffer = []
+
+        self.last_sync = time.monotonic()
+
+    def close(
+        self,
+        sink:base_sink=None,
+    ):
+        if (self.file is not None):
+            self.sync(sink)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def get_records(
+    result:Any,
+    group:int=None,
+)->list:
+    """
+    List of records from the result of extract().
+
+    For HTML configurations, group is the index of the "locate" element to take the records from.
+    For JSON configurations, leave group as None.
+    """
+
+    if (group is not None):
+        result = result[group]
+
+    if (isinstance(result, record_group)):
+        return result.to_list()
+    elif (isinstance(result, dict)):
+        return [ result, ]
+    elif (isinstance(result, list)):
+        return result
+    else:
+        return [ result, ]
+
+def extract_batch(
+    config:dict,
+    jobs:Iterable[dict],
+    sink:base_sink,
+    group:int=None,
+    with_kwargs:bool=False,
+    workers:int=8,
+    prefetch:int=None,
+    func:Callable[..., Any]=extract,
+    journal:batch_journal=None,
+)->Dict[str, Union[int, list]]:
+    """
+    Extract config for each kwargs in jobs, and write the results into sink as they complete.
+
+    If group is None, one item is written per job:
+        { "kwargs": kwargs, "data": result }
+    Otherwise, each record in the locate group of that index is written separately;
+    with_kwargs adds the kwargs of the job to each record.
+
+    Failed jobs are not written. Returns
+        { "jobs": int, "records": int, "skipped": int, "errors": [ (kwargs, exception), ] }
+
+    If a batch_journal is supplied, jobs it has as done are skipped, and all other jobs, including failed ones, are extracted.
+    To resume an interrupted run, call this again with the same jobs and journal, and a sink opened with append=True.
+    """
+
+    _summary = {
+        "jobs": 0,
+        "records": 0,
+        "skipped": 0,
+        "errors": [],
+    }
+
+    if (journal is not None):
+        journal.start()
+
+        def _pending_jobs():
+            for _kwargs in jobs:
+                if (journal.is_done(_kwargs)):
+                    _summary["skipped"] += 1
+                else:
+                    yield _kwargs
+
+        _jobs = _pending_jobs()
+    else:
+        _jobs = jobs
+
+    _completed = False
+
+    try:
+        for _kwargs, _result in iter_extract(
+            config,
+            _jobs,
+            workers=workers,
+            prefetch=prefetch,
+            func=func,
+        ):
+            _summary["jobs"] += 1
+            _first = _summary["records"]
+
+            if (isinstance(_result, Exception)):
+                _summary["errors"].append((_kwargs, _result))
+
+                if (journal is not None):
+                    journal.failed(_kwargs, _result)
+            else:
+                if (group is None):
+                    sink.write({
+                        "kwargs": _kwargs,
+                        "data": _result,
+                    })
+                    _summary["records"] += 1
+                else:
+                    for _record in get_records(_result, group):
+                        sink.write({ **_kwargs, **_record } if with_kwargs else _record)
+                        _summary["records"] += 1
+
+                if (journal is not None):
+                    journal.done(_kwargs, _summary["records"] - _first)
+
+            if (journal is not None and journal.is_due()):
+                journal.sync(sink)
+
+        _completed = True
+    finally:
+        if (journal is not None):
+            if (_completed):
+                journal.sync(sink)
+            else:
+                # Keep what completed before the failure, without hiding the exception being raised
+                try:
+                    journal.sync(sink)
+                except Exception as e:
+                    warnings.warn(RuntimeWarning(f"Batch journal could not be synced: {type(e).__name__}: {e}"))
+
+    return _summary
@@ -5,36 +5,167 @@ Generic functions shared by more than one sub-modules.
 This is to avoid circular imports.
 """
 
-from typing import Any, Iterable, Union, List
+from typing import Any, Iterable, Iterator, Sequence, Union, List, Tuple
 
 import base64
+import codecs
+import itertools
 import json
+import os
+import re
 import string
 import cgi, requests
 from requests.exceptions import Timeout
 import bs4.element
 import yaml
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 from extract_http.exceptions import HTTPRequestTimedOut, \
                                     HTTPRequestUnknownError, \
                                     HTTPRequestError \
 
+from extract_http.fetch import fetch_response
+
+
+
+
+# Number of bytes at the start of a document that are scanned for its encoding
+SNIFF_LIMIT = 4096
+
+# Encodings that browsers treat as windows-1252; see https://encoding.spec.whatwg.org/
+_ENCODING_ALIASES = {
+    "ascii": "cp1252",
+    "latin-1": "cp1252",
+    "iso8859-1": "cp1252",
+}
+
+_BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+_META_CHARSET_PATTERN = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-z0-9_:.+-]+)""",
+    re.IGNORECASE,
+)
+
+_XML_ENCODING_PATTERN = re.compile(
+    rb"""^\s*<\?xml[^>]+encoding\s*=\s*["']([a-z0-9_:.+-]+)""",
+    re.IGNORECASE,
+)
+
+class document_bytes():
+    """
+    Raw bytes of a fetched document, along with the encoding they are in.
+
+    content is the bytes object as received, not a copy of it; parsers are given it as is,
+    so the document is never copied, nor decoded into a str of its own.
+    """
+
+    __slots__ = ("content", "encoding")
+
+    def __init__(
+        self,
+        content:bytes,
+        encoding:str=None,
+    ):
+        self.content = content
+        self.encoding = encoding
+
+    def __len__(self)->int:
+        return len(self.content)
+
+    def __bytes__(self)->bytes:
+        return self.content
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.content)} bytes, encoding={self.encoding!r})"
 
+    @property
+    def text(self)->str:
+        return str(self.content, self.encoding or "utf-8", "replace")
 
+def normalise_encoding(
+    encoding:Union[str, bytes],
+)->str:
+    """
+    Python codec name of encoding, or None if it is not a known encoding.
+    """
+
+    if (isinstance(encoding, bytes)):
+        encoding = encoding.decode("ascii", errors="ignore")
+
+    try:
+        _name = codecs.lookup(encoding.strip()).name
+    except (LookupError, AttributeError) as e:
+        return None
+
+    return _ENCODING_ALIASES.get(_name, _name)
+
+def sniff_encoding(
+    content:bytes,
+    declared:str=None,
+    limit:int=SNIFF_LIMIT,
+)->str:
+    """
+    Encoding of content, found in this order:
+    - byte order mark;
+    - declared, e.g. the charset of the Content-Type header;
+    - <meta charset> or <meta http-equiv="Content-Type"> within the first limit bytes;
+    - XML declaration;
+    - "utf-8" if the first limit bytes are valid UTF-8, otherwise "cp1252".
+
+    Only the first limit bytes are ever scanned.
+    """
+
+    for _mark, _encoding in _BYTE_ORDER_MARKS:
+        if (content.startswith(_mark)):
+            return _encoding
+
+    _encoding = normalise_encoding(declared) if (declared) else None
+    if (_encoding):
+        return _encoding
+
+    _head = content[:limit]
+
+    for _pattern in (_META_CHARSET_PATTERN, _XML_ENCODING_PATTERN):
+        _match = _pattern.search(_head)
+        if (_match):
+            _encoding = normalise_encoding(_match.group(1))
+            if (_encoding):
+                # A document that can be scanned for ASCII <meta> cannot be UTF-16
+                return "utf-8" if (_encoding.startswith("utf-16")) else _encoding
+
+    try:
+        # final=False: a character cut in half by limit is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(_head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        return "cp1252"
 
 def curl(
     url:str,
     params:dict=None,
     encode:str="base64",
+    as_bytes:bool=False,
 ):
     """
     Fetch url and return in the appropriate data type
+
+    If as_bytes is True, text is returned as document_bytes in its declared or sniffed encoding instead of str,
+    so that it is decoded only once by the parser; see sniff_encoding().
     """
 
     if (not isinstance(params, dict)): params = {}
 
     try:
-        r = requests.get(
+        # Identical requests in flight share a single response; see extract_http.fetch
+        r = fetch_response(
             url,
             params=params,
         )
@@ -69,7 +200,8 @@ def curl(
             elif (mimesubtype in ("x-httpd-php", \
                                   "xml", \
                                  )):
-                _return = r.text
+                _return = document_bytes(r.content, sniff_encoding(r.content, options.get("charset"))) \
+                          if (as_bytes) else r.text
 
             # application/*
             else:
@@ -81,7 +213,8 @@ def curl(
 
         elif (mimetype=="text"):
             # text/*
-            _return = r.text
+            _return = document_bytes(r.content, sniff_encoding(r.content, options.get("charset"))) \
+                      if (as_bytes) else r.text
 
         else:
             # bytes for everything else
@@ -157,6 +290,68 @@ def safe_generator(obj, repeat=True):
             yield GeneratorExhausted("Generator has no more values.", last_value=_last_value)
 
 
+def assemble_records(*args, repeat_last=False, counted:Iterable[Any]=())->Iterator[Tuple[Any]]:
+    """
+    Assemble rows out of columns of values, like itertools.zip_longest();
+    non-iterables (including str) are treated as a column of a single value.
+
+    Exhausted columns are filled with None, or their last value if repeat_last is True.
+
+    Assembly stops at the first row in which every value is either exhausted or falsy -
+    this is the behaviour of the original safe_zip(), which is kept for identical output.
+
+    Columns in counted take part in deciding the number of rows like the others, but are left out of the rows;
+    their values are only read where the other columns are all exhausted or falsy,
+    so a lazy Sequence only extracts those.
+
+    All column lengths are established upfront, so the rows are built by zip() directly,
+    without any per-row exceptions or intermediate lists.
+    """
+
+    _as_column = lambda obj: (
+        (obj if isinstance(obj, (list, tuple, Sequence)) else list(obj)) \
+            if (hasattr(obj, "__iter__") and not isinstance(obj, str)) else \
+        (obj, )
+    )
+
+    _columns = [ _as_column(_obj) for _obj in args ]
+    _lengths = [ len(_column) for _column in _columns ]
+
+    _counted_columns = [ _as_column(_obj) for _obj in counted ]
+    _counted_lengths = [ len(_column) for _column in _counted_columns ]
+
+    _height = max(_lengths + _counted_lengths, default=0)
+
+    # Find the first row with nothing but exhausted or falsy values.
+    _stop = _height
+    for _row_id in range(_height):
+        for _column, _length in zip(_columns + _counted_columns, _lengths + _counted_lengths):
+            if (_row_id < _length and _column[_row_id]):
+                break
+        else:
+            _stop = _row_id
+            break
+
+    if (not _columns):
+        # Only counted columns, so the rows are empty
+        return itertools.repeat((), _stop)
+
+    _padded_columns = [
+        (
+            _column if (_length >= _stop) else \
+            itertools.chain(
+                _column,
+                itertools.repeat(
+                    _column[-1] if (repeat_last and _length > 0) else None,
+                    _stop - _length,
+                ),
+            )
+        ) for _column, _length in zip(_columns, _lengths)
+    ]
+
+    return itertools.islice(zip(*_padded_columns), _stop)
+
+
 def safe_zip(*args, repeat_last=False)->Iterable[Any]:
     """
     Safe Zip is like zip(), but it will not complain even
@@ -167,16 +362,10 @@ def safe_zip(*args, repeat_last=False)->Iterable[Any]:
         contain NoneTypes - we are web scrapping and
         there are pages that we inevitably will not find
         the tags we want.
+
+    Kept for backwards compatibility; this is now assemble_records().
     """
-    _generators = [safe_generator(obj) for obj in args]
-    while (True):
-        _return = [next(_generator) for _generator in _generators]
-        if (any(_return)):
-            yield tuple([ (_item if (not isinstance(_item, GeneratorExhausted)) else \
-                            ( _item.last_value if repeat_last else None )) \
-                 for _item in _return])
-        else:
-            return
+    return assemble_records(*args, repeat_last=repeat_last)
 
 
 def find_all_nodes(
@@ -226,24 +415,40 @@ def find_all_nodes(
 
     return _parent_nodes
 
+# Known string Trues and Falses, in lower case.
+BOOL_TRUTHS = (
+    "yes",
+    "true",
+    "y",
+    "ja",
+    "sí",
+    "oui",
+    "si",
+    "evet",
+    "sim",
+    "tak",
+    "ya",
+    "да",
+    "是",
+)
+
+BOOL_FALSEHOODS = (
+    "no",
+    "false",
+    "n",
+    "nein",
+    "non",
+    "hayır",
+    "não",
+    "nie",
+    "tidak",
+    "нет",
+    "否",
+)
+
 def text_to_bool(
     text:str
     )->bool:
-    _truth = (
-        "yes",
-        "true",
-        "y",
-        "ja",
-        "sí",
-        "oui",
-        "si",
-        "evet",
-        "sim",
-        "tak",
-        "ya",
-        "да",
-        "是",
-    )
     """
     Convert some known string Trues into bools.
     
@@ -254,4 +459,32 @@ def text_to_bool(
     if (text.isnumeric()):
         return float(text)>0
     else:
-        return text.strip().lower() in _truth
\ No newline at end of file
+        return text.strip().lower() in BOOL_TRUTHS
+
+def is_bool_text(
+    text:str
+    )->bool:
+    """
+    Whether text is one of the known string Trues or Falses; string numbers are not considered bools.
+    """
+    return isinstance(text, str) and text.strip().lower() in (BOOL_TRUTHS + BOOL_FALSEHOODS)
+
+def get_rss()->int:
+    """
+    Resident set size of this process in bytes, or None where it cannot be read.
+
+    Read from /proc/self/statm where available; otherwise the peak RSS from resource.getrusage(), which can only grow.
+    """
+
+    try:
+        with open("/proc/self/statm", "r") as _fHnd:
+            return int(_fHnd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError) as e:
+        pass
+
+    if (resource is not None):
+        _maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return _maxrss if (os.uname().sysname == "Darwin") else _maxrss * 1024
+
+    return None
@@ -0,0 +1,423 @@
+"""
+export.py
+
+Columnar export of locate group output, without building DataFrames from lists of dicts.
+
+Column dtypes are taken from the "type" transformations of the group where available, e.g.
+    "transform": { "Weight": { "type": "float" } }
+results in a float64 column for "Weight".
+
+- to_numpy()    : NumPy structured array
+- to_arrow()    : pyarrow RecordBatch
+- from_dataframe() : pyarrow Table from a typed DataFrame, e.g. from html_table.export_typed()
+- arrow_writer  : incremental Parquet or Feather file writer, one record batch per locate group output
+
+pyarrow is an optional dependency; install with
+    pip install extract_http[arrow]
+"""
+
+from typing import Any, Dict, Iterable, List, Union
+import warnings
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    import pyarrow.types
+except ImportError:
+    pyarrow = None
+
+from extract_http.record_dict import record_dict
+from extract_http.record_group import record_group, MISSING
+
+from extract_http.defaults import RECORD_DICT_DELIMITER
+
+EXPORT_FORMATS = ("parquet", "feather")
+
+class ExportDependencyMissing(ImportError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class ExportFormatInvalid(ValueError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+def require_pyarrow():
+    if (pyarrow is None):
+        _exception = ExportDependencyMissing("pyarrow is required for Arrow, Parquet and Feather export; install extract_http[arrow].")
+        raise _exception
+
+
+def get_type_hints(
+    config:dict,
+)->Dict[str, str]:
+    """
+    Return { key: type } for all keys in config["transform"] with a "type".
+
+    config can be either a "locate" group for HTML, or the full configuration dictionary for JSON.
+    """
+
+    _transform = config.get("transform", None) or {}
+
+    return {
+        _key: _settings["type"] for _key, _settings in _transform.items() \
+            if (isinstance(_settings, dict) and _settings.get("type", None))
+    }
+
+def get_columns(
+    group:Union[record_group, List[dict]],
+    columns:List[str]=None,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->Dict[str, List[Any]]:
+    """
+    Return { column: values } from the output of a single locate group.
+
+    columns are Key Strings; if not supplied, all top level keys are used in order of first appearance.
+    Keys absent from a record are returned as None.
+    """
+
+    if (isinstance(group, record_group)):
+        if (columns is None):
+            columns = list(group.keys)
+
+        _columns = {}
+        for _column in columns:
+            if (_column in group.keys):
+                _values = group.column(_column)
+                _columns[_column] = [ (None if (_value is MISSING) else _value) for _value in _values ]
+            else:
+                _columns[_column] = group.get(_column, None, delimiter=delimiter)
+
+        return _columns
+
+    if (isinstance(group, dict)):
+        group = [ group, ]
+
+    if (columns is None):
+        _keys = {}
+        for _record in group:
+            for _key in _record:
+                _keys.setdefault(_key, None)
+        columns = list(_keys)
+
+    _columns = {}
+    for _column in columns:
+        if (delimiter in _column):
+            _columns[_column] = [
+                record_dict(_record).get(_column, None, delimiter=delimiter) for _record in group
+            ]
+        else:
+            _columns[_column] = [ _record.get(_column, None) for _record in group ]
+
+    return _columns
+
+
+def get_numpy_column(
+    values:List[Any],
+    type:str=None,
+)->np.ndarray:
+    """
+    Convert a list of values into a 1-dimensional array according to a transform "type".
+
+    int and float columns use NaN for None; an int column containing None becomes float64.
+    str and bytes columns use "" and b"" for None.
+    Columns that fail to convert, or have no type, are inferred by NumPy, falling back to object.
+    """
+
+    _has_none = any(_value is None for _value in values)
+
+    try:
+        if (type == "int"):
+            if (_has_none):
+                return np.array([ (np.nan if (_value is None) else _value) for _value in values ], dtype=np.float64)
+            else:
+                return np.array(values, dtype=np.int64)
+        elif (type == "float"):
+            return np.array([ (np.nan if (_value is None) else _value) for _value in values ], dtype=np.float64)
+        elif (type == "bool" and not _has_none):
+            return np.array(values, dtype=np.bool_)
+        elif (type == "str"):
+            return np.array([ ("" if (_value is None) else str(_value)) for _value in values ], dtype=np.str_)
+        elif (type == "bytes"):
+            return np.array([ (b"" if (_value is None) else _value) for _value in values ], dtype=np.bytes_)
+    except (ValueError, TypeError) as e:
+        # e.g. a "type" transformation failed and left the text unconverted
+        pass
+
+    try:
+        _array = np.array(values)
+        if (_array.ndim == 1 and _array.dtype.kind in "biufUS"):
+            return _array
+    except (ValueError, TypeError) as e:
+        pass
+
+    _array = np.empty(len(values), dtype=np.object_)
+    _array[:] = values
+    return _array
+
+def to_numpy(
+    group:Union[record_group, List[dict]],
+    config:dict=None,
+    types:Dict[str, str]=None,
+    columns:List[str]=None,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->np.ndarray:
+    """
+    Convert the output of a locate group into a NumPy structured array, with one field per column.
+
+    Column types are taken from types if supplied, otherwise from the "transform" of config.
+    """
+
+    _types = types if (types is not None) else get_type_hints(config or {})
+    _columns = get_columns(group, columns=columns, delimiter=delimiter)
+
+    _arrays = {
+        _column: get_numpy_column(_values, _types.get(_column, None)) \
+            for _column, _values in _columns.items()
+    }
+
+    _length = len(next(iter(_arrays.values()))) if (_arrays) else 0
+
+    _structured = np.empty(
+        _length,
+        dtype=[ (_column, _array.dtype) for _column, _array in _arrays.items() ],
+    )
+
+    for _column, _array in _arrays.items():
+        _structured[_column] = _array
+
+    return _structured
+
+
+def get_arrow_type(
+    type:str,
+):
+    require_pyarrow()
+
+    return {
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "bool": pyarrow.bool_(),
+        "str": pyarrow.string(),
+        "bytes": pyarrow.binary(),
+    }.get(type, None)
+
+def get_arrow_column(
+    values:List[Any],
+    type:Union[str, "pyarrow.DataType"]=None,
+)->"pyarrow.Array":
+    """
+    Convert a list of values into a pyarrow Array according to a transform "type", or a pyarrow DataType.
+
+    If conversion to the requested type fails, the type is inferred by pyarrow instead;
+    failing that, all values are converted to str.
+    """
+
+    require_pyarrow()
+
+    _type = get_arrow_type(type) if (isinstance(type, str) or type is None) else type
+
+    if (_type is not None):
+        try:
+            return pyarrow.array(values, type=_type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError) as e:
+            pass
+
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError) as e:
+        return pyarrow.array([ (None if (_value is None) else str(_value)) for _value in values ], type=pyarrow.string())
+
+def conform_arrow_column(
+    values:List[Any],
+    type:"pyarrow.DataType",
+)->"pyarrow.Array":
+    """
+    Convert a list of values into a pyarrow Array of exactly the DataType type.
+
+    Values are cast if necessary; for string columns, values that cannot be cast are converted to str.
+    """
+
+    require_pyarrow()
+
+    try:
+        return pyarrow.array(values, type=type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError) as e:
+        pass
+
+    try:
+        return pyarrow.array(values).cast(type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, pyarrow.ArrowNotImplementedError, TypeError, ValueError) as e:
+        if (pyarrow.types.is_string(type)):
+            return pyarrow.array([ (None if (_value is None) else str(_value)) for _value in values ], type=type)
+        else:
+            raise e
+
+def to_arrow(
+    group:Union[record_group, List[dict]],
+    config:dict=None,
+    types:Dict[str, str]=None,
+    columns:List[str]=None,
+    schema:"pyarrow.Schema"=None,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->"pyarrow.RecordBatch":
+    """
+    Convert the output of a locate group into a pyarrow RecordBatch.
+
+    If schema is supplied, the batch will conform to it: missing columns are filled with nulls, and extra columns dropped.
+    Otherwise column types are taken from types if supplied, or from the "transform" of config.
+    """
+
+    require_pyarrow()
+
+    _types = types if (types is not None) else get_type_hints(config or {})
+
+    if (schema is not None):
+        _columns = get_columns(group, columns=schema.names, delimiter=delimiter)
+
+        return pyarrow.RecordBatch.from_arrays(
+            [
+                conform_arrow_column(_columns[_field.name], _field.type) for _field in schema
+            ],
+            schema=schema,
+        )
+
+    _columns = get_columns(group, columns=columns, delimiter=delimiter)
+
+    return pyarrow.RecordBatch.from_arrays(
+        [
+            get_arrow_column(_values, _types.get(_column, None)) for _column, _values in _columns.items()
+        ],
+        names=list(_columns),
+    )
+
+def from_dataframe(
+    dataframe:"pd.DataFrame",
+)->"pyarrow.Table":
+    """
+    Convert a DataFrame into a pyarrow Table, keeping its dtypes;
+    nullable integers and booleans become nullable Arrow columns, and categoricals become dictionary columns.
+    """
+
+    require_pyarrow()
+
+    return pyarrow.Table.from_pandas(dataframe, preserve_index=False)
+
+
+class arrow_writer():
+    """
+    Write the output of locate groups incrementally into a Parquet or Feather file.
+
+    The schema is determined by the first group written, unless supplied;
+    all subsequent groups are conformed to it.
+
+    Example:
+        with arrow_writer("output.parquet", config=config["locate"][1]) as _writer:
+            for _art_no in art_nos:
+                _writer.write(extract(config, art_no=_art_no)[1])
+    """
+
+    def __init__(
+        self,
+        path:str,
+        format:str=None,
+        config:dict=None,
+        types:Dict[str, str]=None,
+        columns:List[str]=None,
+        schema:"pyarrow.Schema"=None,
+        delimiter:str=RECORD_DICT_DELIMITER,
+        **options,
+    ):
+        """
+        format is one of "parquet" or "feather"; if not supplied, it is determined by the extension of path.
+        options are passed to pyarrow.parquet.ParquetWriter or pyarrow.ipc.new_file, e.g. compression="zstd".
+        """
+
+        require_pyarrow()
+
+        if (format is None):
+            format = "feather" if (str(path).lower().endswith((".feather", ".arrow", ".ipc"))) else "parquet"
+
+        if (format not in EXPORT_FORMATS):
+            _exception = ExportFormatInvalid(f"Format '{format}' is not one of {', '.join(EXPORT_FORMATS)}.")
+            raise _exception
+
+        self.path = path
+        self.format = format
+        self.types = types if (types is not None) else get_type_hints(config or {})
+        self.columns = columns
+        self.schema = schema
+        self.delimiter = delimiter
+        self.options = options
+
+        self.writer = None
+        self.rows = 0
+
+    def open(
+        self,
+        schema:"pyarrow.Schema",
+    ):
+        self.schema = schema
+
+        if (self.format == "parquet"):
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, schema, **self.options)
+        else:
+            self.writer = pyarrow.ipc.new_file(self.path, schema, **({ "options": pyarrow.ipc.IpcWriteOptions(**self.options) } if self.options else {}))
+
+    def write(
+        self,
+        group:Union[record_group, List[dict]],
+    )->int:
+        """
+        Append the output of a locate group; returns the number of records written.
+        """
+
+        if (isinstance(group, Exception)):
+            warnings.warn(RuntimeWarning(f"Skipping failed extraction: {group}"))
+            return 0
+
+        if (self.schema is None):
+            _batch = to_arrow(
+                group,
+                types=self.types,
+                columns=self.columns,
+                delimiter=self.delimiter,
+            )
+        else:
+            _batch = to_arrow(
+                group,
+                schema=self.schema,
+                delimiter=self.delimiter,
+            )
+
+        # Do not let an empty first group decide the schema
+        if (self.writer is None):
+            if (_batch.num_rows <= 0 and self.schema is None):
+                return 0
+
+            self.open(_batch.schema)
+
+        if (_batch.num_rows > 0):
+            if (self.format == "parquet"):
+                self.writer.write_table(pyarrow.Table.from_batches([ _batch, ]))
+            else:
+                self.writer.write_batch(_batch)
+
+        self.rows += _batch.num_rows
+        return _batch.num_rows
+
+    def close(self):
+        if (self.writer is not None):
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -4,9 +4,21 @@ extract.py
 The main Extraction sub-module.
 """
 
-from bs4 import BeautifulSoup
+import copy
+import re
+import string
+from typing import Any, Dict, Iterator, List, Tuple, Union
 
-from extract_http.bin import curl
+from bs4 import BeautifulSoup
+import requests
+
+from extract_http.archive import base_archive, \
+                                get_archive, \
+                                get_document, \
+                                open_archive
+from extract_http.bin import curl, \
+                            document_bytes, \
+                            sniff_encoding
 from extract_http.exceptions import FileIOError, \
                                     HTMLParseError, \
                                     ConfigIncomplete
@@ -15,7 +27,15 @@ from extract_http.html_node import  find_all_nodes, \
                                     get_value_lists, \
                                     get_value_records, \
                                     get_value_table
-from extract_http.transform import  transform_record
+from extract_http.transform import  transform_record, \
+                                    count_transform_errors
+from extract_http.projection import project_config, \
+                                   project_data
+from extract_http.record_group import record_group
+from extract_http.instrument import stage, \
+                                    detail, \
+                                    label, \
+                                    enabled
 
 from extract_http.defaults import RECORD_DICT_DELIMITER
 
@@ -29,64 +49,213 @@ def do_locate_html(
     """
     Take the "locate" key of the config dictionary,
     and do the relevant actions, most notably looking for html tags as specified in "search_root".
+
+    The tree is torn down before returning, see teardown_soup(); the values returned are plain and do not reference it.
     """
 
-    _data = []
+    _soup = parse_html(html)
 
     try:
-        _soup = BeautifulSoup(html, "html.parser")
-    except Exception as e:
-        _exception = HTMLParseError(str(e), html=html)
-        raise _exception
-        return _exception
-    
-    for _locate_group in locate:
-        _nodes = find_all_nodes(
-            _locate_group.get("search_root", None),
-            _soup
-        )
-        
-        _values = _locate_group.get("values", None)
-        _array = _locate_group.get("array", None) or _locate_group.get("record", None)
-        _lists = _locate_group.get("lists", None)
-        _table = _locate_group.get("table", None)
-
-        _transform = _locate_group.get("transform", {})
-
-        if (_values):
-            _data_group = get_value_records(
-                _values,
-                _nodes,
-            )
-        elif (_lists):
-            _data_group = [ get_value_lists(
-                _lists,
-                _nodes,
-            ), ]
-        elif (_array):
-            _data_group = get_value_array(
-                _array["key"],
-                _array["value"],
-                _nodes,
-            )
-        elif (_table):
-            _data_group = get_value_table(
-                _table,
-                _nodes,
-            )
-
-        _data_group = do_transform(
-            _transform,
-            _data_group,
+        return do_locate_soup(
+            locate,
+            _soup,
             url=url,
             delimiter=delimiter,
         )
-        
-        _data.append(_data_group)
+    finally:
+        teardown_soup(_soup)
+
+def parse_html(
+    html:Union[str, bytes],
+)->BeautifulSoup:
+    """
+    Parse html into a BeautifulSoup tree.
+
+    document_bytes are decoded by the parser in their known encoding, without detection.
+    """
+
+    with stage("parse") as _stage:
+        try:
+            if (isinstance(html, document_bytes)):
+                _soup = BeautifulSoup(html.content, "html.parser", from_encoding=html.encoding)
+            else:
+                _soup = BeautifulSoup(html, "html.parser")
+        except Exception as e:
+            _exception = HTMLParseError(str(e), html=html)
+            raise _exception
+            return _exception
+
+        _stage.add(count=1, nbytes=len(html))
+
+    return _soup
+
+def teardown_soup(
+    soup:BeautifulSoup,
+):
+    """
+    Break up a parsed tree, so that it is freed as soon as the last reference to it is dropped.
+
+    Every element of a tree references its parent, siblings and neighbours, so a tree left as is can only be freed by
+    the cyclic garbage collector, which holds on to it until its next full collection and pauses for longer the larger
+    the tree. BeautifulSoup.decompose() does not reach past the root of a whole document, so the chain of elements is
+    walked here instead. None of the elements can be used afterwards.
+    """
+
+    with stage("teardown") as _stage:
+        _element = soup.contents[0] if (soup.contents) else None
+        _count = 0
+
+        while (_element is not None):
+            _next = _element.next_element
+            _element.__dict__.clear()
+            _element = _next
+            _count += 1
+
+        if (getattr(soup, "builder", None) is not None):
+            soup.builder.soup = None
+
+        soup.__dict__.clear()
+        soup.contents = []
+
+        _stage.add(count=_count)
+
+def do_locate_soup(
+    locate:dict,
+    soup:BeautifulSoup,
+    url:str=None,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->list:
+    """
+    Same as do_locate_html(), but on an already parsed tree.
+
+    soup is only read, so the same tree can be located by any number of configurations.
+    """
+
+    _data = []
+    _soup = soup
+
+    for _group_id, _locate_group in enumerate(locate):
+        _path = f"locate[{_group_id}]"
+
+        # Pruned by extract_http.projection.project_config()
+        if (_locate_group is None):
+            _data.append([])
+            continue
+
+        with label(group=_group_id, path=_path):
+            with stage("find_all_nodes") as _stage, detail("find_all_nodes", "search_root"):
+                _nodes = find_all_nodes(
+                    _locate_group.get("search_root", None),
+                    _soup
+                )
+                _stage.add(count=len(_nodes))
+            
+            _values = _locate_group.get("values", None)
+            # Selectors pruned by extract_http.projection.project_config(), that still decide the number of records
+            _counted = _locate_group.get("counted", None)
+            _array = _locate_group.get("array", None) or _locate_group.get("record", None)
+            _lists = _locate_group.get("lists", None)
+            _table = _locate_group.get("table", None)
+
+            _transform = _locate_group.get("transform", {})
+
+            if (_values or _counted):
+                with stage("get_value_records") as _stage, label(path=_path + ".values"):
+                    _data_group = get_value_records(
+                        _values or {},
+                        _nodes,
+                        counted=_counted,
+                    )
+                    _stage.add(count=len(_data_group))
+            elif (_lists is not None):
+                with stage("get_value_lists") as _stage, label(path=_path + ".lists"):
+                    _data_group = [ get_value_lists(
+                        _lists,
+                        _nodes,
+                    ), ]
+                    _stage.add(count=len(_data_group))
+            elif (_array):
+                with stage("get_value_array") as _stage, label(path=_path + ".array"):
+                    _data_group = get_value_array(
+                        _array["key"],
+                        _array["value"],
+                        _nodes,
+                    )
+                    _stage.add(count=len(_data_group))
+            elif (_table):
+                with stage("get_value_table") as _stage, detail("get_value_table", "table"):
+                    _data_group = get_value_table(
+                        _table,
+                        _nodes,
+                    )
+                    _stage.add(count=len(_data_group))
+
+            _fields = _locate_group.get("fields", None)
+            _compact = _locate_group.get("compact", None)
+
+            # Typed tables, i.e. DataFrames and Arrow tables, are already columnar and are not compacted
+            if (_compact and isinstance(_data_group, list)):
+                # Opt-in compact representation of the records; see record_group.
+                # Each record is transformed and compacted into a row in turn, so that only one of them is ever a full record_dict.
+                with label(path=_path + ".transform"):
+                    _records = iter_transform(
+                        _transform,
+                        _data_group,
+                        url=url,
+                        delimiter=delimiter,
+                    )
+
+                    if (_fields is not None):
+                        _records = (project_data(_record, _fields, delimiter=delimiter) for _record in _records)
+
+                    _data_group = record_group.from_records(
+                        _records,
+                        layout=_compact,
+                    )
+            else:
+                with label(path=_path + ".transform"):
+                    _data_group = do_transform(
+                        _transform,
+                        _data_group,
+                        url=url,
+                        delimiter=delimiter,
+                    )
+
+                if (_fields is not None):
+                    _data_group = project_data(
+                        _data_group,
+                        _fields,
+                        delimiter=delimiter,
+                    )
+            
+            _data.append(_data_group)
 
     return _data
     
 
+def iter_transform(
+    transform:dict,
+    data:list,
+    url:str=None,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->Iterator[Any]:
+    """
+    do_transform() of each item of data, yielded one at a time.
+
+    Each item is released from data as it is taken, so that data is emptied as the results are consumed.
+    """
+
+    for _id in range(len(data)):
+        _obj = data[_id]
+        data[_id] = None
+
+        yield do_transform(
+            transform,
+            _obj,
+            url=url,
+            delimiter=delimiter,
+        )
+
 def do_transform(
     transform:dict,
     data:list,
@@ -110,36 +279,35 @@ def do_transform(
                 delimiter=delimiter,
             )
     elif (isinstance(data, dict)):
-        data = transform_record(
-            transform,
-            data,
-            url=url,
-            delimiter=delimiter,
-        )
+        with stage("transform_record") as _stage:
+            data = transform_record(
+                transform,
+                data,
+                url=url,
+                delimiter=delimiter,
+            )
+            _stage.add(
+                count=1,
+                errors=count_transform_errors(transform, data, delimiter) if (enabled()) else 0,
+            )
 
     return data
 
 
-def do_extract_html(
+def get_fetch_settings(
     config:dict,
     **kwargs,
-    )->str:
+)->dict:
     """
-    Perform extraction from a full configuration dictionary,
-    provided that the source is a HTML.
+    Return { "type", "url", "file", "archive", "params", "bytes" } of config, formatted with kwargs.
 
-    There are two ways to use this:
-    - call this with a config["type"] == "html", then it will fetch the source via curl(); or
-    - call this with a config["file"] containing a local file name, then the file will be open and read as the HTML input.
+    Default parameters in config["params"] are substituted with kwargs of the same names.
+    "bytes" only applies to HTML.
     """
-    
-    _type = config.get("type", "").format(**kwargs)
-    _url = config.get("url", "").format(**kwargs)
-    _file = config.get("file", "").format(**kwargs)
+
     _params = config.get("params", {})
-    _locate = config.get("locate", {})
 
-    # Type checking parameters input
+    # Type checking parameters input
     if (not (isinstance(_params, dict))):
         _params = {}
     else:
@@ -150,36 +318,136 @@ def do_extract_html(
         if (_param in kwargs):
             _params[_param] = kwargs[_param]
 
-    if (not (_type and (_url or _file) and _locate)):
-        _exception = ConfigIncomplete("HTML Extraction missing configurations. Type, URL and Locate needs to be supplied.")
-        raise _exception
-        return _exception
+    _type = config.get("type", "").format(**kwargs)
+
+    return {
+        "type": _type,
+        "url": config.get("url", "").format(**kwargs),
+        "file": config.get("file", "").format(**kwargs),
+        "archive": config.get("archive", "").format(**kwargs),
+        "params": _params,
+        "bytes": _type == "html" and bool(config.get("bytes", False)),
+    }
 
-    if (_file):
+def get_fetch_key(
+    settings:dict,
+)->tuple:
+    """
+    Hashable identity of the source described by settings; settings with the same key fetch the same document.
+    """
+
+    if (settings["file"]):
+        return ("file", settings["file"], settings.get("bytes", False))
+    else:
+        return (
+            "archive:" + settings["archive"] if (settings.get("archive")) else "url",
+            settings["url"],
+            tuple(sorted((str(_param), str(_value)) for _param, _value in settings["params"].items())),
+            settings.get("bytes", False),
+        )
+
+def get_request_url(
+    url:str,
+    params:dict=None,
+)->str:
+    """
+    url with params added to its query string, as it would be requested.
+    """
+
+    if (params):
+        return requests.Request("GET", url, params=params).prepare().url
+    else:
+        return url
+
+def fetch(
+    settings:dict,
+):
+    """
+    Fetch the source described by settings from get_fetch_settings().
+
+    Local files are read as text; urls are read from the archive if supplied, see extract_http.archive,
+    and fetched via curl() otherwise.
+    If settings["bytes"] is True, text is returned as document_bytes instead; see extract_http.bin.sniff_encoding().
+    Failures are returned, not raised.
+    """
+
+    _as_bytes = settings.get("bytes", False)
+
+    if (settings["file"]):
         try:
-            with open(_file, "r") as _fHnd:
-                _result = _fHnd.read()
+            if (_as_bytes):
+                with open(settings["file"], "rb") as _fHnd:
+                    _content = _fHnd.read()
+                _result = document_bytes(_content, sniff_encoding(_content))
+            else:
+                with open(settings["file"], "r") as _fHnd:
+                    _result = _fHnd.read()
         except Exception as e:
             _result = FileIOError(str(e))
+    elif (settings.get("archive")):
+        try:
+            _response = get_archive(settings["archive"]).get(get_request_url(settings["url"], settings["params"]))
+            _result = get_document(_response, settings["type"])
+        except Exception as e:
+            _result = e
     else:
         _result = curl(
-            _url,
-            _params,
+            settings["url"],
+            settings["params"],
             None,
+            as_bytes=_as_bytes,
         )
 
-    if (not isinstance(_result, Exception)):
-        _html = _result
-        _data = do_locate_html(
-            _locate,
-            _html,
-            url=_url,
-        )
+    return _result
 
-        return _data
-    else:
-        raise _result
-        return _result
+def check_html_config(
+    config:dict,
+    settings:dict,
+):
+    if (not (settings["type"] and (settings["url"] or settings["file"]) and config.get("locate", {}))):
+        _exception = ConfigIncomplete("HTML Extraction missing configurations. Type, URL and Locate needs to be supplied.")
+        raise _exception
+
+def check_json_config(
+    config:dict,
+    settings:dict,
+):
+    if (not (settings["type"] and (settings["url"] or settings["file"]))):
+        _exception = ConfigIncomplete("JSON Extraction missing configurations. Type, URL need to be supplied.")
+        raise _exception
+
+def do_extract_html(
+    config:dict,
+    **kwargs,
+    )->str:
+    """
+    Perform extraction from a full configuration dictionary,
+    provided that the source is a HTML.
+
+    There are two ways to use this:
+    - call this with a config["type"] == "html", then it will fetch the source via curl(); or
+    - call this with a config["file"] containing a local file name, then the file will be open and read as the HTML input.
+    """
+    
+    _settings = get_fetch_settings(config, **kwargs)
+
+    check_html_config(config, _settings)
+
+    with label(url=_settings["file"] or _settings["url"]), stage("extract"):
+        _result = fetch(_settings)
+
+        if (not isinstance(_result, Exception)):
+            _html = _result
+            _data = do_locate_html(
+                config.get("locate", {}),
+                _html,
+                url=_settings["url"],
+            )
+
+            return _data
+        else:
+            raise _result
+            return _result
 
     
 def do_extract_json(
@@ -196,51 +464,59 @@ def do_extract_json(
     - call this with a config["file"] containing a local file name, then the file will be open and read as the JSON input.
     """
 
-    _type = config.get("type", "").format(**kwargs)
-    _url = config.get("url", "").format(**kwargs)
-    _file = config.get("file", "").format(**kwargs)
-    _params = config.get("params", {})
-    _transform = config.get("transform", None)
+    _settings = get_fetch_settings(config, **kwargs)
 
-    for _param in _params:
-        if (_param in kwargs):
-            _params[_param] = kwargs[_param]
-    
-    if (not (_type and (_url or _file))):
-        _exception = ConfigIncomplete("JSON Extraction missing configurations. Type, URL need to be supplied.")
-        raise _exception
+    check_json_config(config, _settings)
 
-    if (_file):
-        try:
-            with open(_file, "r") as _fHnd:
-                _result = _fHnd.read()
-        except Exception as e:
-            _result = FileIOError(str(e))
-    else:
-        _result = curl(
-            _url,
-            _params,
-            None,
-        )
+    with label(url=_settings["file"] or _settings["url"]), stage("extract"):
+        _result = fetch(_settings)
+
+        if (not isinstance(_result, Exception)):
+            return do_transform_json(
+                config,
+                _result,
+                url=_settings["url"],
+                delimiter=delimiter,
+            )
+        else:
+            raise _result
+            return _result
+
+def do_transform_json(
+    config:dict,
+    data:dict,
+    url:str=None,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->dict:
+    """
+    Take the "transform" key of a JSON config dictionary, and apply it on data already fetched.
+    """
 
-    if (not isinstance(_result, Exception)):
-        _data = _result
+    _transform = config.get("transform", None)
 
-        if (_transform):
-            _data = do_transform(
+    if (_transform):
+        with label(path="transform"):
+            data = do_transform(
                 transform=_transform,
-                data=_data,
-                url=_url,
+                data=data,
+                url=url,
                 delimiter=delimiter,
             )
 
-        return _data
-    else:
-        raise _result
-        return _result
+    _fields = config.get("fields", None)
+    if (_fields is not None):
+        data = project_data(
+            data,
+            _fields,
+            delimiter=delimiter,
+        )
+
+    return data
 
 def extract(
     config:dict,
+    *,
+    project_fields:List[str]=None,
     **kwargs,
 )->list:
     """
@@ -248,6 +524,11 @@ def extract(
     This is the function to use on a full config dict.
 
     Reads config["type"] to determine which method to call.
+
+    kwargs are the parameters of the Format Strings of the config, e.g. its "url".
+    project_fields is a list of Key Strings of the records to return, e.g. [ "name", "specs>>>weight" ];
+    only the work that contributes to them is done, see extract_http.projection.project_config().
+    To extract the same fields repeatedly, compile the config with project_config() once instead.
     """
 
     _type = config.get("type", "").format(**kwargs)
@@ -256,6 +537,9 @@ def extract(
         _exception = ConfigIncomplete("Extraction missing Type configuration.")
         raise _exception
 
+    if (project_fields is not None):
+        config = project_config(config, project_fields)
+
     _func_switch = {
         "html":do_extract_html,
         "json":do_extract_json,
@@ -265,4 +549,205 @@ def extract(
     return _func_switch.get(config.get("type", _func_switch[None]))(
         config,
         **kwargs,
-    )
\ No newline at end of file
+    )
+
+def extract_many(
+    configs:Union[List[dict], Dict[Any, dict]],
+    **kwargs,
+)->Union[list, dict]:
+    """
+    Extract multiple configurations, fetching and parsing each distinct document only once.
+
+    Useful when several configurations read the same page, e.g. its specifications, accessories and downloads:
+    configurations whose url (or file) and params are the same after formatting with kwargs share one fetch,
+    and HTML configurations share one parsed tree too.
+
+    configs is either a list or a dict of configurations; the results are returned in the same shape,
+    i.e. a list in the same order, or a dict with the same keys.
+    Failures are not raised, but returned in place of the result of that configuration; all of them bool() as False.
+    """
+
+    _named = configs if (isinstance(configs, dict)) else dict(enumerate(configs))
+
+    _documents = {}     # fetch key: fetched document
+    _soups = {}         # fetch key: parsed tree
+    _results = {}
+
+    for _name, _config in _named.items():
+        try:
+            _settings = get_fetch_settings(_config, **kwargs)
+            _type = _settings["type"]
+
+            if (_type == "html"):
+                check_html_config(_config, _settings)
+            elif (_type == "json"):
+                check_json_config(_config, _settings)
+            else:
+                _exception = ConfigIncomplete(f"Extraction Type '{_type}' is not one of html, json.")
+                raise _exception
+
+            _key = get_fetch_key(_settings)
+
+            with label(url=_settings["file"] or _settings["url"]), stage("extract"):
+                if (_key not in _documents):
+                    _documents[_key] = fetch(_settings)
+
+                _document = _documents[_key]
+
+                if (isinstance(_document, Exception)):
+                    raise _document
+
+                if (_type == "html"):
+                    if (_key not in _soups):
+                        _soups[_key] = parse_html(_document)
+
+                    _results[_name] = do_locate_soup(
+                        _config.get("locate", {}),
+                        _soups[_key],
+                        url=_settings["url"],
+                    )
+                else:
+                    # Transforms modify the data in place, so each configuration gets its own copy
+                    _results[_name] = do_transform_json(
+                        _config,
+                        copy.deepcopy(_document),
+                        url=_settings["url"],
+                    )
+        except Exception as e:
+            _results[_name] = e
+
+    for _soup in _soups.values():
+        teardown_soup(_soup)
+
+    if (isinstance(configs, dict)):
+        return _results
+    else:
+        return [ _results[_id] for _id in range(len(configs)) ]
+
+def get_url_pattern(
+    url:str,
+)->re.Pattern:
+    """
+    Regular expression matching the urls that the format string url can format into,
+    with a named group for each of its fields; fields that are not names, e.g. "{0}", are matched but not captured.
+    """
+
+    _pattern = ""
+    _names = set()
+
+    for _literal, _field, _spec, _conversion in string.Formatter().parse(url):
+        _pattern += re.escape(_literal)
+
+        if (_field is None):
+            continue
+
+        if (not _field.isidentifier()):
+            _pattern += ".+?"
+        elif (_field in _names):
+            _pattern += f"(?P={_field})"
+        else:
+            _pattern += f"(?P<{_field}>.+?)"
+            _names.add(_field)
+
+    return re.compile(_pattern)
+
+def match_url(
+    pattern:re.Pattern,
+    url:str,
+)->dict:
+    """
+    kwargs that format the url pattern of get_url_pattern() into url, or None if it does not match;
+    the query string of url is ignored if the pattern does not match it.
+    """
+
+    _match = pattern.fullmatch(url) or pattern.fullmatch(url.split("?", 1)[0])
+
+    if (_match):
+        return _match.groupdict()
+    else:
+        return None
+
+def iter_extract_archive(
+    configs:Union[List[dict], Dict[Any, dict]],
+    archive:Union[str, base_archive],
+    **kwargs,
+)->Iterator[Tuple[Any, str, dict, Any]]:
+    """
+    Apply configurations to all the records of an archive that match their url, in one sequential pass of the archive.
+
+    configs is either a list or a dict of configurations; archive is a path, see extract_http.archive.open_archive(), or an archive.
+    The url of each configuration is turned into a pattern, see get_url_pattern(), whose fields are taken as kwargs,
+    e.g. "https://www.example.com/{art_no}/en/" matches "https://www.example.com/A2000292/en/" with art_no="A2000292".
+    kwargs supplied here are added to them.
+
+    Yields (name, url, kwargs, result) in the order of the archive, name being the index or key of the configuration.
+    Records that match no configuration are skipped without being read, and records that match several are parsed once.
+    Exceptions are not raised, but yielded in place of the result; all of them bool() as False.
+    """
+
+    _named = configs if (isinstance(configs, dict)) else dict(enumerate(configs))
+    _patterns = {
+        _name: get_url_pattern(_config.get("url", "")) for _name, _config in _named.items()
+    }
+
+    if (isinstance(archive, str)):
+        archive = open_archive(archive)
+
+    for _response in archive.iter_responses(
+        want=lambda url: any(match_url(_pattern, url) is not None for _pattern in _patterns.values()),
+    ):
+        _documents = {}     # type: document, for this record only
+
+        try:
+
+            for _name, _config in _named.items():
+                _matched = match_url(_patterns[_name], _response.url)
+                if (_matched is None):
+                    continue
+
+                _kwargs = { **_matched, **kwargs }
+
+                try:
+                    _settings = get_fetch_settings(_config, **_kwargs)
+                    _type = _settings["type"]
+
+                    if (_type == "html"):
+                        check_html_config(_config, _settings)
+                    elif (_type == "json"):
+                        check_json_config(_config, _settings)
+                    else:
+                        _exception = ConfigIncomplete(f"Extraction Type '{_type}' is not one of html, json.")
+                        raise _exception
+
+                    with label(url=_response.url), stage("extract"):
+                        if (_type not in _documents):
+                            _document = get_document(_response, _type)
+                            if (_type == "html" and not isinstance(_document, Exception)):
+                                _document = parse_html(_document)
+                            _documents[_type] = _document
+
+                        _document = _documents[_type]
+
+                        if (isinstance(_document, Exception)):
+                            raise _document
+
+                        if (_type == "html"):
+                            _result = do_locate_soup(
+                                _config.get("locate", {}),
+                                _document,
+                                url=_settings["url"],
+                            )
+                        else:
+                            # Transforms modify the data in place, so each configuration gets its own copy
+                            _result = do_transform_json(
+                                _config,
+                                copy.deepcopy(_document),
+                                url=_settings["url"],
+                            )
+                except Exception as e:
+                    _result = e
+
+                yield _name, _response.url, _kwargs, _result
+        finally:
+            if (isinstance(_documents.get("html", None), BeautifulSoup)):
+                teardown_soup(_documents["html"])
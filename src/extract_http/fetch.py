@@ -0,0 +1,548 @@
+"""
+fetch.py
+
+The network layer behind extract_http.bin.curl().
+
+Identical requests in flight at the same time, i.e. with the same method, url and params, are coalesced:
+only the first is sent, and all others wait for and share its response.
+This saves duplicate fetches when a batch contains duplicate kwargs, or different configs format to the same url.
+
+Responses are shared as is; callers must not modify them.
+
+Example:
+    extract_http.fetch.COALESCER.stats()
+returns
+    { "requests": 120, "fetches": 100, "coalesced": 20, "bytes_saved": 1843200 }
+
+Requests are sent by a transport, set with set_transport():
+- requests_transport : HTTP/1.1 via requests; the default
+- httpx_transport    : HTTP/2 via httpx, multiplexing concurrent requests to the same host over one connection,
+                       and falling back to HTTP/1.1 for hosts that do not support it.
+                       Requires the optional httpx and h2 packages; install with
+                           pip install extract_http[http2]
+
+Both transports negotiate compression with Accept-Encoding, offering zstd and brotli if the optional
+zstandard and brotli packages are installed, and gzip and deflate always; install both with
+    pip install extract_http[compression]
+Responses are decompressed as they are read. With keep_compressed=True, the bytes as received are kept too,
+as response.compressed, e.g. for caches and archives of raw pages; response.content_encoding names their encoding.
+"""
+
+from concurrent.futures import Future
+import threading
+import zlib
+from typing import Any, Callable, Dict, Hashable, Iterable, Tuple
+from urllib.parse import urlparse
+import warnings
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from extract_http.instrument import stage
+
+class FetchDependencyMissing(ImportError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+
+class FetchContentEncodingInvalid(ValueError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+# Size of chunks read from the network
+FETCH_CHUNK_SIZE = 64 * 1024
+
+def get_accept_encoding()->str:
+    """
+    Value of the Accept-Encoding header, in order of preference, of the encodings that can be decoded.
+    """
+
+    return ", ".join(
+        _encoding for _encoding, _available in (
+            ("zstd", zstandard is not None),
+            ("br", brotli is not None),
+            ("gzip", True),
+            ("deflate", True),
+        ) if _available
+    )
+
+def get_decoder(
+    encoding:str,
+):
+    """
+    Streaming decoder of a content encoding, with decompress(chunk) and flush() methods.
+    """
+
+    if (encoding in ("gzip", "x-gzip")):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif (encoding == "deflate"):
+        return deflate_decoder()
+    elif (encoding == "br" and brotli is not None):
+        return brotli_decoder()
+    elif (encoding == "zstd" and zstandard is not None):
+        return zstandard.ZstdDecompressor().decompressobj()
+    else:
+        _exception = FetchContentEncodingInvalid(f"Content-Encoding '{encoding}' cannot be decoded.")
+        raise _exception
+
+class deflate_decoder():
+    """
+    "deflate" is meant to be zlib, but some servers send raw deflate; decide by the first chunk.
+    """
+
+    def __init__(self):
+        self.decoder = None
+
+    def decompress(self, data:bytes)->bytes:
+        if (self.decoder is None):
+            self.decoder = zlib.decompressobj()
+            try:
+                return self.decoder.decompress(data)
+            except zlib.error as e:
+                self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        return self.decoder.decompress(data)
+
+    def flush(self)->bytes:
+        return self.decoder.flush() if (self.decoder is not None) else b""
+
+class brotli_decoder():
+    def __init__(self):
+        self.decoder = brotli.Decompressor()
+
+    def decompress(self, data:bytes)->bytes:
+        return self.decoder.process(data)
+
+    def flush(self)->bytes:
+        return b""
+
+def decode_stream(
+    chunks:Iterable[bytes],
+    content_encoding:str=None,
+    keep_compressed:bool=False,
+)->Tuple[bytes, bytes]:
+    """
+    Decode chunks of a body as received, with content_encoding being the value of the Content-Encoding header.
+
+    Returns (content, compressed); compressed is the body as received if keep_compressed, otherwise None.
+    """
+
+    _encodings = [
+        _encoding.strip().lower() for _encoding in (content_encoding or "").split(",") \
+            if _encoding.strip() and _encoding.strip().lower() != "identity"
+    ]
+
+    # Encodings are listed in the order they were applied
+    _decoders = [ get_decoder(_encoding) for _encoding in reversed(_encodings) ]
+
+    _content = []
+    _compressed = [] if (keep_compressed) else None
+
+    for _chunk in chunks:
+        if (_compressed is not None):
+            _compressed.append(_chunk)
+
+        for _decoder in _decoders:
+            _chunk = _decoder.decompress(_chunk)
+
+        _content.append(_chunk)
+
+    # Flush through the remaining decoders in turn
+    for _id, _decoder in enumerate(_decoders):
+        _chunk = _decoder.flush()
+        for _next_decoder in _decoders[_id+1:]:
+            _chunk = _next_decoder.decompress(_chunk)
+        _content.append(_chunk)
+
+    return b"".join(_content), (b"".join(_compressed) if (_compressed is not None) else None)
+
+
+class base_transport():
+    """
+    Sends requests; returns responses with the interface of requests.Response used by curl(),
+    i.e. status_code, headers, content, text and json().
+
+    Timeouts must be raised as requests.exceptions.Timeout.
+
+    Responses also have
+    - nbytes           : number of bytes received, before decompression
+    - content_encoding : Content-Encoding of the body as received
+    - compressed       : the body as received if keep_compressed, otherwise None
+    """
+
+    keep_compressed = False
+
+    def finish(
+        self,
+        response,
+        chunks:Iterable[bytes],
+    ):
+        """
+        Read and decode the body of response from chunks as received.
+        """
+
+        _content_encoding = response.headers.get("Content-Encoding", None)
+        _nbytes = [ 0, ]
+
+        def _counted(chunks:Iterable[bytes]):
+            for _chunk in chunks:
+                _nbytes[0] += len(_chunk)
+                yield _chunk
+
+        try:
+            _content, _compressed = decode_stream(
+                _counted(chunks),
+                _content_encoding,
+                keep_compressed=self.keep_compressed,
+            )
+        except FetchContentEncodingInvalid as e:
+            # Pass undecodable bodies on as received
+            _content = b"".join(_counted(chunks))
+            _compressed = _content if (self.keep_compressed) else None
+
+        response._content = _content
+        response.nbytes = _nbytes[0]
+        response.content_encoding = _content_encoding
+        response.compressed = _compressed
+
+        return response
+
+    def request(
+        self,
+        method:str,
+        url:str,
+        params:dict=None,
+    ):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class requests_transport(base_transport):
+    """
+    HTTP/1.1 via requests, one connection per request.
+    """
+
+    def __init__(
+        self,
+        timeout:float=None,
+        keep_compressed:bool=False,
+    ):
+        self.timeout = timeout
+        self.keep_compressed = keep_compressed
+
+    def request(
+        self,
+        method:str,
+        url:str,
+        params:dict=None,
+    )->requests.Response:
+        _response = requests.request(
+            method,
+            url,
+            params=params,
+            timeout=self.timeout,
+            headers={ "Accept-Encoding": get_accept_encoding(), },
+            stream=True,
+        )
+
+        with _response:
+            self.finish(
+                _response,
+                _response.raw.stream(FETCH_CHUNK_SIZE, decode_content=False),
+            )
+            _response._content_consumed = True
+
+        return _response
+
+
+class httpx_transport(base_transport):
+    """
+    HTTP/2 via httpx, shared by all threads.
+
+    Concurrent requests to the same host are multiplexed over a single connection, as streams;
+    max_streams limits the number of streams in flight per host, with any further requests waiting for a free stream.
+
+    For https, the protocol is negotiated with the server, so hosts without HTTP/2 are served with HTTP/1.1.
+    Plain http has no negotiation: HTTP/2 is only used if prior_knowledge is True, i.e. the server is known to speak h2c;
+    hosts that then fail to speak HTTP/2 are retried, and thereafter served, with HTTP/1.1.
+    """
+
+    def __init__(
+        self,
+        max_streams:int=100,
+        max_connections:int=None,
+        prior_knowledge:bool=False,
+        timeout:float=None,
+        keep_compressed:bool=False,
+        **options,
+    ):
+        """
+        options are passed to httpx.Client, e.g. verify=False.
+        """
+
+        if (httpx is None):
+            _exception = FetchDependencyMissing("httpx is required for the HTTP/2 transport; install extract_http[http2].")
+            raise _exception
+
+        _http2 = h2 is not None
+        if (not _http2):
+            warnings.warn(RuntimeWarning("h2 is not installed; httpx_transport will use HTTP/1.1 only. Install extract_http[http2]."))
+
+        self.max_streams = max_streams
+        self.prior_knowledge = prior_knowledge and _http2
+        self.keep_compressed = keep_compressed
+
+        _limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+        self.client = httpx.Client(
+            http1=not self.prior_knowledge,
+            http2=_http2,
+            limits=_limits,
+            timeout=timeout,
+            **options,
+        )
+        # Used for hosts found not to support HTTP/2 with prior knowledge
+        self.http1_client = httpx.Client(
+            http1=True,
+            http2=False,
+            limits=_limits,
+            timeout=timeout,
+            **options,
+        ) if (self.prior_knowledge) else self.client
+
+        self.lock = threading.Lock()
+        self.streams = {}
+        self.http1_hosts = set()
+
+    def get_streams(
+        self,
+        host:str,
+    )->threading.BoundedSemaphore:
+        with self.lock:
+            if (host not in self.streams):
+                self.streams[host] = threading.BoundedSemaphore(self.max_streams)
+
+            return self.streams[host]
+
+    def request(
+        self,
+        method:str,
+        url:str,
+        params:dict=None,
+    ):
+        _host = urlparse(url).netloc
+
+        with self.get_streams(_host):
+            try:
+                if (_host in self.http1_hosts):
+                    return self.send(self.http1_client, method, url, params)
+
+                try:
+                    return self.send(self.client, method, url, params)
+                except (httpx.RemoteProtocolError, httpx.LocalProtocolError) as e:
+                    if (not self.prior_knowledge):
+                        raise e
+
+                    with self.lock:
+                        self.http1_hosts.add(_host)
+
+                    return self.send(self.http1_client, method, url, params)
+            except httpx.TimeoutException as e:
+                raise requests.exceptions.Timeout(str(e))
+
+    def send(
+        self,
+        client:"httpx.Client",
+        method:str,
+        url:str,
+        params:dict=None,
+    )->"httpx.Response":
+        with client.stream(
+            method,
+            url,
+            params=params,
+            headers={ "Accept-Encoding": get_accept_encoding(), },
+        ) as _response:
+            self.finish(
+                _response,
+                _response.iter_raw(FETCH_CHUNK_SIZE),
+            )
+
+        return _response
+
+    def close(self):
+        self.client.close()
+        self.http1_client.close()
+
+
+TRANSPORT = requests_transport()
+
+def get_transport()->base_transport:
+    return TRANSPORT
+
+def set_transport(
+    transport:base_transport,
+)->base_transport:
+    """
+    Send all subsequent requests with transport; returns the previous transport, which is not closed.
+    """
+
+    global TRANSPORT
+
+    _previous = TRANSPORT
+    TRANSPORT = transport
+    return _previous
+
+class request_coalescer():
+    """
+    Share the result of a call between all callers of the same key while it is in flight.
+
+    Set enabled to False to make every call separately.
+    """
+
+    def __init__(
+        self,
+        enabled:bool=True,
+    ):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.counters = {
+            "requests": 0,
+            "fetches": 0,
+            "coalesced": 0,
+            "bytes_saved": 0,
+        }
+
+    def call(
+        self,
+        key:Hashable,
+        func:Callable[..., Any],
+        *args,
+        **kwargs,
+    )->Any:
+        """
+        Return func(*args, **kwargs), or the result of the call of the same key already in flight.
+
+        If the call raises, all of its callers raise the same exception.
+        """
+
+        with self.lock:
+            self.counters["requests"] += 1
+
+            _future = self.in_flight.get(key, None) if (self.enabled) else None
+
+            if (_future is None):
+                _future = Future()
+                _owner = True
+
+                if (self.enabled):
+                    self.in_flight[key] = _future
+            else:
+                _owner = False
+                self.counters["coalesced"] += 1
+
+        if (_owner):
+            try:
+                _future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                _future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.counters["fetches"] += 1
+                    if (self.in_flight.get(key, None) is _future):
+                        del self.in_flight[key]
+
+            return _future.result()
+
+        _result = _future.result()
+
+        with self.lock:
+            self.counters["bytes_saved"] += getattr(_result, "nbytes", len(getattr(_result, "content", b"") or b""))
+
+        return _result
+
+    def stats(self)->Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            for _counter in self.counters:
+                self.counters[_counter] = 0
+
+
+COALESCER = request_coalescer()
+
+def get_request_key(
+    method:str,
+    url:str,
+    params:dict=None,
+)->tuple:
+    """
+    Identity of a request, with params sorted.
+    """
+
+    return (
+        method.upper(),
+        url,
+        tuple(sorted((str(_param), str(_value)) for _param, _value in (params or {}).items())),
+    )
+
+def send_request(
+    method:str,
+    url:str,
+    params:dict=None,
+)->requests.Response:
+    with stage("curl", host=urlparse(url).hostname) as _stage:
+        _response = get_transport().request(
+            method,
+            url,
+            params=params,
+        )
+
+        # Bytes on the wire, i.e. before decompression
+        _stage.add(count=1, nbytes=getattr(_response, "nbytes", len(_response.content)))
+        _stage.label(status=_response.status_code)
+
+    return _response
+
+def fetch_response(
+    url:str,
+    params:dict=None,
+    method:str="GET",
+)->requests.Response:
+    """
+    Send a request, coalesced with any identical request in flight.
+    """
+
+    return COALESCER.call(
+        get_request_key(method, url, params),
+        send_request,
+        method,
+        url,
+        params,
+    )
@@ -0,0 +1,404 @@
+"""
+files.py
+
+Bulk extraction of local files, e.g. archives of saved pages; no HTTP requests are made.
+
+- iter_files()         : (path, kwargs) for each file in a directory, a glob pattern or a manifest
+- map_file()           : bytes of a file, read from a memory map, and its encoding
+- extract_file()       : extract() of a single local file
+- iter_extract_files() : generator yielding results as they complete, extracted by a pool of processes
+- extract_files()      : iter_extract_files() written straight into a sink, see extract_http.sink
+
+Like extract_http.batch, only a bounded number of files are ever submitted ahead of the consumer.
+Worker processes can be recycled after a number of documents, or once their RSS has grown by a number of bytes,
+so that long runs keep a flat memory profile.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import fnmatch
+import glob
+import json
+import mmap
+import os
+import pickle
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+from extract_http.batch import get_records
+from extract_http.bin import document_bytes, get_rss, sniff_encoding, SNIFF_LIMIT
+from extract_http.exceptions import ConfigIncomplete, FileIOError
+from extract_http.extract import get_fetch_settings, \
+                                 check_html_config, \
+                                 check_json_config, \
+                                 do_locate_html, \
+                                 do_transform_json
+from extract_http.instrument import label, stage
+from extract_http.sink import base_sink
+
+from extract_http.defaults import RECORD_DICT_DELIMITER
+
+# State of the worker process this module is running in; reset when a new process is forked
+_worker_state = {
+    "pid": None,
+    "documents": 0,
+    "rss": None,
+}
+
+class FileExtractionError(RuntimeError):
+    """
+    Stands in for an exception raised, or a result returned, in a worker process that could not be sent back as is.
+    """
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+def iter_manifest(
+    path:str,
+)->Iterator[Tuple[str, dict]]:
+    """
+    (path, kwargs) for each line of a manifest file.
+
+    Each line is either a path, or a JSON object of kwargs with the path in "file", e.g.
+        pages/A2000292.html
+        {"file": "pages/A2000293.html", "art_no": "A2000293"}
+    Relative paths are relative to the directory of the manifest. Blank lines and lines starting with "#" are skipped.
+    """
+
+    _root = os.path.dirname(os.path.abspath(path))
+
+    with open(path, "r", encoding="utf-8") as _fHnd:
+        for _line in _fHnd:
+            _line = _line.strip()
+
+            if (not _line or _line.startswith("#")):
+                continue
+
+            if (_line.startswith("{")):
+                _kwargs = json.loads(_line)
+                _path = _kwargs.pop("file")
+            else:
+                _kwargs = {}
+                _path = _line
+
+            yield os.path.join(_root, _path), _kwargs
+
+def iter_files(
+    source:Union[str, Iterable[Union[str, dict]]],
+    pattern:str="*",
+)->Iterator[Tuple[str, dict]]:
+    """
+    (path, kwargs) for each file in source, which is one of:
+    - a directory, searched recursively for file names matching pattern, in sorted order;
+    - a glob pattern, e.g. "archive/**/*.html";
+    - a manifest file, see iter_manifest();
+    - an iterable of paths, or of kwargs dicts with the path in "file".
+
+    Files are listed lazily, so source can be of any size.
+    """
+
+    if (isinstance(source, str)):
+        if (os.path.isdir(source)):
+            for _root, _dirs, _files in os.walk(source):
+                _dirs.sort()
+                for _file in sorted(fnmatch.filter(_files, pattern)):
+                    yield os.path.join(_root, _file), {}
+        elif (glob.has_magic(source)):
+            for _path in glob.iglob(source, recursive=True):
+                if (os.path.isfile(_path)):
+                    yield _path, {}
+        elif (os.path.isfile(source)):
+            yield from iter_manifest(source)
+        else:
+            _exception = FileIOError(f"'{source}' is not a directory, glob pattern or manifest.")
+            raise _exception
+    else:
+        for _item in source:
+            if (isinstance(_item, dict)):
+                _kwargs = _item.copy()
+                yield _kwargs.pop("file"), _kwargs
+            else:
+                yield _item, {}
+
+def map_file(
+    path:str,
+)->document_bytes:
+    """
+    Bytes of the file at path, read from a read-only memory map, as document_bytes in their sniffed encoding;
+    see extract_http.bin.sniff_encoding().
+
+    Only the first SNIFF_LIMIT bytes are scanned for the encoding, and the pages of the map are copied into a single bytes object,
+    which the parser decodes itself; the file is never decoded into a text of its own first.
+    """
+
+    with open(path, "rb") as _fHnd:
+        if (os.fstat(_fHnd.fileno()).st_size == 0):
+            return document_bytes(b"", "utf-8")
+
+        with mmap.mmap(_fHnd.fileno(), 0, access=mmap.ACCESS_READ) as _map:
+            _encoding = sniff_encoding(_map[:SNIFF_LIMIT])
+
+            # The parser needs bytes; this is the only copy of the file
+            _content = _map[:]
+
+    return document_bytes(_content, _encoding)
+
+def extract_file(
+    config:dict,
+    path:str,
+    delimiter:str=RECORD_DICT_DELIMITER,
+    **kwargs,
+)->Any:
+    """
+    Extract config from the local file at path in place of config["file"] or config["url"].
+
+    config["url"] is still formatted with kwargs, and used to resolve relative URLs.
+    JSON files are parsed before the "transform" is applied.
+    """
+
+    _settings = get_fetch_settings(config, **kwargs)
+    _settings["file"] = path
+    _type = _settings["type"]
+
+    if (_type == "html"):
+        check_html_config(config, _settings)
+    elif (_type == "json"):
+        check_json_config(config, _settings)
+    else:
+        _exception = ConfigIncomplete(f"Extraction Type '{_type}' is not one of html, json.")
+        raise _exception
+
+    with label(url=path), stage("extract"):
+        try:
+            _document = map_file(path)
+        except (OSError, ValueError) as e:
+            _exception = FileIOError(str(e))
+            raise _exception
+
+        if (_type == "html"):
+            return do_locate_html(
+                config.get("locate", {}),
+                _document,
+                url=_settings["url"],
+                delimiter=delimiter,
+            )
+        else:
+            return do_transform_json(
+                config,
+                json.loads(_document.text),
+                url=_settings["url"],
+                delimiter=delimiter,
+            )
+
+def extract_file_chunk(
+    config:dict,
+    chunk:List[Tuple[str, dict]],
+)->List[Tuple[str, dict, bytes]]:
+    """
+    extract_file() of each (path, kwargs) in chunk, in a worker process.
+
+    Exceptions are returned in place of the result. Each result is pickled here, in the worker, see load_result(),
+    so that one that cannot be sent between processes is replaced by a FileExtractionError for its file only,
+    instead of failing the whole chunk.
+    """
+
+    _return = []
+
+    for _path, _kwargs in chunk:
+        try:
+            _result = extract_file(config, _path, **_kwargs)
+        except Exception as e:
+            _result = e
+
+        try:
+            _pickled = pickle.dumps(_result)
+        except Exception as e:
+            _error = _result if (isinstance(_result, Exception)) else e
+            _pickled = pickle.dumps(FileExtractionError(f"{type(_error).__name__}: {_error}"))
+
+        _return.append((_path, _kwargs, _pickled))
+
+    return _return
+
+def load_result(
+    pickled:bytes,
+)->Any:
+    """
+    Unpickle a result of extract_file_chunk(); some objects pickle, but cannot be unpickled, and are returned as FileExtractionError.
+    """
+
+    try:
+        return pickle.loads(pickled)
+    except Exception as e:
+        return FileExtractionError(f"{type(e).__name__}: {e}")
+
+def extract_worker_chunk(
+    config:dict,
+    chunk:List[Tuple[str, dict]],
+    max_documents:int=None,
+    max_rss_growth:int=None,
+)->Tuple[List[Tuple[str, dict, Any]], bool]:
+    """
+    extract_file_chunk() in a worker process, and whether that process has reached its limits and should be recycled:
+    max_documents extracted, or an RSS max_rss_growth bytes larger than before its first chunk.
+    """
+
+    if (_worker_state["pid"] != os.getpid()):
+        _worker_state.update({
+            "pid": os.getpid(),
+            "documents": 0,
+            "rss": get_rss(),
+        })
+
+    _results = extract_file_chunk(config, chunk)
+    _worker_state["documents"] += len(chunk)
+
+    _recycle = max_documents is not None and _worker_state["documents"] >= max_documents
+
+    if (not _recycle and max_rss_growth is not None and _worker_state["rss"] is not None):
+        _recycle = get_rss() - _worker_state["rss"] >= max_rss_growth
+
+    return _results, _recycle
+
+def iter_chunks(
+    files:Iterator[Tuple[str, dict]],
+    chunksize:int,
+)->Iterator[List[Tuple[str, dict]]]:
+    _chunk = []
+
+    for _file in files:
+        _chunk.append(_file)
+
+        if (len(_chunk) >= chunksize):
+            yield _chunk
+            _chunk = []
+
+    if (_chunk):
+        yield _chunk
+
+def iter_extract_files(
+    config:dict,
+    source:Union[str, Iterable[Union[str, dict]]],
+    pattern:str="*",
+    processes:int=None,
+    chunksize:int=16,
+    prefetch:int=None,
+    max_documents:int=None,
+    max_rss_growth:int=None,
+)->Iterator[Tuple[str, dict, Any]]:
+    """
+    extract_file() of each file in source, see iter_files(), using processes worker processes; defaults to the number of CPUs.
+
+    Yields (path, kwargs, result) in order of completion.
+    Exceptions are not raised, but yielded in place of the result; all of them bool() as False.
+
+    Files are sent to the workers chunksize at a time; prefetch is the maximum number of chunks submitted but not yet yielded,
+    and defaults to 2 * processes.
+
+    Once any worker has extracted max_documents, or its RSS has grown by max_rss_growth bytes, no more chunks are submitted;
+    the chunks in flight are finished, and the pool is replaced by fresh processes.
+    max_documents is checked after each chunk, so it is best a multiple of chunksize.
+    """
+
+    if (processes is None):
+        processes = os.cpu_count() or 1
+
+    if (prefetch is None):
+        prefetch = processes * 2
+
+    prefetch = max(prefetch, 1)
+
+    _chunks = iter_chunks(iter_files(source, pattern=pattern), max(chunksize, 1))
+    _exhausted = False
+
+    while (not _exhausted):
+        _futures = set()
+        _recycle = False
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            while (True):
+                # Top up the chunks in flight, unless the pool is being recycled
+                while (not _exhausted and not _recycle and len(_futures) < prefetch):
+                    try:
+                        _chunk = next(_chunks)
+                    except StopIteration:
+                        _exhausted = True
+                        break
+
+                    _futures.add(executor.submit(
+                        extract_worker_chunk,
+                        config,
+                        _chunk,
+                        max_documents=max_documents,
+                        max_rss_growth=max_rss_growth,
+                    ))
+
+                if (not _futures):
+                    break
+
+                _done, _futures = wait(_futures, return_when=FIRST_COMPLETED)
+
+                for _future in _done:
+                    _results, _recycle_worker = _future.result()
+                    _recycle = _recycle or _recycle_worker
+
+                    for _path, _kwargs, _pickled in _results:
+                        yield _path, _kwargs, load_result(_pickled)
+
+def extract_files(
+    config:dict,
+    source:Union[str, Iterable[Union[str, dict]]],
+    sink:base_sink,
+    group:int=None,
+    with_path:bool=False,
+    pattern:str="*",
+    processes:int=None,
+    chunksize:int=16,
+    prefetch:int=None,
+    max_documents:int=None,
+    max_rss_growth:int=None,
+)->Dict[str, Union[int, list]]:
+    """
+    Extract config from each file in source, and write the results into sink as they complete.
+
+    If group is None, one item is written per file:
+        { "file": path, "kwargs": kwargs, "data": result }
+    Otherwise, each record in the locate group of that index is written separately;
+    with_path adds the path of the file, as "file", and its kwargs to each record.
+
+    Failed files are not written. Returns
+        { "files": int, "records": int, "errors": [ (path, exception), ] }
+    """
+
+    _summary = {
+        "files": 0,
+        "records": 0,
+        "errors": [],
+    }
+
+    for _path, _kwargs, _result in iter_extract_files(
+        config,
+        source,
+        pattern=pattern,
+        processes=processes,
+        chunksize=chunksize,
+        prefetch=prefetch,
+        max_documents=max_documents,
+        max_rss_growth=max_rss_growth,
+    ):
+        _summary["files"] += 1
+
+        if (isinstance(_result, Exception)):
+            _summary["errors"].append((_path, _result))
+        elif (group is None):
+            sink.write({
+                "file": _path,
+                "kwargs": _kwargs,
+                "data": _result,
+            })
+            _summary["records"] += 1
+        else:
+            for _record in get_records(_result, group):
+                sink.write({ "file": _path, **_kwargs, **_record } if with_path else _record)
+                _summary["records"] += 1
+
+    return _summary
@@ -11,6 +11,7 @@ Once the node is identified, it can be extracted with different ways:
 """
 
 
+import collections.abc
 import re
 import typing
 from typing import Union
@@ -25,11 +26,20 @@ import pandas as pd
 
 
 
-from extract_http.bin import safe_zip, find_all_nodes
-from extract_http.html_table import TableOrientation, html_table
+from extract_http.bin import assemble_records, find_all_nodes
+from extract_http.export import from_dataframe
+from extract_http.html_table import TableOrientation, html_table, DEFAULT_CATEGORY_THRESHOLD
+from extract_http.instrument import detail
 from pandas.io.pytables import Table
 
 
+TABLE_OUTPUTS = ("records", "dataframe", "arrow")
+
+class TableOutputInvalid(ValueError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
 class NodeFormatStringInvalid(ValueError):
     def __bool__(self):
         return False
@@ -106,11 +116,46 @@ def get_node_attrvalue(
         return None
 
 
+class node_values(collections.abc.Sequence):
+    """
+    Values of a list of nodes, each only extracted when it is first read.
+
+    Used for the "counted" selectors of a locate group, whose nodes decide the number of records but whose values are not returned;
+    see extract_http.bin.assemble_records().
+    """
+
+    __slots__ = ("nodes", "extract", "_values")
+
+    def __init__(
+        self,
+        nodes:list,
+        extract:typing.Callable[[bs4.element.Tag], typing.Any],
+    ):
+        self.nodes = nodes
+        self.extract = extract
+        self._values = {}
+
+    def __len__(self)->int:
+        return len(self.nodes)
+
+    def __getitem__(self, id:int)->typing.Any:
+        if (id not in self._values):
+            self._values[id] = self.extract(self.nodes[id])
+
+        return self._values[id]
+
 def get_node_value(
     format:list,
     nodes:bs4.element.Tag,
     allow_list:bool=True,
+    lazy:bool=False,
 ):
+    """
+    Value of the format on nodes: a List of the values of all the nodes found, or a single value if an #id is specified.
+
+    If lazy is True, the List is a node_values instead, which only extracts values when they are read.
+    """
+
     if (isinstance(format, str) or \
         isinstance(format, dict)):
         format = [format, ]
@@ -131,7 +176,9 @@ def get_node_value(
     if (_value_nodes):
         extract = lambda value: get_node_attrvalue(value, _formatter["source"], _formatter["subsource"])
 
-        if (_formatter["id"] is None):
+        if (_formatter["id"] is None and lazy):
+            _return = node_values(_value_nodes, extract)
+        elif (_formatter["id"] is None):
             # Take all values as a list
             _return = [ extract(_value_node) for _value_node in _value_nodes ]
         else:
@@ -161,8 +208,10 @@ def get_value_array(
         nodes = [nodes, ]
 
     for _node in nodes:
-        _key = get_node_value(key_format, _node)
-        _value = get_node_value(value_format, _node)
+        with detail("select", "key"):
+            _key = get_node_value(key_format, _node)
+        with detail("select", "value"):
+            _value = get_node_value(value_format, _node)
 
         # get_node_value() always return a list unless #id is specified
         if (isinstance(_key, list)):
@@ -192,21 +241,32 @@ def get_value_array(
 
 def get_value_lists(
     values:dict,
-    nodes:bs4.element.Tag
+    nodes:bs4.element.Tag,
+    lazy:bool=False,
 )->dict:
 
-    _dicts = {
-        _key:get_node_value(
-            values[_key], nodes,
-        ) for _key in values
-    }
+    _dicts = {}
+
+    for _key in values:
+        with detail("select", _key):
+            _dicts[_key] = get_node_value(
+                values[_key], nodes,
+                lazy=lazy,
+            )
 
     return _dicts
 
 def get_value_records(
     values:dict,
     nodes:bs4.element.Tag,
+    counted:dict=None,
 )->list:
+    """
+    Records of the values of each node.
+
+    The selectors in counted are matched like those in values, and decide the number of records alike,
+    but their values are left out of the records, and only extracted where that number depends on them.
+    """
 
     _record_nodes = nodes if (isinstance(nodes, list)) else [nodes, ]
     
@@ -217,9 +277,15 @@ def get_value_records(
                     values,
                     node,
                 ) 
+        _counts = get_value_lists(
+                    counted,
+                    node,
+                    lazy=True,
+                ) if (counted) else {}
 
-        if _dicts:
-            _record = [ dict(zip(_dicts.keys(), _record)) for _record in safe_zip(*_dicts.values()) ]
+        if (_dicts or _counts):
+            _keys = tuple(_dicts)
+            _record = [ dict(zip(_keys, _record)) for _record in assemble_records(*_dicts.values(), counted=_counts.values()) ]
         else:
             _record = []
 
@@ -252,24 +318,47 @@ def get_value_table(
     _orient = TableOrientation.HEADER_ROW if (settings.get("orient", "rows").lower() == "rows") else TableOrientation.INDEX_COL
     _key_index = settings.get("key_index", 0)
     _keys = settings.get("keys", {})
+    _columns = settings.get("columns", None)
+    _output = settings.get("output", None) or "records"
 
-    # Outer join all the tables requested
-    _html_table = None
-    for _node in nodes:
-        _obj = html_table.from_bs4_node(
+    if (_output not in TABLE_OUTPUTS):
+        _exception = TableOutputInvalid(f"Table output '{_output}' is not one of {', '.join(TABLE_OUTPUTS)}.")
+        raise _exception
+
+    # Outer join all the tables requested
+    _html_tables = [
+        html_table.from_bs4_node(
             _node,
             _orient,
             _key_index
-        )
-    
-        if (_html_table is None):
-            _html_table = _obj
+        ) for _node in nodes
+    ]
+
+    if (len(_html_tables) > 1):
+        _html_table = html_table.combine(_html_tables)
+    elif (_html_tables):
+        _html_table = _html_tables[0]
+    else:
+        _html_table = None
+
+    if (_output != "records"):
+        # Typed columns, built straight from the table without going through the transform
+        if (_html_table):
+            _return = _html_table.export_typed(
+                _keys,
+                dtypes=settings.get("dtypes", None),
+                category_threshold=settings.get("category_threshold", DEFAULT_CATEGORY_THRESHOLD),
+                columns=_columns,
+            )
         else:
-            _html_table.merge(_obj)
+            _return = pd.DataFrame()
 
-    if (_html_table):
+        if (_output == "arrow"):
+            _return = from_dataframe(_return)
+    elif (_html_table):
         _return = _html_table.export(
-            _keys
+            _keys,
+            columns=_columns,
         )
     else:
         _return = []
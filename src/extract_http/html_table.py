@@ -7,7 +7,8 @@ Deals with a single html table tag.
 from __future__ import annotations # enable in class type hint of itself
 
 from enum import Enum
-from typing import List, Tuple, Union
+import re
+from typing import Iterable, List, Tuple, Union
 import warnings
 
 import numpy as np
@@ -17,7 +18,23 @@ import bs4.element
 
 DEFAULT_TABLE_TAG_CONTENT = "$innerText"
 
-from extract_http.bin import find_all_nodes
+# Text columns with at most this ratio of unique values are made categorical when inferring dtypes.
+DEFAULT_CATEGORY_THRESHOLD = 0.5
+
+# Cell texts inferred as integers, and the range they must fit in
+_INTEGER_PATTERN = re.compile(r"[+-]?\d+")
+_INT64_MIN, _INT64_MAX = -2**63, 2**63 - 1
+
+# Numbers with leading zeros, e.g. "00123", are identifiers rather than quantities
+_LEADING_ZERO_PATTERN = re.compile(r"[+-]?0\d")
+
+from extract_http.bin import find_all_nodes, \
+                             is_bool_text, \
+                             text_to_bool
+from extract_http.instrument import stage
+from extract_http.numeric import parse_numbers, \
+                                 NumericParseError, \
+                                 NUMERIC_TYPES
 
 def create_tag(html:str)->bs4.element.Tag:
     if (html is not None and not pd.isna(html)):
@@ -52,6 +69,123 @@ def map_keys(
         return _value.pop(0)
 
 
+def get_inferred_numeric(
+    values:pd.Series,
+)->str:
+    """
+    "int" or "float" if all values are numeric and convert to that dtype exactly, otherwise None.
+
+    - int only if all values are integers without leading zeros that fit in int64;
+    - float if all values are finite, or infinite, numbers without leading zeros, and are not integers that float would round.
+    """
+
+    _texts = [ (_value.strip() if (isinstance(_value, str)) else _value) for _value in values ]
+
+    if (any(isinstance(_text, str) and _LEADING_ZERO_PATTERN.match(_text) for _text in _texts)):
+        return None
+
+    _integers = []
+    for _text in _texts:
+        if (isinstance(_text, bool)):
+            return None
+        elif (isinstance(_text, (int, np.integer))):
+            _integers.append(int(_text))
+        elif (isinstance(_text, str) and _INTEGER_PATTERN.fullmatch(_text)):
+            _integers.append(int(_text))
+        else:
+            _integers = None
+            break
+
+    if (_integers is not None):
+        if (all(_INT64_MIN <= _integer <= _INT64_MAX for _integer in _integers)):
+            return "int"
+        else:
+            # Too large for int64, and float would lose digits
+            return None
+
+    # Integers beyond 2 ** 53 lose digits in float64
+    if (any(isinstance(_text, str) and _INTEGER_PATTERN.fullmatch(_text) and abs(int(_text)) > 2**53 for _text in _texts)):
+        return None
+
+    _numeric = pd.to_numeric(pd.Series(_texts, dtype=np.object_), errors="coerce")
+
+    if (_numeric.notna().all()):
+        return "float"
+    else:
+        return None
+
+def get_typed_column(
+    values:List[str],
+    dtype:str=None,
+    category_threshold:float=DEFAULT_CATEGORY_THRESHOLD,
+)->pd.Series:
+    """
+    Convert a column of cell texts into a typed pd.Series.
+
+    dtype is one of "int", "float", "bool", "str", "category", or any other dtype accepted by pd.Series.astype().
+    "int" and "float" columns are parsed by extract_http.numeric, so that units and thousands separators are ignored.
+    If dtype is not supplied, it is inferred in the following order:
+    - int, if all non-empty values are integers that fit in int64 - as nullable Int64 if there are empty values;
+    - float, if all non-empty values are numeric; see get_inferred_numeric().
+      Numbers with leading zeros, e.g. "00123", and integers too large for int64 are not numeric, as they would not convert back exactly;
+    - bool, if all non-empty values are known string Trues or Falses, converted as text_to_bool();
+    - category, if the ratio of unique values to rows is at most category_threshold;
+    - str otherwise.
+    Empty values, i.e. None or "", become missing values.
+    """
+
+    _series = pd.Series(
+        [ (None if (_value is None or (isinstance(_value, str) and not _value.strip())) else _value) for _value in values ],
+        dtype=np.object_,
+    )
+    _present = _series.dropna()
+
+    if (dtype is None):
+        if (len(_present) <= 0):
+            return _series
+
+        _inferred = get_inferred_numeric(_present)
+
+        # Converted exactly; integers do not go through float64, which only holds 53 bits
+        if (_inferred == "int"):
+            return pd.Series(
+                [ (None if (_value is None) else int(_value.strip() if (isinstance(_value, str)) else _value)) for _value in _series ],
+                dtype="Int64",
+            )
+        elif (_inferred == "float"):
+            return pd.to_numeric(_series).astype(np.float64)
+        elif (_present.map(is_bool_text).all()):
+            dtype = "bool"
+        elif (_present.nunique() <= len(_series) * category_threshold):
+            dtype = "category"
+        else:
+            dtype = "str"
+
+    if (dtype in NUMERIC_TYPES):
+        # Explicit numeric dtypes accept units and separators, e.g. "1,234 g"; see extract_http.numeric
+        _numbers = pd.to_numeric(pd.Series(
+            [ (None if (isinstance(_number, NumericParseError)) else _number) for _number in parse_numbers(_series) ],
+            dtype=np.object_,
+        ))
+
+        if (dtype == "int"):
+            # Numbers that do not fit in int64, including infinities, are missing rather than wrapped around
+            _numbers = _numbers.astype(np.float64)
+            _numbers = _numbers.where(_numbers.abs() < 2.**63)
+            return _numbers.round().astype("Int64")
+        else:
+            return _numbers.astype(np.float64)
+    elif (dtype == "bool"):
+        _bools = _series.map(lambda _value: text_to_bool(_value) if (isinstance(_value, str)) else _value)
+        return _bools.astype("boolean") if (_bools.isna().any()) else _bools.astype(np.bool_)
+    elif (dtype == "category"):
+        return _series.astype("category")
+    elif (dtype == "str"):
+        return _series
+    else:
+        return _series.astype(dtype)
+
+
 class TableOrientation(Enum):
     HEADER_ROW = 0
     INDEX_COL = 1
@@ -73,17 +207,20 @@ class html_table():
         orient:TableOrientation=TableOrientation.HEADER_ROW,
         index:int=0,
     ):
-        # Put the whole table into a list of lists
-        _lists = cls._get_list_of_lists(obj)
+        with stage("html_table") as _stage:
+            # Put the whole table into a list of lists
+            _lists = cls._get_list_of_lists(obj)
+
+            # Get numpy array
+            _dataframe = cls._get_dataframe(_lists)
 
-        # Get numpy array
-        _dataframe = cls._get_dataframe(_lists)
+            if (orient is TableOrientation.INDEX_COL):
+                _dataframe = _dataframe.transpose()
 
-        if (orient is TableOrientation.INDEX_COL):
-            _dataframe = _dataframe.transpose()
+            _dataframe.columns = _dataframe.iloc[index,:]
+            _dataframe.drop(index, inplace=True)
 
-        _dataframe.columns = _dataframe.iloc[index,:]
-        _dataframe.drop(index, inplace=True)
+            _stage.add(count=len(_dataframe))
 
         return cls(_dataframe)
 
@@ -213,9 +350,24 @@ class html_table():
                 
         return _dataframe
 
+    @staticmethod
+    def get_header_text(
+        header:str,
+    )->str:
+        """
+        Normalised text of a header cell, which is used as the key of records.
+        """
+        _tag = create_tag(header)
+
+        if (_tag is not None):
+            return _tag.text.strip().replace("\n", " ")
+        else:
+            return None
+
     def export(
         self,
         keys:dict={}, # decides what to use as values out of the nodes
+        columns:Iterable[str]=None, # header texts of the columns to export; all of them if None
     ):
 
         if (isinstance(self.dataframe, pd.DataFrame)):
@@ -224,10 +376,23 @@ class html_table():
 
             _records = []
 
-            for _index, _row in self.dataframe.iterrows():
+            # Header text only needs to be worked out once per column
+            _record_keys = [ self.get_header_text(_key) for _key in self.dataframe.columns ]
+
+            # Cells of other columns are never parsed
+            if (columns is not None):
+                columns = set(columns)
+                _column_ids = [ _id for _id, _record_key in enumerate(_record_keys) if _record_key in columns ]
+                _record_keys = [ _record_keys[_id] for _id in _column_ids ]
+            else:
+                _column_ids = None
+
+            for _row in self.dataframe.itertuples(index=False, name=None):
+                if (_column_ids is not None):
+                    _row = [ _row[_id] for _id in _column_ids ]
+
                 _dict = {}
-                for _key, _value in _row.iteritems():
-                    _record_key = create_tag(_key).text.strip().replace("\n", " ")
+                for _record_key, _value in zip(_record_keys, _row):
                     _record_value = map_keys(
                         _record_key,
                         create_tag(_value),
@@ -241,6 +406,136 @@ class html_table():
         else:
             pass
 
+    def export_typed(
+        self,
+        keys:dict={}, # decides what to use as values out of the nodes
+        dtypes:dict=None,
+        category_threshold:float=DEFAULT_CATEGORY_THRESHOLD,
+        columns:Iterable[str]=None,
+    )->pd.DataFrame:
+        """
+        Like export(), but returns a DataFrame with one typed column per key.
+
+        dtypes is a dict of { key: dtype }; columns not in dtypes have their dtype inferred.
+        See get_typed_column() for the accepted dtypes and the inference rules.
+        """
+
+        _records = self.export(keys, columns=columns) or []
+        _dtypes = dtypes or {}
+
+        _keys = {}
+        for _record in _records:
+            for _key in _record:
+                _keys.setdefault(_key, None)
+
+        return pd.DataFrame({
+            _key: get_typed_column(
+                [ _record.get(_key, None) for _record in _records ],
+                dtype=_dtypes.get(_key, None),
+                category_threshold=category_threshold,
+            ).reset_index(drop=True) for _key in _keys
+        })
+
+    @classmethod
+    def combine(
+        cls,
+        tables:List[html_table],
+    )->html_table:
+        """
+        Outer join all tables in a single pass.
+
+        This produces the same rows as folding all tables into the first one with merge(),
+        but columns are aligned by their normalised header text instead of their HTML,
+        and the combined DataFrame is only allocated once at the end.
+
+        As with merge(), rows are joined where they agree on all the columns they share with the tables before them;
+        tables sharing no columns at all are appended.
+        """
+
+        _column_keys = []       # (header text, nth occurrence within its table)
+        _column_labels = {}     # column key -> the header HTML first seen
+        _rows = []              # dict of column key -> cell HTML
+
+        for _table in tables:
+            if (not isinstance(_table, html_table)):
+                continue
+
+            _occurrences = {}
+            _table_keys = []
+            for _label in _table.dataframe.columns:
+                _text = cls.get_header_text(_label)
+                _occurrences[_text] = _occurrences.get(_text, -1) + 1
+                _key = (_text, _occurrences[_text])
+
+                _table_keys.append(_key)
+                _column_labels.setdefault(_key, _label)
+
+            _table_rows = [
+                {
+                    _key: (None if (_value is None or pd.isna(_value)) else _value) \
+                        for _key, _value in zip(_table_keys, _row)
+                } for _row in _table.dataframe.itertuples(index=False, name=None)
+            ]
+
+            _common_keys = [ _key for _key in _column_keys if _key in _table_keys ]
+
+            if (not _rows or not _common_keys):
+                _rows += _table_rows
+            else:
+                # Hash join on the common columns.
+                # Like DataFrame.merge(), rows sharing the same key are kept together, in order of first appearance of the key.
+                _index = {}
+                for _row in _table_rows:
+                    _index.setdefault(
+                        tuple(_row.get(_key, None) for _key in _common_keys),
+                        [],
+                    ).append(_row)
+
+                _groups = {}
+                for _row in _rows:
+                    _groups.setdefault(
+                        tuple(_row.get(_key, None) for _key in _common_keys),
+                        [],
+                    ).append(_row)
+
+                _joined_rows = []
+                for _join_key, _group in _groups.items():
+                    _matches = _index.get(_join_key, None)
+
+                    for _row in _group:
+                        if (_matches):
+                            _joined_rows += [ { **_row, **_match } for _match in _matches ]
+                        else:
+                            _joined_rows.append(_row)
+
+                # Unmatched rows from the new table go to the end
+                for _join_key, _group in _index.items():
+                    if (_join_key not in _groups):
+                        _joined_rows += _group
+
+                _rows = _joined_rows
+
+            _column_keys += [ _key for _key in _table_keys if _key not in _column_keys ]
+
+        _array = np.full(
+            (len(_rows), len(_column_keys)),
+            np.nan,
+            dtype=np.object_,
+        )
+
+        for _row_id, _row in enumerate(_rows):
+            for _col_id, _key in enumerate(_column_keys):
+                _value = _row.get(_key, None)
+                if (_value is not None):
+                    _array[_row_id, _col_id] = _value
+
+        return cls(
+            pd.DataFrame(
+                _array,
+                columns=[ _column_labels[_key] for _key in _column_keys ],
+            )
+        )
+
     def merge(
         self,
         other:html_table,
@@ -251,4 +546,4 @@ class html_table():
                 how="outer",
             )
         else:
-            return self
+            return self
\ No newline at end of file
@@ -0,0 +1,735 @@
+"""
+instrument.py
+
+Lightweight per-stage instrumentation of the extraction pipeline.
+
+Each stage of the pipeline (curl, parse, find_all_nodes, get_value_*, transform_record, embed_base64, html_table)
+is wrapped in a stage() context, as is the extraction of each whole document (extract).
+While no collector is installed, stage() returns a shared no-op object, so instrumentation costs a single list check when disabled.
+
+Finer detail() stages, e.g. of each "values" key or "transform" step, are only opened for collectors
+that ask for them, such as profiler.
+
+Example:
+    with instrument.stage_stats() as _stats:
+        extract(config, art_no="A2000292")
+
+    print (_stats.report())
+"""
+
+import contextvars
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+# Installed collectors. This is replaced rather than mutated, so that stage() can read it without locking.
+_collectors = ()
+# Installed collectors that also receive detail() stages.
+_detailed_collectors = ()
+_collectors_lock = threading.Lock()
+
+# Labels (e.g. locate group, url) applying to all stages opened within the current context.
+_labels = contextvars.ContextVar("extract_http_instrument_labels", default={})
+
+# tracemalloc.reset_peak() is only available from Python 3.9; memory_tracer falls back without it.
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+
+class stage_frame():
+    """
+    A single timed execution of a stage.
+
+    Collectors receive this object on enter() and exit();
+    elapsed is only populated upon exit, and errors is incremented upon exit if the stage raised.
+    """
+
+    __slots__ = ("name", "labels", "start", "elapsed", "count", "nbytes", "errors", "data", "collectors")
+
+    def __init__(
+        self,
+        name:str,
+        labels:dict,
+        collectors:tuple=None,
+    ):
+        self.name = name
+        self.labels = labels
+        self.collectors = collectors if (collectors is not None) else _collectors
+        self.start = None
+        self.elapsed = None
+        self.count = 0
+        self.nbytes = 0
+        self.errors = 0
+        self.data = {}  # Scratch space for collectors, keyed by collector
+
+    def add(
+        self,
+        count:int=0,
+        nbytes:int=0,
+        errors:int=0,
+    ):
+        """
+        Add to the count of items, bytes and errors, e.g. failed transformations, processed by this stage.
+        """
+        self.count += count
+        self.nbytes += nbytes
+        self.errors += errors
+
+    def label(
+        self,
+        **labels,
+    ):
+        """
+        Add labels only known within the stage, e.g. the HTTP status of a fetch.
+        """
+        self.labels = {**self.labels, **labels}
+
+    def __enter__(self):
+        for _collector in self.collectors:
+            _collector.enter(self)
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.start
+
+        if (exc_type is not None):
+            self.errors += 1
+
+        for _collector in reversed(self.collectors):
+            _collector.exit(self)
+
+        return False
+
+
+class null_stage():
+    """
+    Do-nothing stand-in for stage_frame, returned when instrumentation is disabled.
+    """
+
+    __slots__ = ()
+
+    def add(self, count:int=0, nbytes:int=0, errors:int=0):
+        pass
+
+    def label(self, **labels):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_STAGE = null_stage()
+
+
+class stage_label():
+    """
+    Context applying labels to all stages opened inside it.
+    """
+
+    __slots__ = ("labels", "token")
+
+    def __init__(self, labels:dict):
+        self.labels = labels
+        self.token = None
+
+    def __enter__(self):
+        self.token = _labels.set({**_labels.get(), **self.labels})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _labels.reset(self.token)
+        return False
+
+
+def enabled()->bool:
+    """
+    Whether any collector is currently installed.
+    """
+    return bool(_collectors)
+
+
+def stage(
+    name:str,
+    **labels,
+):
+    """
+    Return a context manager timing the stage name.
+
+    Returns NULL_STAGE if no collectors are installed.
+    """
+    if (not _collectors):
+        return NULL_STAGE
+
+    _current_labels = _labels.get()
+    return stage_frame(name, {**_current_labels, **labels} if labels else _current_labels)
+
+
+def detail(
+    name:str,
+    key:str,
+):
+    """
+    Return a context manager timing a fine-grained stage name, e.g. a single "values" key,
+    for collectors with detailed = True only; key is its config path relative to the "path" label, e.g. "description.substitute".
+
+    Returns NULL_STAGE if no such collectors are installed.
+    """
+    if (not _detailed_collectors):
+        return NULL_STAGE
+
+    return stage_frame(name, {**_labels.get(), "key": key}, _detailed_collectors)
+
+
+def label(
+    **labels,
+):
+    """
+    Return a context manager applying labels to all stages opened within it, e.g.
+        with label(group=1):
+            ...
+
+    Returns NULL_STAGE if no collectors are installed.
+    """
+    if (not _collectors):
+        return NULL_STAGE
+
+    return stage_label(labels)
+
+
+def current_labels()->dict:
+    """
+    Labels applying to the current context.
+    """
+    return _labels.get()
+
+
+class collector():
+    """
+    Base class of all collectors.
+
+    Subclass and override enter() and/or exit(); then install() the collector, or use it as a context manager.
+    Collectors with detailed = True also receive detail() stages.
+    """
+
+    detailed = False
+
+    def enter(self, frame:stage_frame):
+        pass
+
+    def exit(self, frame:stage_frame):
+        pass
+
+    def install(self):
+        global _collectors, _detailed_collectors
+
+        with _collectors_lock:
+            if (self not in _collectors):
+                _collectors = _collectors + (self, )
+                _detailed_collectors = tuple(_collector for _collector in _collectors if _collector.detailed)
+
+        return self
+
+    def uninstall(self):
+        global _collectors, _detailed_collectors
+
+        with _collectors_lock:
+            _collectors = tuple(_collector for _collector in _collectors if _collector is not self)
+            _detailed_collectors = tuple(_collector for _collector in _collectors if _collector.detailed)
+
+        return self
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+        return False
+
+
+class callback_hook(collector):
+    """
+    Collector calling func(frame) on the exit of every stage.
+    """
+
+    def __init__(
+        self,
+        func:Callable[[stage_frame], Any],
+    ):
+        self.func = func
+
+    def exit(self, frame:stage_frame):
+        self.func(frame)
+
+
+def add_hook(
+    func:Callable[[stage_frame], Any],
+)->callback_hook:
+    """
+    Install a callback_hook calling func(frame) on the exit of every stage.
+
+    Returns the installed hook, which can be passed to remove_hook().
+    """
+    return callback_hook(func).install()
+
+
+def remove_hook(
+    hook:collector,
+)->None:
+    hook.uninstall()
+
+
+class stage_stats(collector):
+    """
+    Collector aggregating wall time, call counts, item counts, bytes and errors, per stage and per locate group.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def exit(self, frame:stage_frame):
+        _key = (frame.name, frame.labels.get("group", None))
+
+        with self._lock:
+            _stat = self._stats.get(_key, None)
+
+            if (_stat is None):
+                _stat = self._stats[_key] = {
+                    "calls": 0,
+                    "wall": 0.,
+                    "max": 0.,
+                    "count": 0,
+                    "bytes": 0,
+                    "errors": 0,
+                }
+
+            _stat["calls"] += 1
+            _stat["wall"] += frame.elapsed
+            _stat["max"] = max(_stat["max"], frame.elapsed)
+            _stat["count"] += frame.count
+            _stat["bytes"] += frame.nbytes
+            _stat["errors"] += frame.errors
+
+    def report(self)->Dict[str, dict]:
+        """
+        Return aggregated statistics as
+        {
+            "stages": {
+                stage_name: { "calls", "wall", "max", "count", "bytes", "errors" },
+            },
+            "groups": {
+                group_id: {
+                    stage_name: { "calls", "wall", "max", "count", "bytes", "errors" },
+                },
+            },
+        }
+        Stages not opened within a locate group are only included in "stages".
+        """
+        _stages = {}
+        _groups = {}
+
+        with self._lock:
+            _items = [ (_key, _stat.copy()) for _key, _stat in self._stats.items() ]
+
+        for (_name, _group), _stat in _items:
+            if (_group is not None):
+                _groups.setdefault(_group, {})[_name] = _stat.copy()
+
+            if (_name in _stages):
+                _total = _stages[_name]
+                _total["calls"] += _stat["calls"]
+                _total["wall"] += _stat["wall"]
+                _total["max"] = max(_total["max"], _stat["max"])
+                _total["count"] += _stat["count"]
+                _total["bytes"] += _stat["bytes"]
+                _total["errors"] += _stat["errors"]
+            else:
+                _stages[_name] = _stat
+
+        return {
+            "stages": _stages,
+            "groups": _groups,
+        }
+
+
+class traced_collector(collector):
+    """
+    Base class of collectors that need tracemalloc; tracing is started on install() if it is not already,
+    and stopped on uninstall() only if it was started here.
+    """
+
+    tracing = True
+    frames = 1
+
+    def install(self):
+        if (self.tracing and not tracemalloc.is_tracing()):
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+        return super().install()
+
+    def uninstall(self):
+        super().uninstall()
+
+        if (getattr(self, "_started_tracing", False)):
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        return self
+
+
+class profiler(traced_collector):
+    """
+    Collector attributing time, and optionally memory, to individual config paths, e.g. "locate[1].values.art_no"
+    or "locate[1].transform.description.substitute", aggregated over any number of extractions.
+
+    Paths are made of the "path" label, set by the pipeline for each locate group and transform, and the key of each detail() stage.
+    Fetching and parsing are attributed to "fetch" and "parse".
+
+    wall includes the time of any stages opened within; self excludes that of other paths opened within in the same thread.
+    If memory is True, tracemalloc is started, and alloc is the net memory allocated and kept by each path, in bytes.
+    """
+
+    detailed = True
+
+    # Stages that are not part of any config path
+    DOCUMENT_STAGES = {
+        "curl": "fetch",
+        "parse": "parse",
+    }
+
+    def __init__(
+        self,
+        memory:bool=False,
+    ):
+        self.memory = memory
+        self.tracing = memory
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def get_path(self, frame:stage_frame)->str:
+        if ("key" in frame.labels):
+            _path = frame.labels.get("path", None)
+            return f"{_path}.{frame.labels['key']}" if (_path) else frame.labels["key"]
+        else:
+            return self.DOCUMENT_STAGES.get(frame.name, None)
+
+    def enter(self, frame:stage_frame):
+        # Stack of the frames open in this thread, to deduct the time of inner frames from outer ones
+        _stack = getattr(self._local, "stack", None)
+        if (_stack is None):
+            _stack = self._local.stack = []
+
+        frame.data[self] = [ 0., 0, tracemalloc.get_traced_memory()[0] if (self.memory) else 0 ]
+        _stack.append(frame)
+
+    def exit(self, frame:stage_frame):
+        if (self not in frame.data):
+            # Opened before this profiler was installed
+            return
+
+        _stack = self._local.stack
+        _stack.pop()
+
+        _inner_wall, _inner_alloc, _start_memory = frame.data.pop(self)
+        _alloc = (tracemalloc.get_traced_memory()[0] - _start_memory) if (self.memory) else 0
+
+        _path = self.get_path(frame)
+
+        if (_path is None):
+            # Not attributed, so its time stays with the enclosing path
+            return
+
+        if (_stack):
+            _outer = _stack[-1].data.get(self, None)
+            if (_outer is not None):
+                _outer[0] += frame.elapsed
+                _outer[1] += _alloc
+
+        with self._lock:
+            _stat = self._stats.get(_path, None)
+
+            if (_stat is None):
+                _stat = self._stats[_path] = {
+                    "stage": frame.name,
+                    "calls": 0,
+                    "wall": 0.,
+                    "self": 0.,
+                    "alloc": 0,
+                    "self_alloc": 0,
+                }
+
+            _stat["calls"] += 1
+            _stat["wall"] += frame.elapsed
+            _stat["self"] += frame.elapsed - _inner_wall
+            _stat["alloc"] += _alloc
+            _stat["self_alloc"] += _alloc - _inner_alloc
+
+    def report(self)->Dict[str, dict]:
+        """
+        Return { path: { "stage", "calls", "wall", "self", "alloc", "self_alloc" } }.
+        """
+
+        with self._lock:
+            return { _path: _stat.copy() for _path, _stat in self._stats.items() }
+
+    def top(
+        self,
+        n:int=10,
+        by:str="self",
+    )->List[dict]:
+        """
+        The n paths with the highest by, e.g. "self", "wall" or "self_alloc", as a list of { "path", ... }.
+        """
+
+        _report = [ { "path": _path, **_stat } for _path, _stat in self.report().items() ]
+        _report.sort(key=lambda stat: stat[by], reverse=True)
+
+        return _report[:n]
+
+
+class memory_tracer(traced_collector):
+    """
+    Collector recording, with tracemalloc, the peak memory of each stage and of each document,
+    along with the top allocation sites of the stages in site_stages.
+
+    A document is a single entry to the "extract" stage, named by its "url" label; extracting the same url twice,
+    e.g. on a retry or with extract_many(), makes two documents.
+    Peaks are in bytes above the memory traced when the stage, or the document, started.
+    Documents whose peak exceeds threshold are flagged, and on_flag(url, document) is called if supplied.
+    Only the max_urls documents with the highest peaks are kept, besides the flagged ones.
+
+    Allocation sites are those of the memory still allocated at the end of the stage, compared to its start;
+    finding them takes a tracemalloc snapshot at both ends, which is costly, so per-record stages are left out by default.
+    tracemalloc traces the whole process, so peaks are the most accurate with one extraction running at a time.
+
+    On Python 3.8, which lacks tracemalloc.reset_peak(), the traced peak cannot be reset per stage:
+    a stage gets it only if it was raised during the stage, otherwise the highest memory traced as its stages opened and closed,
+    so peaks below the highest one seen so far can be under-reported.
+    """
+
+    SITE_STAGES = ("curl", "parse", "html_table", "embed_base64")
+    DOCUMENT_STAGE = "extract"
+
+    def __init__(
+        self,
+        threshold:int=512 * 1024 * 1024,
+        sites:int=10,
+        site_stages:tuple=SITE_STAGES,
+        frames:int=1,
+        max_urls:int=1000,
+        on_flag:Callable[[str, dict], Any]=None,
+    ):
+        self.threshold = threshold
+        self.sites = sites
+        self.site_stages = set(site_stages) if (sites) else set()
+        self.frames = frames
+        self.max_urls = max_urls
+        self.on_flag = on_flag
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._sites = {}
+            self._documents = []
+            self.flagged = []
+
+    def snapshot(self)->tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    def enter(self, frame:stage_frame):
+        _stack = getattr(self._local, "stack", None)
+        if (_stack is None):
+            _stack = self._local.stack = []
+
+        _current, _peak = tracemalloc.get_traced_memory()
+
+        # The peak is reset below, so pass it on to the frames already open first
+        for _open_frame in _stack:
+            _state = _open_frame.data.get(self, None)
+            if (_state is not None):
+                _state["peak"] = max(_state["peak"], self.get_peak(_state, _current, _peak))
+
+        if (_reset_peak is not None):
+            _reset_peak()
+
+        _outer_document = getattr(self._local, "document", None)
+        if (frame.name == self.DOCUMENT_STAGE):
+            # Each extraction is a new document, even of the same url as the last
+            self._local.document = self.get_document(frame.labels.get("url", None), _current)
+
+        frame.data[self] = {
+            "start": _current,
+            "peak": _current,
+            "traced_peak": _peak,
+            "snapshot": self.snapshot() if (frame.name in self.site_stages) else None,
+            "document": getattr(self._local, "document", None),
+            "outer_document": _outer_document,
+        }
+        _stack.append(frame)
+
+    def get_peak(
+        self,
+        state:dict,
+        current:int,
+        peak:int,
+    )->int:
+        """
+        Peak traced since the stage of state opened, or since the last reset of the peak.
+
+        Without tracemalloc.reset_peak(), the traced peak only belongs to the stage if it was raised since the stage opened;
+        otherwise current is the best known.
+        """
+
+        if (_reset_peak is not None or peak > state["traced_peak"]):
+            return peak
+
+        return current
+
+    def get_document(
+        self,
+        url:str,
+        start:int,
+    )->dict:
+        _document = {
+            "url": url,
+            "start": start,
+            "peak": 0,
+            "stages": {},
+            "flagged": False,
+        }
+
+        with self._lock:
+            if (len(self._documents) >= self.max_urls * 2):
+                self._documents.sort(key=lambda document: document["peak"], reverse=True)
+                del self._documents[self.max_urls:]
+
+            self._documents.append(_document)
+
+        return _document
+
+    def exit(self, frame:stage_frame):
+        _state = frame.data.pop(self, None)
+        if (_state is None):
+            # Opened before this tracer was installed
+            return
+
+        _stack = self._local.stack
+        _stack.pop()
+
+        _current, _peak = tracemalloc.get_traced_memory()
+        _peak = max(self.get_peak(_state, _current, _peak), _state["peak"])
+        _stage_peak = _peak - _state["start"]
+
+        if (_stack):
+            _outer = _stack[-1].data.get(self, None)
+            if (_outer is not None):
+                _outer["peak"] = max(_outer["peak"], _peak)
+
+        _sites = None
+        if (_state["snapshot"] is not None):
+            _sites = [
+                (f"{_stat.traceback[0].filename}:{_stat.traceback[0].lineno}", _stat.size_diff, _stat.count_diff) \
+                    for _stat in self.snapshot().compare_to(_state["snapshot"], "lineno")[:self.sites] if _stat.size_diff > 0
+            ]
+
+        _document = _state["document"]
+        _flagged = False
+
+        if (frame.name == self.DOCUMENT_STAGE):
+            self._local.document = _state["outer_document"]
+
+        with self._lock:
+            _stat = self._stages.get(frame.name, None)
+            if (_stat is None):
+                _stat = self._stages[frame.name] = {
+                    "calls": 0,
+                    "peak": 0,
+                    "total_peak": 0,
+                }
+
+            _stat["calls"] += 1
+            _stat["peak"] = max(_stat["peak"], _stage_peak)
+            _stat["total_peak"] += _stage_peak
+
+            if (_sites):
+                _stage_sites = self._sites.setdefault(frame.name, {})
+                for _site, _size, _count in _sites:
+                    _site_stat = _stage_sites.setdefault(_site, [ 0, 0 ])
+                    _site_stat[0] += _size
+                    _site_stat[1] += _count
+
+            if (_document is not None):
+                _document["peak"] = max(_document["peak"], _peak - _document["start"])
+                _document["stages"][frame.name] = max(_document["stages"].get(frame.name, 0), _stage_peak)
+
+                if (_document["peak"] > self.threshold and not _document["flagged"]):
+                    _document["flagged"] = _flagged = True
+                    self.flagged.append(_document)
+
+        if (_flagged and self.on_flag is not None):
+            self.on_flag(_document["url"], _document)
+
+    def report(
+        self,
+        documents:int=10,
+    )->Dict[str, Any]:
+        """
+        Return
+        {
+            "stages": {
+                stage_name: { "calls", "peak", "mean_peak", "sites": [ { "site", "size", "count" }, ] },
+            },
+            "documents": [ { "url", "peak", "stages": { stage_name: peak } }, ],
+            "flagged": [ { "url", "peak", "stages": { stage_name: peak } }, ],
+        }
+        where documents are the top documents by peak, and sites the top allocation sites by size, e.g. "extract.py:65".
+        """
+
+        _export = lambda document: {
+            "url": document["url"],
+            "peak": document["peak"],
+            "stages": document["stages"].copy(),
+        }
+
+        with self._lock:
+            _stages = {
+                _name: {
+                    "calls": _stat["calls"],
+                    "peak": _stat["peak"],
+                    "mean_peak": _stat["total_peak"] / _stat["calls"],
+                    "sites": [
+                        { "site": _site, "size": _size, "count": _count } for _site, (_size, _count) in sorted(
+                            self._sites.get(_name, {}).items(), key=lambda item: item[1][0], reverse=True,
+                        )[:self.sites]
+                    ],
+                } for _name, _stat in self._stages.items()
+            }
+            _documents = sorted(self._documents, key=lambda document: document["peak"], reverse=True)[:documents]
+
+            return {
+                "stages": _stages,
+                "documents": [ _export(_document) for _document in _documents ],
+                "flagged": [ _export(_document) for _document in self.flagged ],
+            }
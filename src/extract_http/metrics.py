@@ -0,0 +1,400 @@
+"""
+metrics.py
+
+Aggregated runtime metrics of the extraction pipeline, for long-running extraction services,
+exported in the Prometheus text format.
+
+- metrics_registry  : counters, gauges and histograms, rendered by render(), or served over HTTP by serve()
+- metrics_collector : an extract_http.instrument collector recording the stages of the pipeline into a registry
+
+Example:
+    _collector = metrics.metrics_collector().install()
+    _collector.registry.serve(9464)     # http://127.0.0.1:9464/metrics
+
+Recording a stage takes a few dict operations and a bisect under a lock, so the collector can stay installed in production.
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from extract_http.instrument import collector, stage_frame
+
+# Upper bounds of histogram buckets, in seconds and bytes
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+BYTES_BUCKETS = tuple(1024 * 4 ** _power for _power in range(9))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def escape_label(
+    value:Any,
+)->str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def format_labels(
+    names:Tuple[str],
+    values:Tuple[Any],
+    extra:str=None,
+)->str:
+    _pairs = [ f'{_name}="{escape_label(_value)}"' for _name, _value in zip(names, values) ]
+    if (extra):
+        _pairs.append(extra)
+
+    return "{" + ",".join(_pairs) + "}" if (_pairs) else ""
+
+def format_value(
+    value:float,
+)->str:
+    if (math.isinf(value)):
+        return "+Inf" if (value > 0) else "-Inf"
+    elif (isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    else:
+        return repr(value)
+
+class metric():
+    """
+    Base class of all metrics: a value for each combination of label values.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name:str,
+        help:str="",
+        labels:Iterable[str]=(),
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_key(
+        self,
+        labels:dict,
+    )->tuple:
+        return tuple(labels.get(_name, "") for _name in self.labels)
+
+    def set(
+        self,
+        value:float,
+        **labels,
+    ):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+    def get(
+        self,
+        **labels,
+    )->Any:
+        return self.values.get(self.get_key(labels), 0)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def samples(self)->List[Tuple[str, str, float]]:
+        """
+        (name, labels, value) of each sample, labels being formatted already.
+        """
+
+        with self.lock:
+            _items = list(self.values.items())
+
+        return [ (self.name, format_labels(self.labels, _key), _value) for _key, _value in sorted(_items, key=lambda item: tuple(map(str, item[0]))) ]
+
+    def snapshot(self)->List[dict]:
+        with self.lock:
+            return [ { "labels": dict(zip(self.labels, _key)), "value": _value } for _key, _value in self.values.items() ]
+
+class counter(metric):
+    type = "counter"
+
+    def inc(
+        self,
+        amount:float=1,
+        **labels,
+    ):
+        self.inc_key(self.get_key(labels), amount)
+
+    def inc_key(
+        self,
+        key:tuple,
+        amount:float=1,
+    ):
+        """
+        inc() with the label values already in the order of labels; used on hot paths.
+        """
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class gauge(metric):
+    type = "gauge"
+
+class histogram(metric):
+    """
+    Cumulative histogram; each value is [ bucket counts..., sum, count ].
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name:str,
+        help:str="",
+        labels:Iterable[str]=(),
+        buckets:Iterable[float]=TIME_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(
+        self,
+        value:float,
+        **labels,
+    ):
+        self.observe_key(self.get_key(labels), value)
+
+    def observe_key(
+        self,
+        key:tuple,
+        value:float,
+    ):
+        """
+        observe() with the label values already in the order of labels; used on hot paths.
+        """
+
+        # Counts are kept per bucket, and only made cumulative when rendered
+        _bucket = bisect_left(self.buckets, value)
+
+        with self.lock:
+            _value = self.values.get(key, None)
+            if (_value is None):
+                _value = self.values[key] = [ 0, ] * (len(self.buckets) + 3)
+
+            _value[_bucket] += 1
+            _value[-2] += value
+            _value[-1] += 1
+
+    def samples(self)->List[Tuple[str, str, float]]:
+        with self.lock:
+            _items = [ (_key, _value.copy()) for _key, _value in self.values.items() ]
+
+        _samples = []
+        for _key, _value in sorted(_items, key=lambda item: tuple(map(str, item[0]))):
+            _cumulative = 0
+            for _bound, _count in zip(self.buckets + (math.inf, ), _value):
+                _cumulative += _count
+                _samples.append((self.name + "_bucket", format_labels(self.labels, _key, f'le="{format_value(float(_bound))}"'), _cumulative))
+
+            _samples.append((self.name + "_sum", format_labels(self.labels, _key), _value[-2]))
+            _samples.append((self.name + "_count", format_labels(self.labels, _key), _value[-1]))
+
+        return _samples
+
+    def snapshot(self)->List[dict]:
+        with self.lock:
+            return [
+                {
+                    "labels": dict(zip(self.labels, _key)),
+                    "buckets": dict(zip(self.buckets + (math.inf, ), _value[:-2])),
+                    "sum": _value[-2],
+                    "count": _value[-1],
+                } for _key, _value in self.values.items()
+            ]
+
+class metrics_registry():
+    """
+    A set of metrics, rendered together.
+
+    Callbacks added by add_callback() are called with the registry before each render() or snapshot(),
+    to update metrics that are read from elsewhere, e.g. cache statistics.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def register(
+        self,
+        metric:metric,
+    )->metric:
+        """
+        Add metric, or return the metric already registered under its name.
+        """
+
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name:str, help:str="", labels:Iterable[str]=())->counter:
+        return self.register(counter(name, help, labels))
+
+    def gauge(self, name:str, help:str="", labels:Iterable[str]=())->gauge:
+        return self.register(gauge(name, help, labels))
+
+    def histogram(self, name:str, help:str="", labels:Iterable[str]=(), buckets:Iterable[float]=TIME_BUCKETS)->histogram:
+        return self.register(histogram(name, help, labels, buckets))
+
+    def add_callback(
+        self,
+        func:Callable[["metrics_registry"], Any],
+    ):
+        self.callbacks.append(func)
+
+    def collect(self)->List[metric]:
+        for _callback in self.callbacks:
+            _callback(self)
+
+        with self.lock:
+            return list(self.metrics.values())
+
+    def render(self)->str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+
+        _lines = []
+        for _metric in self.collect():
+            _lines.append(f"# HELP {_metric.name} {_metric.help}")
+            _lines.append(f"# TYPE {_metric.name} {_metric.type}")
+            for _name, _labels, _value in _metric.samples():
+                _lines.append(f"{_name}{_labels} {format_value(_value)}")
+
+        return "\n".join(_lines) + "\n"
+
+    def snapshot(self)->Dict[str, List[dict]]:
+        """
+        All metrics as { name: [ { "labels", "value" }, ] }; histograms have "buckets", "sum" and "count" instead of "value".
+        """
+
+        return { _metric.name: _metric.snapshot() for _metric in self.collect() }
+
+    def reset(self):
+        with self.lock:
+            _metrics = list(self.metrics.values())
+
+        for _metric in _metrics:
+            _metric.reset()
+
+    def serve(
+        self,
+        port:int=9464,
+        host:str="127.0.0.1",
+    )->ThreadingHTTPServer:
+        """
+        Serve render() at http://host:port/metrics from a daemon thread.
+
+        Returns the server; call shutdown() and server_close() on it to stop serving. Use port 0 for any free port.
+        """
+
+        _registry = self
+
+        class _handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if (self.path.split("?", 1)[0] not in ("/", "/metrics")):
+                    self.send_error(404)
+                    return
+
+                _body = _registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), _handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True, name="extract_http_metrics").start()
+
+        return _server
+
+def collect_cache_stats(
+    registry:metrics_registry,
+):
+    """
+    Callback updating the hits and misses of the caches of extract_http:
+    - "coalescer": requests served by an identical request in flight, see extract_http.fetch.COALESCER
+    - "row_class": record_row classes reused, see extract_http.record_group.make_row_class()
+    """
+
+    from extract_http.fetch import COALESCER
+    from extract_http.record_group import make_row_class
+
+    _coalescer = COALESCER.stats()
+    _row_class = make_row_class.cache_info()
+
+    _caches = {
+        "coalescer": (_coalescer["coalesced"], _coalescer["fetches"]),
+        "row_class": (_row_class.hits, _row_class.misses),
+    }
+
+    _hits = registry.counter("extract_http_cache_hits_total", "Lookups served from a cache.", ("cache", ))
+    _misses = registry.counter("extract_http_cache_misses_total", "Lookups not served from a cache.", ("cache", ))
+    _ratio = registry.gauge("extract_http_cache_hit_ratio", "Hits over all lookups of a cache.", ("cache", ))
+
+    for _cache, (_cache_hits, _cache_misses) in _caches.items():
+        _hits.set(_cache_hits, cache=_cache)
+        _misses.set(_cache_misses, cache=_cache)
+        _ratio.set(_cache_hits / (_cache_hits + _cache_misses) if (_cache_hits + _cache_misses) else 0., cache=_cache)
+
+class metrics_collector(collector):
+    """
+    Collector recording every stage into registry, a new metrics_registry if not supplied:
+    - extract_http_fetch_seconds{host, status}      : latency of each fetch; status is "error" if it raised
+    - extract_http_fetch_bytes{host}                : bytes of each response, as received
+    - extract_http_stage_seconds{stage}             : wall time of each stage, including "parse"
+    - extract_http_records_total{group}             : records emitted per locate group
+    - extract_http_stage_errors_total{stage}        : failures, e.g. transformations returning exceptions, or failed embeds
+    - extract_http_cache_*{cache}                   : see collect_cache_stats()
+    """
+
+    def __init__(
+        self,
+        registry:metrics_registry=None,
+    ):
+        self.registry = registry if (registry is not None) else metrics_registry()
+
+        self.fetch_seconds = self.registry.histogram(
+            "extract_http_fetch_seconds", "Latency of fetches.", ("host", "status"), TIME_BUCKETS,
+        )
+        self.fetch_bytes = self.registry.histogram(
+            "extract_http_fetch_bytes", "Bytes of responses as received.", ("host", ), BYTES_BUCKETS,
+        )
+        self.stage_seconds = self.registry.histogram(
+            "extract_http_stage_seconds", "Wall time of pipeline stages.", ("stage", ), TIME_BUCKETS,
+        )
+        self.records = self.registry.counter(
+            "extract_http_records_total", "Records emitted per locate group.", ("group", ),
+        )
+        self.errors = self.registry.counter(
+            "extract_http_stage_errors_total", "Failures within pipeline stages.", ("stage", ),
+        )
+
+        if (collect_cache_stats not in self.registry.callbacks):
+            self.registry.add_callback(collect_cache_stats)
+
+    def exit(self, frame:stage_frame):
+        _name = frame.name
+
+        if (_name == "curl"):
+            _host = frame.labels.get("host", "")
+            _status = frame.labels.get("status", "error") if (not frame.errors) else "error"
+            self.fetch_seconds.observe_key((_host, _status), frame.elapsed)
+            if (frame.nbytes):
+                self.fetch_bytes.observe_key((_host, ), frame.nbytes)
+        elif (_name.startswith("get_value_")):
+            self.records.inc_key((frame.labels.get("group", ""), ), frame.count)
+
+        self.stage_seconds.observe_key((_name, ), frame.elapsed)
+
+        if (frame.errors):
+            self.errors.inc_key((_name, ), frame.errors)
@@ -0,0 +1,277 @@
+"""
+numeric.py
+
+Parsing of numbers from scraped text, e.g. "1,234.5 kg", "1.234,5 €", "15 %" or "CHF 1'299.-".
+
+- parse_number()  : a single value
+- parse_numbers() : a list of values at once, converted by NumPy in bulk
+- convert_type()  : the "int" and "float" type transformations, see extract_http.transform
+
+The text must be a single number, which may only be surrounded by whitespace, a currency before it, e.g. "$" or "CHF ",
+and a unit after it, e.g. "kg", "%" or "€"; the unit may not contain digits.
+Anything else, e.g. "A2000292", "i7-12700K", "2022-05-10" or "pH-7", is not numeric, and is left as is by convert_type().
+Thousands separators can be ",", ".", "'", or spaces; the decimal separator can be "." or ",".
+
+When a number contains a single "," or "." only, it is ambiguous, e.g. "1,234" or "1.234".
+Unless decimal or locale is supplied, "." is then taken as the decimal separator,
+and "," as a thousands separator only if followed by exactly 3 digits, so "1,234" is 1234 but "1,5" is 1.5.
+"""
+
+import re
+from typing import Any, Iterable, List, Tuple, Union
+
+import numpy as np
+
+# Languages that use "," as the decimal separator; for all others, "." is assumed.
+DECIMAL_COMMA_LANGUAGES = (
+    "bg", "ca", "cs", "da", "de", "el", "es", "et", "fi", "fr", "hr", "hu", "id", "is", "it",
+    "lt", "lv", "nb", "nl", "nn", "no", "pl", "pt", "ro", "ru", "sk", "sl", "sr", "sv", "tr", "uk", "vi",
+)
+
+NUMERIC_TYPES = ("int", "float")
+
+# Characters that can only ever be thousands separators
+_GROUP_SEPARATORS = "'\u2019\u00a0\u202f "
+
+# Currencies that may precede a number; codes must be followed by whitespace, e.g. "CHF 1'299.-"
+CURRENCY_SYMBOLS = "$\u20ac\u00a3\u00a5\u20b9\u20bd\u20a9\u20aa\u20ab\u20ba\u20b4\u20a6\u0e3f\u00a2"
+CURRENCY_CODES = (
+    "AUD", "BRL", "CAD", "CHF", "CNY", "CZK", "DKK", "EUR", "GBP", "HKD", "HUF", "INR",
+    "JPY", "KRW", "MXN", "NOK", "NZD", "PLN", "RUB", "SEK", "SGD", "TRY", "USD", "ZAR",
+)
+
+# Matched against the whole text
+_NUMBER_PATTERN = re.compile(
+    r"\s*(?P<currency_sign>[-+\u2212])?"
+    r"(?:[" + re.escape(CURRENCY_SYMBOLS) + r"]\s*|(?:" + "|".join(CURRENCY_CODES) + r")\s+)?"
+    r"(?P<sign>[-+\u2212])?"
+    r"(?P<number>\d+(?:(?:[.,'\u2019\u00a0\u202f]|\s(?=\d{3}(?!\d)))\d+)*|[.,]\d+)"
+    r"(?:[eE](?P<exponent>[-+]?\d+))?"
+    r"(?:\s*(?P<percent>%))?"
+    r"(?P<unit>\D*)"
+)
+
+class NumericParseError(ValueError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+def get_decimal(
+    locale:str=None,
+    decimal:str=None,
+)->str:
+    """
+    Decimal separator to use for locale, e.g. "de_CH" or "fr-FR"; decimal overrides locale if supplied.
+
+    Returns None if neither is supplied, meaning the separator is decided per value.
+    """
+
+    if (decimal is not None):
+        return decimal
+
+    if (locale):
+        _language = re.split(r"[-_.@]", str(locale).lower(), maxsplit=1)[0]
+        return "," if (_language in DECIMAL_COMMA_LANGUAGES) else "."
+
+    return None
+
+def is_grouped(
+    groups:List[str],
+)->bool:
+    """
+    Whether groups of digits separated by a thousands separator are valid, i.e. 1-3 digits followed by groups of 3.
+    """
+
+    return (0 < len(groups[0]) <= 3) and all(len(_group) == 3 for _group in groups[1:])
+
+def normalise_number(
+    text:str,
+    decimal:str=None,
+)->Tuple[str, bool, bool]:
+    """
+    Parse the number in text, and return it as (normalised, is_integer, is_percent),
+    where normalised is a string that int() or float() accepts.
+
+    Returns None if text is not a single number, optionally with a currency and a unit, or its separators are inconsistent.
+    """
+
+    _match = _NUMBER_PATTERN.fullmatch(text)
+
+    if (not _match):
+        return None
+
+    # Signs on both sides of the currency, e.g. "-$-5"
+    if (_match.group("currency_sign") and _match.group("sign")):
+        return None
+
+    _number = _match.group("number")
+    _sign = "-" if ((_match.group("currency_sign") or _match.group("sign")) in ("-", "\u2212")) else ""
+    _exponent = _match.group("exponent")
+    _percent = _match.group("percent") is not None
+
+    # Every non-digit in _number is a separator
+    _separators = [ _char for _char in _number if not _char.isdigit() ]
+    _decimal = None
+
+    if (_separators):
+        _last = _separators[-1]
+        _kinds = set(_separators)
+
+        if (_last in _GROUP_SEPARATORS):
+            _decimal = None
+        elif (len(_kinds) > 1):
+            # e.g. "1,234.5" or "1.234,5" - the last one is the decimal separator, and must appear only once
+            if (_separators.count(_last) > 1):
+                return None
+            _decimal = _last
+        elif (len(_separators) > 1):
+            # e.g. "1,234,567"
+            _decimal = None
+        else:
+            _integer, _fraction = _number.split(_last)
+            if (decimal is not None):
+                _decimal = _last if (_last == decimal or not is_grouped([ _integer, _fraction ])) else None
+            elif (_last == "."):
+                _decimal = _last
+            else:
+                _decimal = None if (is_grouped([ _integer, _fraction ]) and _integer != "0") else _last
+
+    if (_decimal is not None):
+        _integer, _fraction = _number.rsplit(_decimal, maxsplit=1)
+    else:
+        _integer, _fraction = _number, ""
+
+    _groups = re.split(r"[^\d]", _integer)
+    if (len(_groups) > 1 and not is_grouped(_groups)):
+        return None
+
+    _normalised = _sign + ("".join(_groups) or "0")
+    _is_integer = not (_decimal or _exponent)
+
+    if (_decimal):
+        _normalised += "." + _fraction
+    if (_exponent):
+        _normalised += "e" + _exponent
+
+    return _normalised, _is_integer, _percent
+
+def to_python(
+    value:float,
+)->Union[int, float]:
+    """
+    Convert a float into an int if it has no fractional part.
+    """
+
+    if (value.is_integer()):
+        return int(value)
+    else:
+        return value
+
+def parse_numbers(
+    values:Iterable[Any],
+    locale:str=None,
+    decimal:str=None,
+    percent:bool=False,
+)->List[Union[int, float, NumericParseError]]:
+    """
+    Parse a list of values into numbers at once.
+
+    Integers are returned as int, and everything else as float, unless it has no fractional part.
+    If percent is True, values with a "%" sign are divided by 100; otherwise the sign is ignored like any other unit.
+    Values that are not numeric are returned as NumericParseError in their place.
+
+    Numbers, i.e. int and float, are returned as is; bools are not considered numeric.
+    """
+
+    _decimal = get_decimal(locale, decimal)
+
+    _values = list(values)
+    _return = [ None, ] * len(_values)
+
+    # Indices and normalised texts of the values that need float conversion
+    _float_ids = []
+    _float_texts = []
+    _percents = set()
+
+    for _id, _value in enumerate(_values):
+        if (isinstance(_value, bool)):
+            _return[_id] = NumericParseError(f"{_value!r} is not numeric.")
+        elif (isinstance(_value, (int, float))):
+            _return[_id] = _value
+        elif (isinstance(_value, str)):
+            _normalised = normalise_number(_value, _decimal)
+
+            if (_normalised is None):
+                _return[_id] = NumericParseError(f"{_value!r} is not numeric.")
+                continue
+
+            _text, _is_integer, _is_percent = _normalised
+
+            if (_is_integer and not (_is_percent and percent)):
+                # Exact, even beyond the precision of float64
+                _return[_id] = int(_text)
+            else:
+                _float_ids.append(_id)
+                _float_texts.append(_text)
+                if (_is_percent and percent):
+                    _percents.add(_id)
+        else:
+            _return[_id] = NumericParseError(f"{type(_value).__name__} {_value!r} is not numeric.")
+
+    if (_float_texts):
+        _floats = np.array(_float_texts, dtype=np.str_).astype(np.float64)
+
+        if (_percents):
+            _floats[[ (_id in _percents) for _id in _float_ids ]] /= 100
+
+        for _id, _float in zip(_float_ids, _floats.tolist()):
+            _return[_id] = to_python(_float)
+
+    return _return
+
+def parse_number(
+    value:Any,
+    locale:str=None,
+    decimal:str=None,
+    percent:bool=False,
+)->Union[int, float, NumericParseError]:
+    """
+    Parse a single value into a number; see parse_numbers().
+    """
+
+    return parse_numbers([ value, ], locale=locale, decimal=decimal, percent=percent)[0]
+
+def convert_type(
+    values:Union[Any, List[Any]],
+    type:str,
+    locale:str=None,
+    decimal:str=None,
+)->Union[Any, List[Any]]:
+    """
+    Convert a value, or a list of values, into type, which is one of "int" or "float".
+
+    Values that cannot be converted are returned as is; so are "int" texts with a fractional part.
+    """
+
+    _is_list = isinstance(values, list)
+    _values = values if (_is_list) else [ values, ]
+
+    _numbers = parse_numbers(_values, locale=locale, decimal=decimal)
+
+    _return = []
+    for _value, _number in zip(_values, _numbers):
+        if (isinstance(_number, NumericParseError)):
+            _return.append(_value)
+        elif (type == "float"):
+            _return.append(float(_number))
+        elif (isinstance(_value, str) and isinstance(_number, float) and not _number.is_integer()):
+            # Do not truncate text like "3.5"; numbers are truncated as int() would
+            _return.append(_value)
+        else:
+            try:
+                _return.append(int(_number))
+            except (OverflowError, ValueError) as e:
+                # inf and nan
+                _return.append(_value)
+
+    return _return if (_is_list) else _return[0]
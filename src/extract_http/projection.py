@@ -0,0 +1,199 @@
+"""
+projection.py
+
+Projection pushdown: compile a configuration down to the work that contributes to a list of requested fields.
+
+Fields are Key Strings of the records extracted, e.g. "name" or "specs>>>weight"; for HTML, they apply to the records of every locate group.
+- project_config() : configuration that only selects, extracts and transforms what the fields need
+- project_data()   : records cut down to the fields, nested keys included
+
+Example:
+    _config = project_config(config, [ "name", "price" ])
+
+    for _art_no in art_nos:
+        extract(_config, art_no=_art_no)
+"""
+
+import copy
+from typing import Any, Dict, Iterable, List, Set
+
+from extract_http.transform import get_top_key, prune_transform
+
+from extract_http.defaults import RECORD_DICT_DELIMITER
+
+def get_field_tree(
+    fields:Iterable[str],
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->Dict[str, Any]:
+    """
+    Nest fields into a tree of { key: subtree }, where a subtree of None takes the whole value, e.g.
+        [ "name", "specs>>>weight", "specs>>>height" ]
+    into
+        { "name": None, "specs": { "weight": None, "height": None } }
+    """
+
+    _tree = {}
+
+    for _field in fields:
+        _node = _tree
+        _keys = _field.split(delimiter)
+
+        for _id, _key in enumerate(_keys):
+            if (_key in _node and _node[_key] is None):
+                # Already taken whole by a shorter field
+                break
+
+            if (_id == len(_keys) - 1):
+                _node[_key] = None
+            else:
+                _node = _node.setdefault(_key, {})
+
+    return _tree
+
+def project_value(
+    value:Any,
+    tree:Dict[str, Any],
+)->Any:
+    if (isinstance(value, dict)):
+        return project_record(value, tree)
+    elif (isinstance(value, list)):
+        # Lists of records are projected item by item, like Key Strings iterate them
+        return [ project_value(_item, tree) for _item in value ]
+    else:
+        return value
+
+def project_record(
+    record:dict,
+    tree:Dict[str, Any],
+)->dict:
+    """
+    New dict of the keys of record in tree, in the order of tree; keys missing from record are left out.
+    """
+
+    _return = {}
+
+    for _key, _subtree in tree.items():
+        if (_key in record):
+            _return[_key] = record[_key] if (_subtree is None) else project_value(record[_key], _subtree)
+
+    return _return
+
+def project_data(
+    data:Any,
+    fields:Iterable[str],
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->Any:
+    """
+    Cut a record, or a list of records, down to fields.
+
+    Anything else, e.g. a DataFrame of a typed table output, is returned as is.
+    """
+
+    _tree = get_field_tree(fields, delimiter=delimiter)
+
+    if (isinstance(data, dict)):
+        return project_record(data, _tree)
+    elif (isinstance(data, list)):
+        return [ project_record(_record, _tree) if (isinstance(_record, dict)) else _record for _record in data ]
+    else:
+        return data
+
+def project_selectors(
+    selectors:Dict[str, str],
+    needed:Set[str],
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->Dict[str, str]:
+    return { _key:_selector for _key, _selector in selectors.items() if get_top_key(_key, delimiter) in needed }
+
+def project_locate_group(
+    locate_group:dict,
+    fields:List[str],
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->dict:
+    """
+    Copy of locate_group that only extracts and transforms the top level keys that fields need,
+    or None if neither its selectors nor its "transform" write any of them.
+
+    - "transform" keeps the keys that write what is needed, and what they read is needed too; see extract_http.transform.prune_transform();
+    - "values" keeps the selectors of needed keys; the others are moved to "counted", as they still decide the number of records,
+      but their values are only extracted where that number depends on them, see extract_http.html_node.get_value_records();
+    - "lists" keeps the selectors of needed keys, as its group is a single record anyway;
+    - "table" only exports the columns whose header texts are needed, see locate[] > table > columns;
+    - "array" is kept whole, as its keys are only known from the page.
+    Its records are then cut down to fields, under "fields", so that they are the same as those of the full group cut down by project_data().
+    """
+
+    _needed = { get_top_key(_field, delimiter) for _field in fields }
+
+    _transform, _needed = prune_transform(
+        locate_group.get("transform", {}) or {},
+        _needed,
+        delimiter=delimiter,
+    )
+
+    _return = {
+        **locate_group,
+        "transform": _transform,
+        "fields": list(fields),
+    }
+
+    if (locate_group.get("values", None)):
+        _return["values"] = project_selectors(locate_group["values"], _needed, delimiter=delimiter)
+        _counted = { _key:_selector for _key, _selector in locate_group["values"].items() if _key not in _return["values"] }
+
+        if (not _return["values"] and not _transform):
+            return None
+
+        if (_counted):
+            _return["counted"] = _counted
+    elif (locate_group.get("lists", None)):
+        _return["lists"] = project_selectors(locate_group["lists"], _needed, delimiter=delimiter)
+
+        if (not _return["lists"] and not _transform):
+            return None
+    elif (locate_group.get("array", None) or locate_group.get("record", None)):
+        pass
+    elif (locate_group.get("table", None)):
+        _columns = locate_group["table"].get("columns", None)
+
+        _return["table"] = {
+            **locate_group["table"],
+            "columns": sorted(_needed if (_columns is None) else _needed.intersection(_columns)),
+        }
+
+    return _return
+
+def project_config(
+    config:dict,
+    fields:Iterable[str],
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->dict:
+    """
+    Compile config down to the selectors, extractors, table columns and transformations, embeds included,
+    that contribute to fields; config itself is not modified.
+
+    Locate groups that contribute nothing are replaced by None, and yield no records, so that the other groups keep their index;
+    the records of the others are the same as those of config cut down by project_data().
+    JSON documents are not pruned, as they are fetched whole; only the "transform" is.
+    The result can be extracted any number of times.
+    """
+
+    fields = list(fields)
+    _return = copy.copy(config)
+
+    if (config.get("locate", None)):
+        _return["locate"] = [
+            project_locate_group(_locate_group, fields, delimiter=delimiter) if (_locate_group is not None) else None \
+                for _locate_group in config["locate"]
+        ]
+    else:
+        _transform, _ = prune_transform(
+            config.get("transform", None) or {},
+            { get_top_key(_field, delimiter) for _field in fields },
+            delimiter=delimiter,
+        )
+
+        _return["transform"] = _transform
+        _return["fields"] = fields
+
+    return _return
@@ -0,0 +1,315 @@
+"""
+record_group.py
+
+A compact container of records extracted by a single "locate" group.
+
+Instead of one dict per record, all records share one tuple of keys (the schema);
+each record then only holds its values, in one of the following layouts:
+- "rows"    : one tuple per record
+- "columns" : one list per key
+- "slots"   : one instance per record, of a class with __slots__ generated for the schema
+
+Records are converted back into record_dict objects on demand only, e.g.
+    _group = record_group.from_records(records, layout="columns")
+    _group.get("Employment>>>Salary")   # List of all salaries
+    _group[0]                           # record_dict of the first record
+    _group.to_list()                    # List of dicts, as returned without compaction
+"""
+
+from functools import lru_cache
+import keyword
+from typing import Any, Iterable, Iterator, List, Tuple, Union
+
+from extract_http.record_dict import record_dict, RecordNodeNotFound
+
+from extract_http.defaults import RECORD_DICT_DELIMITER
+
+RECORD_GROUP_LAYOUTS = ("rows", "columns", "slots")
+
+class RecordGroupLayoutInvalid(ValueError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class missing_value():
+    """
+    Placeholder for keys that a record does not have, as opposed to having the value None.
+    """
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __reduce__(self):
+        # Pickled by reference to the module level MISSING, so that "is MISSING" still holds once unpickled
+        return "MISSING"
+
+MISSING = missing_value()
+
+
+class record_row():
+    """
+    Base class of the generated __slots__ row classes.
+
+    Subclasses define _schema as the tuple of keys, and one slot for each.
+    """
+
+    __slots__ = ()
+    _schema = ()
+
+    def __init__(self, *values):
+        for _slot, _value in zip(self.__slots__, values):
+            setattr(self, _slot, _value)
+
+    def values(self)->Tuple[Any]:
+        return tuple(getattr(self, _slot) for _slot in self.__slots__)
+
+    def __getitem__(self, key:str)->Any:
+        try:
+            _value = getattr(self, self.__slots__[self._schema.index(key)])
+        except ValueError as e:
+            raise KeyError(key)
+
+        if (_value is MISSING):
+            raise KeyError(key)
+
+        return _value
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(repr(_value) for _value in self.values())})"
+
+    def __reduce__(self):
+        # Generated classes cannot be found by name, so rows are pickled as their schema and values instead
+        return (_make_row, (self._schema, self.values()))
+
+
+@lru_cache(maxsize=None)
+def make_row_class(
+    keys:Tuple[str],
+)->type:
+    """
+    Generate a record_row subclass with one slot for each key.
+
+    If all keys are valid identifiers, they are used as slot names, allowing attribute access e.g. row.art_no;
+    otherwise all slots are named positionally as _0, _1...
+    """
+
+    if (all(isinstance(_key, str) and _key.isidentifier() and not keyword.iskeyword(_key) and not hasattr(record_row, _key) for _key in keys)):
+        _slots = tuple(keys)
+    else:
+        _slots = tuple(f"_{_id}" for _id in range(len(keys)))
+
+    return type(
+        "record_row_" + str(abs(hash(keys))),
+        (record_row, ),
+        {
+            "__slots__": _slots,
+            "_schema": keys,
+        },
+    )
+
+def _make_row(
+    schema:Tuple[str],
+    values:Tuple[Any],
+)->record_row:
+    """
+    Unpickle a record_row, see record_row.__reduce__().
+    """
+    return make_row_class(schema)(*values)
+
+
+class record_group():
+    """
+    Records of a single "locate" group sharing one key schema.
+    """
+
+    def __init__(
+        self,
+        keys:Tuple[str],
+        data:Union[list, dict],
+        layout:str="rows",
+    ):
+        """
+        Use record_group.from_records() instead, unless the data is already in the desired layout:
+        - "rows"    : data is a list of tuples
+        - "columns" : data is a dict of { key: list }
+        - "slots"   : data is a list of make_row_class(keys) instances
+        """
+        self.keys = tuple(keys)
+        self.data = data
+        self.layout = layout
+
+    @classmethod
+    def from_records(
+        cls,
+        records:Iterable[dict],
+        layout:str="rows",
+    )->"record_group":
+        """
+        Compact dicts into a record_group.
+
+        The schema is the union of keys of all records, in order of first appearance;
+        keys absent in a record are stored as MISSING, and will not appear when the record is converted back to a dict.
+
+        records are consumed in a single pass, each turned into a row as soon as it is produced,
+        so a generator of records is never held in memory as dicts all at once.
+        """
+
+        if (layout is True):
+            layout = "rows"
+
+        if (layout not in RECORD_GROUP_LAYOUTS):
+            _exception = RecordGroupLayoutInvalid(f"Layout '{layout}' is not one of {', '.join(RECORD_GROUP_LAYOUTS)}.")
+            raise _exception
+
+        _keys = {}
+        _rows = []
+
+        for _record in records:
+            for _key in _record:
+                _keys.setdefault(_key, None)
+
+            _rows.append(tuple(_record.get(_key, MISSING) for _key in _keys))
+
+        _keys = tuple(_keys)
+
+        # Rows made before the last keys appeared are padded
+        _rows = [
+            _row if (len(_row) == len(_keys)) else _row + (MISSING, ) * (len(_keys) - len(_row)) for _row in _rows
+        ]
+
+        if (layout == "columns"):
+            _data = {
+                _key: list(_column) for _key, _column in zip(_keys, zip(*_rows))
+            } if _rows else { _key: [] for _key in _keys }
+        elif (layout == "slots"):
+            _row_class = make_row_class(_keys)
+            _data = [ _row_class(*_row) for _row in _rows ]
+        else:
+            _data = _rows
+
+        return cls(_keys, _data, layout=layout)
+
+    def __len__(self)->int:
+        if (self.layout == "columns"):
+            return len(next(iter(self.data.values()), []))
+        else:
+            return len(self.data)
+
+    def row(
+        self,
+        index:int,
+    )->Tuple[Any]:
+        """
+        Values of the record at index, in the order of keys.
+        """
+
+        if (self.layout == "columns"):
+            return tuple(self.data[_key][index] for _key in self.keys)
+        elif (self.layout == "slots"):
+            return self.data[index].values()
+        else:
+            return self.data[index]
+
+    def rows(self)->Iterator[Tuple[Any]]:
+        if (self.layout == "columns"):
+            return zip(*(self.data[_key] for _key in self.keys))
+        elif (self.layout == "slots"):
+            return (_row.values() for _row in self.data)
+        else:
+            return iter(self.data)
+
+    def column(
+        self,
+        key:str,
+    )->List[Any]:
+        """
+        Values of key for all records; MISSING where the record does not have the key.
+        """
+
+        if (self.layout == "columns"):
+            return self.data[key]
+
+        _index = self.keys.index(key)
+        return [ _row[_index] for _row in self.rows() ]
+
+    def __getitem__(
+        self,
+        index:int,
+    )->record_dict:
+        """
+        Record at index, as a record_dict.
+        """
+        return record_dict(
+            (_key, _value) for _key, _value in zip(self.keys, self.row(index)) if (_value is not MISSING)
+        )
+
+    def __iter__(self)->Iterator[record_dict]:
+        for _row in self.rows():
+            yield record_dict(
+                (_key, _value) for _key, _value in zip(self.keys, _row) if (_value is not MISSING)
+            )
+
+    def get(
+        self,
+        key:Union[str, list],
+        default:Any=RecordNodeNotFound("Requested node does not exist."),
+        delimiter:str=RECORD_DICT_DELIMITER,
+        **kwargs,
+    )->List[Any]:
+        """
+        Like record_dict.get(), but returns a list of the values from all records.
+
+        The first key of the Key String is looked up in the schema,
+        so that only the records with nested values are converted into record_dict.
+        """
+
+        if (isinstance(key, str)):
+            key = key.split(delimiter)
+        else:
+            key = list(key)
+
+        _first_key = key.pop(0)
+
+        if (_first_key not in self.keys):
+            return [ default for _ in range(len(self)) ]
+
+        _values = []
+        for _value in self.column(_first_key):
+            if (_value is MISSING):
+                _values.append(default)
+            elif (len(key) <= 0):
+                _values.append(_value)
+            else:
+                _values.append(
+                    record_dict({ _first_key: _value }).get(
+                        [ _first_key, ] + key,
+                        default=default,
+                        delimiter=delimiter,
+                        **kwargs,
+                    )
+                )
+
+        return _values
+
+    def to_list(self)->List[dict]:
+        """
+        Convert back into a list of dicts.
+        """
+        return [ dict(_record) for _record in self ]
+
+    def __eq__(self, other:Any)->bool:
+        if (isinstance(other, record_group)):
+            return self.to_list() == other.to_list()
+        elif (isinstance(other, list)):
+            return self.to_list() == other
+        else:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}(keys={self.keys!r}, layout={self.layout!r}, records={len(self)})"
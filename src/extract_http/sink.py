@@ -0,0 +1,402 @@
+"""
+sink.py
+
+Streaming output of extracted records.
+
+Records are serialised and written by a background thread, through a bounded queue:
+when the disk falls behind, sink.write() blocks until there is room in the queue again,
+which in turn holds back extraction in extract_http.batch.extract_batch().
+
+- ndjson_sink : one JSON object per line
+- csv_sink    : one row per record; nested values are written as JSON
+
+Both support compression, chosen by compression="gzip" or "zstd", or by the extension of path (.gz, .zst).
+zstd requires the optional zstandard package; install with
+    pip install extract_http[zstd]
+
+Example:
+    with ndjson_sink("output.ndjson.gz") as _sink:
+        for _record in records:
+            _sink.write(_record)
+"""
+
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+from typing import Any, Iterable, List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from extract_http.record_group import record_group
+
+SINK_COMPRESSIONS = (None, "gzip", "zstd")
+
+class SinkClosed(RuntimeError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class SinkWriteError(IOError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class SinkDependencyMissing(ImportError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+# Marks the end of the queue
+_SINK_END = object()
+
+class _sink_flush():
+    """
+    Queued by flush(); set once everything queued before it is written and synced to disk.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+def json_default(
+    obj:Any,
+)->Any:
+    """
+    Serialise objects that json does not support natively:
+    bytes as base64 text, record_group as a list of records, and anything else as str().
+    """
+
+    if (isinstance(obj, (bytes, bytearray))):
+        return base64.b64encode(obj).decode("ascii")
+    elif (isinstance(obj, record_group)):
+        return obj.to_list()
+    elif (hasattr(obj, "tolist")):
+        # numpy scalars and arrays
+        return obj.tolist()
+    else:
+        return str(obj)
+
+def get_compression(
+    path:str,
+    compression:str=None,
+)->str:
+    if (compression is None):
+        _path = str(path).lower()
+        if (_path.endswith(".gz")):
+            compression = "gzip"
+        elif (_path.endswith((".zst", ".zstd"))):
+            compression = "zstd"
+
+    if (compression not in SINK_COMPRESSIONS):
+        raise ValueError(f"Compression '{compression}' is not one of {', '.join(str(_compression) for _compression in SINK_COMPRESSIONS)}.")
+
+    return compression
+
+def open_binary(
+    path:str,
+    compression:str=None,
+    append:bool=False,
+    buffer_size:int=1024*1024,
+    level:int=None,
+)->io.IOBase:
+    """
+    Open path for binary writing, with compression if requested.
+
+    Appending to compressed files adds a new gzip member or zstd frame, which readers of both formats concatenate.
+    """
+
+    _mode = "ab" if append else "wb"
+
+    if (compression == "gzip"):
+        # gzip.open() owns the underlying file, so that closing it closes the file too
+        return io.BufferedWriter(
+            gzip.open(
+                path,
+                _mode,
+                compresslevel=level if (level is not None) else 6,
+            ),
+            buffer_size=buffer_size,
+        )
+    elif (compression == "zstd"):
+        if (zstandard is None):
+            _exception = SinkDependencyMissing("zstandard is required for zstd compression; install extract_http[zstd].")
+            raise _exception
+
+        return zstandard.ZstdCompressor(level=level if (level is not None) else 3).stream_writer(
+            open(path, _mode, buffering=buffer_size),
+            closefd=True,
+        )
+    else:
+        return open(path, _mode, buffering=buffer_size)
+
+
+class base_sink():
+    """
+    Base class of all sinks.
+
+    Subclasses implement open(), write_record() and close_file(), all of which are called from the writer thread only.
+    """
+
+    def __init__(
+        self,
+        path:str,
+        compression:str=None,
+        append:bool=False,
+        max_queue:int=1024,
+        buffer_size:int=1024*1024,
+        level:int=None,
+    ):
+        """
+        max_queue is the number of records that can be waiting to be written before write() blocks.
+        """
+
+        self.path = path
+        self.compression = get_compression(path, compression)
+        self.append = append
+        self.buffer_size = buffer_size
+        self.level = level
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.records = 0
+        self.closed = False
+
+        self.file = None
+        self.thread = threading.Thread(target=self.run, name=f"{type(self).__name__}({path})", daemon=True)
+        self.thread.start()
+
+    def open(self):
+        self.file = open_binary(
+            self.path,
+            compression=self.compression,
+            append=self.append,
+            buffer_size=self.buffer_size,
+            level=self.level,
+        )
+
+    def write_record(self, record:Any):
+        raise NotImplementedError()
+
+    def close_file(self):
+        if (self.file is not None):
+            self.file.close()
+            self.file = None
+
+    def sync_file(self):
+        """
+        Flush everything written so far through any buffers and compressors, and fsync it.
+        Compressed streams remain readable up to this point even if the process dies afterwards.
+        """
+
+        if (self.file is None):
+            return
+
+        self.file.flush()
+
+        # io.BufferedWriter does not flush its raw stream, e.g. the gzip compressor
+        _raw = getattr(self.file, "raw", None)
+        if (_raw is not None):
+            _raw.flush()
+
+        try:
+            os.fsync(self.file.fileno())
+        except (AttributeError, OSError, io.UnsupportedOperation) as e:
+            pass
+
+    def run(self):
+        """
+        Writer thread.
+
+        Any exception is kept in self.error, and raised by the next write() or close();
+        the queue is still drained so that writers never block indefinitely.
+        """
+
+        try:
+            self.open()
+        except Exception as e:
+            self.error = SinkWriteError(f"Cannot open {self.path}: {e}")
+
+        while (True):
+            _record = self.queue.get()
+
+            try:
+                if (_record is _SINK_END):
+                    break
+                elif (isinstance(_record, _sink_flush)):
+                    if (self.error is None):
+                        self.sync_file()
+                    _record.event.set()
+                elif (self.error is None):
+                    self.write_record(_record)
+                    self.records += 1
+            except Exception as e:
+                self.error = SinkWriteError(f"Cannot write to {self.path}: {e}")
+            finally:
+                self.queue.task_done()
+
+        try:
+            self.close_file()
+        except Exception as e:
+            if (self.error is None):
+                self.error = SinkWriteError(f"Cannot close {self.path}: {e}")
+
+    def write(
+        self,
+        record:Any,
+        timeout:float=None,
+    ):
+        """
+        Queue a record for writing; blocks while the queue is full.
+        """
+
+        if (self.error is not None):
+            raise self.error
+
+        if (self.closed):
+            _exception = SinkClosed(f"{type(self).__name__} for {self.path} is already closed.")
+            raise _exception
+
+        self.queue.put(record, timeout=timeout)
+
+    def write_many(
+        self,
+        records:Iterable[Any],
+    ):
+        for _record in records:
+            self.write(_record)
+
+    def flush(
+        self,
+        timeout:float=None,
+    ):
+        """
+        Block until all records queued so far are written and synced to disk.
+        """
+
+        if (self.error is not None):
+            raise self.error
+
+        if (self.closed):
+            return
+
+        _flush = _sink_flush()
+        self.queue.put(_flush, timeout=timeout)
+        _flush.event.wait(timeout)
+
+        if (self.error is not None):
+            raise self.error
+
+    def pending(self)->int:
+        """
+        Number of records waiting to be written.
+        """
+        return self.queue.qsize()
+
+    def close(self):
+        """
+        Write all queued records, and close the file.
+        """
+
+        if (not self.closed):
+            self.closed = True
+            self.queue.put(_SINK_END)
+            self.thread.join()
+
+        if (self.error is not None):
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class ndjson_sink(base_sink):
+    """
+    Write each record as a JSON object on its own line.
+    """
+
+    def write_record(self, record:Any):
+        self.file.write(
+            json.dumps(record, default=json_default, ensure_ascii=False).encode("utf-8") + b"\n"
+        )
+
+
+class csv_sink(base_sink):
+    """
+    Write each record as a CSV row.
+
+    The columns are fieldnames if supplied, otherwise the keys of the first record;
+    keys of later records that are not in the columns are ignored.
+    Values that are lists or dicts are written as JSON, and bytes as base64 text.
+    """
+
+    def __init__(
+        self,
+        path:str,
+        fieldnames:List[str]=None,
+        header:bool=None,
+        dialect:str="excel",
+        **kwargs,
+    ):
+        """
+        header decides whether the column names are written as the first row;
+        by default this is done unless appending.
+        """
+
+        self.fieldnames = fieldnames
+        self.header = header if (header is not None) else (not kwargs.get("append", False))
+        self.dialect = dialect
+        self.text = None
+        self.writer = None
+
+        super().__init__(path, **kwargs)
+
+    def open(self):
+        super().open()
+        self.text = io.TextIOWrapper(self.file, encoding="utf-8", newline="", write_through=True)
+
+    def write_record(self, record:dict):
+        if (self.writer is None):
+            if (self.fieldnames is None):
+                self.fieldnames = list(record)
+
+            self.writer = csv.DictWriter(
+                self.text,
+                fieldnames=self.fieldnames,
+                extrasaction="ignore",
+                dialect=self.dialect,
+            )
+
+            if (self.header):
+                self.writer.writeheader()
+
+        self.writer.writerow({
+            _key: self.get_cell(_value) for _key, _value in record.items()
+        })
+
+    @staticmethod
+    def get_cell(value:Any)->Any:
+        if (isinstance(value, (list, dict))):
+            return json.dumps(value, default=json_default, ensure_ascii=False)
+        elif (isinstance(value, (bytes, bytearray))):
+            return json_default(value)
+        else:
+            return value
+
+    def close_file(self):
+        if (self.text is not None):
+            self.text.flush()
+            self.text.detach()
+            self.text = None
+
+        super().close_file()
@@ -5,19 +5,25 @@
 import warnings
 
 from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from datetime import datetime
 from enum import Enum
 import math
 import re
 import string
-from typing import Iterable, Union, List
+from typing import Iterable, Union, List, Set, Tuple
 from urllib.parse import urljoin
 
 from extract_http.bin import curl, \
                              formatters, \
-                             safe_zip, \
+                             assemble_records, \
                              text_to_bool
+from extract_http.numeric import parse_numbers, \
+                                 convert_type, \
+                                 NumericParseError, \
+                                 NUMERIC_TYPES
 from extract_http.record_dict import record_dict
+from extract_http.instrument import stage, detail
 
 from extract_http.defaults import RECORD_DICT_DELIMITER
 
@@ -104,22 +110,27 @@ def get_numeric_value(
     text: str,
     return_err: bool=True,
 )->Union[float,int]:
+    """
+    Parse text, or a list of texts, into numbers; see extract_http.numeric.parse_numbers().
+
+    Texts that are not numeric are returned as ArithmaticCalculationError if return_err, or dropped otherwise.
+    """
+
     if (isinstance(text, list) and not isinstance(text, str)):
         value = []
-        for _item in text:
-            _item_value = get_numeric_value(_item, return_err=return_err)
+        for _item_value in parse_numbers(text):
+            if (isinstance(_item_value, NumericParseError)):
+                if (not return_err):
+                    continue
+                _item_value = ArithmaticCalculationError(str(_item_value))
 
-            if (not isinstance(_item_value, Exception) or return_err):
-                value.append(_item_value)
+            value.append(_item_value)
 
     else: 
-        try:
-            value = float(text)
-        except ValueError as e:
-            return ArithmaticCalculationError(str(e))
+        value = parse_numbers([ text, ])[0]
 
-        if (value.is_integer()):
-            value = int(text)
+        if (isinstance(value, NumericParseError)):
+            return ArithmaticCalculationError(str(value))
         
     return value
 
@@ -195,6 +206,121 @@ class transform_formatter(string.Formatter):
         return super().format_field(value, python_format_spec)
 
 
+def get_top_key(
+    key:str,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->str:
+    """
+    Top level key of a Key String, e.g. "key1" for "key1>>>key2".
+    """
+
+    return key.split(delimiter, maxsplit=1)[0]
+
+def count_transform_errors(
+    transform:dict,
+    record:dict,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->int:
+    """
+    Number of values in the top level keys written by transform that are exceptions, i.e. failed transformations.
+    """
+
+    _count = 0
+
+    for _top_key in { get_top_key(_key, delimiter) for _key in transform }:
+        _value = record.get(_top_key, None) if (isinstance(record, dict)) else None
+        _values = _value if (isinstance(_value, list)) else [ _value, ]
+        _count += sum(1 for _item in _values if isinstance(_item, Exception))
+
+    return _count
+
+def get_transform_dependencies(
+    transform:dict,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->dict:
+    """
+    Return { key: (reads, writes) } for each key in transform,
+    where reads and writes are sets of the top level keys of the record that the transformation of key reads and writes.
+
+    reads are taken from the {field} references in "source"; if "source" is not supplied, the key reads itself.
+    Field names are also stripped of any attribute or index, e.g. {price.real} or {sizes[0]}, to be safe.
+    """
+
+    _dependencies = {}
+
+    for _key, _settings in transform.items():
+        _source = _settings.get("source", None) or f"{{{_key}}}"
+
+        _reads = set()
+        for _formatter in formatters(_source):
+            _top_key = get_top_key(_formatter, delimiter=delimiter)
+            _reads.add(_top_key)
+            _reads.add(re.split(r"[.\[]", _top_key, maxsplit=1)[0])
+
+        _dependencies[_key] = (_reads, { get_top_key(_key, delimiter=delimiter), })
+
+    return _dependencies
+
+def prune_transform(
+    transform:dict,
+    needed:Iterable[str],
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->Tuple[dict, Set[str]]:
+    """
+    Return (pruned, reads), where pruned only keeps the keys of transform that contribute to the top level keys needed,
+    in their original order, and reads is the set of top level keys the record needs before pruned is applied.
+
+    Keys are walked from the last to the first: a key is kept if it writes a top level key still needed,
+    and then what it reads in its "source" is needed too, see get_transform_dependencies().
+    Keys that are written are still needed before the transform, as any transformation may only write part of them.
+    """
+
+    _dependencies = get_transform_dependencies(transform, delimiter=delimiter)
+    _needed = set(needed)
+    _kept = set()
+
+    for _key in reversed(list(transform)):
+        _reads, _writes = _dependencies[_key]
+
+        if (_writes & _needed):
+            _kept.add(_key)
+            _needed |= _reads
+
+    return { _key:transform[_key] for _key in transform if _key in _kept }, _needed
+
+def get_transform_waves(
+    transform:dict,
+    delimiter:str=RECORD_DICT_DELIMITER,
+)->List[List[str]]:
+    """
+    Split the keys of transform into waves, each a list of keys in their original order.
+
+    A key is put into the wave after the last of the earlier keys it conflicts with, i.e. where either of them
+    writes a top level key that the other reads or writes; keys that conflict with no earlier key are in the first wave.
+    Applying the waves in order, and the keys within a wave in any order or concurrently,
+    gives the same record as applying all keys sequentially.
+    """
+
+    _dependencies = get_transform_dependencies(transform, delimiter=delimiter)
+    _wave_ids = {}
+
+    for _key, (_reads, _writes) in _dependencies.items():
+        _wave_id = 0
+
+        for _earlier_key, _wave_earlier in _wave_ids.items():
+            _earlier_reads, _earlier_writes = _dependencies[_earlier_key]
+
+            if ((_writes & (_earlier_reads | _earlier_writes)) or (_reads & _earlier_writes)):
+                _wave_id = max(_wave_id, _wave_earlier + 1)
+
+        _wave_ids[_key] = _wave_id
+
+    _waves = [ [] for _ in range(max(_wave_ids.values(), default=-1) + 1) ]
+    for _key, _wave_id in _wave_ids.items():
+        _waves[_wave_id].append(_key)
+
+    return _waves
+
 # Transform a single record
 def transform_record(
     transform:dict,
@@ -204,6 +330,7 @@ def transform_record(
 )->dict:
     """
     Main function to apply transformations from transform onto record.
+    Keys that do not depend on each other are applied concurrently if any of them embeds; see get_transform_waves().
     url is supplied to calculate full url from relative ones; needed for base64.
     delimiter is used for nested key strings in form of "key1>>>key1a>>>key1ai".
     """
@@ -306,7 +433,7 @@ def transform_record(
         # So we have a list to deal with.
 
         # First we create a generator of ( [_subrecord1_attr1, _subrecord1_attr2,... ], [_subrecord2_attr1, _subrecord2_attr2,... ], [_subrecord3_attr1, _subrecord3_attr2,... ], )
-        _subrecords = safe_zip(*[record.get(
+        _subrecords = assemble_records(*[record.get(
             _formatter,
             None,
             delimiter=delimiter,
@@ -365,21 +492,38 @@ def transform_record(
         
         return text
 
-    @vectorise
     def change_type(
         type:str,
         source:str,
+        locale:str=None,
     ):
         """
         key "type"
 
         Change object type for value.
+        Numeric types parse the whole list at once; see extract_http.numeric.
         """
 
+        if (type in NUMERIC_TYPES):
+            return convert_type(
+                list(source) if (isinstance(source, list)) else source,
+                type,
+                locale=locale,
+            )
+        else:
+            return change_type_text(
+                type=type,
+                source=source,
+            )
+
+    @vectorise
+    def change_type_text(
+        type:str,
+        source:str,
+    ):
+
         _type_switch = {
-            "int":int,
             "str":str,
-            "float":float,
             "bool":text_to_bool,
             "bytes":lambda text: text.encode("utf-8"),
         }
@@ -419,8 +563,15 @@ def transform_record(
                     prep_url(_url) for _url in ([ source, ] if (not isinstance(source, list)) else source)
                 ]
                 
-                with ThreadPoolExecutor() as executor:
-                    _data = executor.map(lambda _url:curl(_url, params, encode="base64text"), _urls)
+                with stage("embed_base64") as _stage:
+                    with ThreadPoolExecutor() as executor:
+                        _data = list(executor.map(lambda _url:curl(_url, params, encode="base64text"), _urls))
+
+                    _stage.add(
+                        count=len(_urls),
+                        nbytes=sum(len(_result) for _result in _data if (not isinstance(_result, Exception))),
+                        errors=sum(1 for _result in _data if isinstance(_result, Exception)),
+                    )
 
             _data = [
                 (_result if (not isinstance(_result, Exception)) else None) for _result in list(_data)
@@ -487,14 +638,19 @@ def transform_record(
     # Ensure record is a record_dict object, otherwise nested keys won't work
     record = record_dict(record)
 
-    # Each _key in transform represents a new dict key
-    # DO NOT PARALLELISE THIS - some subsequent transformations can require earlier ones
-    for _key in transform:
+    def apply_transform(
+        _key:str,
+    ):
+        """
+        Apply all transformations of transform[_key] onto record.
+        """
+
         _source = transform[_key].get("source", None)
         _split = transform[_key].get("split", None)
         _type = transform[_key].get("type", None)
         _substitute = transform[_key].get("substitute", None)
         _embed = transform[_key].get("embed", None)
+        _locale = transform[_key].get("locale", None)
 
         # print (_key, _source, _split, _type, _substitute, _embed)
 
@@ -508,7 +664,7 @@ def transform_record(
                 _source = f"{{{_key}}}"
             else:
                 warnings.warn(f"Source not found for transform key {_key}, skipping.")
-                continue
+                return
 
         # Create a lambda to get the destination value;
         # this is necessary because it changes after each successful transformation
@@ -520,79 +676,125 @@ def transform_record(
                                             )
 
         # Get the source value
-        _source_record_value = get_source(
-                source=_source,
-                record=record,
-                delimiter=delimiter,
-            )
-
-        # Check if the list returned is natively a list in the record.
-        # Otherwise iterate_lists will just pop the first element of the list to the record and discard the rest.
-        is_native_list = isinstance(_source_record_value, native_list)
-
-        
+        with detail("source", f"{_key}.source"):
+            _source_record_value = get_source(
+                    source=_source,
+                    record=record,
+                    delimiter=delimiter,
+                )
 
-        # Create the new key if doesn't exist yet
-        record.put(
-            _key,
-            _source_record_value,
-            delimiter=delimiter,
-            iterate_lists=(not is_native_list),
-            replace_list_items=True,
-        )
+            # Check if the list returned is natively a list in the record.
+            # Otherwise iterate_lists will just pop the first element of the list to the record and discard the rest.
+            is_native_list = isinstance(_source_record_value, native_list)
 
-        # SPLIT STRING
-        if (_split):
+            # Create the new key if doesn't exist yet
             record.put(
                 _key,
-                split_value(
-                    delimiter=_split, # This is not delimiter <<< - its a variable defined by the config
-                    source=_destination_record_value(True),
-                ),
+                _source_record_value,
                 delimiter=delimiter,
-                iterate_lists=False, # Don't iterate lists here - obviously we are expecting lists
+                iterate_lists=(not is_native_list),
                 replace_list_items=True,
             )
 
+        # SPLIT STRING
+        if (_split):
+            with detail("split", f"{_key}.split"):
+                record.put(
+                    _key,
+                    split_value(
+                        delimiter=_split, # This is not delimiter <<< - its a variable defined by the config
+                        source=_destination_record_value(True),
+                    ),
+                    delimiter=delimiter,
+                    iterate_lists=False, # Don't iterate lists here - obviously we are expecting lists
+                    replace_list_items=True,
+                )
+
         # REGEX SUBSTITUTION
         if (_substitute):
-            record.put(
-                _key,
-                make_substitution(
-                    substitute=_substitute,
-                    source=_destination_record_value(True),
-                ),
-                delimiter=delimiter,
-                iterate_lists=(not is_native_list),
-                replace_list_items=True,
-            )
+            with detail("substitute", f"{_key}.substitute"):
+                record.put(
+                    _key,
+                    make_substitution(
+                        substitute=_substitute,
+                        source=_destination_record_value(True),
+                    ),
+                    delimiter=delimiter,
+                    iterate_lists=(not is_native_list),
+                    replace_list_items=True,
+                )
 
         # EMBED BASE64
         if (_embed):
-            record.put(
-                _key,
-                embed_base64(
-                    embed=_embed,
-                    source=_destination_record_value(True),
-                    url=url,
-                    ),
-                delimiter=delimiter,
-                iterate_lists=(not is_native_list),
-                replace_list_items=True,
-            )
+            with detail("embed", f"{_key}.embed"):
+                record.put(
+                    _key,
+                    embed_base64(
+                        embed=_embed,
+                        source=_destination_record_value(True),
+                        url=url,
+                        ),
+                    delimiter=delimiter,
+                    iterate_lists=(not is_native_list),
+                    replace_list_items=True,
+                )
 
         # TYPE CHANGE
         if (_type):
-            record.put(
-                _key,
-                change_type(
-                    type=_type,
-                    source=_destination_record_value(True),
-                    ),
-                delimiter=delimiter,
-                iterate_lists=(not is_native_list),
-                replace_list_items=True,
-            )
-            
+            with detail("type", f"{_key}.type"):
+                record.put(
+                    _key,
+                    change_type(
+                        type=_type,
+                        source=_destination_record_value(True),
+                        locale=_locale,
+                        ),
+                    delimiter=delimiter,
+                    iterate_lists=(not is_native_list),
+                    replace_list_items=True,
+                )
+
+    # Keys are applied in waves; keys within a wave do not read or write anything the others write,
+    # so they can be applied in any order with identical results. See get_transform_waves().
+    _keys_before = list(record)
+    _key_ids = { _key:_id for _id, _key in enumerate(transform) }
+    _created = {}
+
+    def apply_tracked(
+        _key:str,
+    ):
+        """
+        apply_transform(), noting which key created each new top level key.
+        """
+
+        _top_key = get_top_key(_key, delimiter=delimiter)
+        _existed = _top_key in record
+
+        apply_transform(_key)
+
+        if (not _existed and _top_key in record):
+            _created[_top_key] = _key_ids[_key]
+
+    for _wave in get_transform_waves(transform, delimiter=delimiter):
+        # Only worth the threads if there is I/O to overlap
+        if (len(_wave) > 1 and any(transform[_key].get("embed", None) for _key in _wave)):
+            with ThreadPoolExecutor(max_workers=len(_wave)) as executor:
+                # Each thread gets a copy of the current context, so that instrument labels carry over
+                _futures = [
+                    executor.submit(contextvars.copy_context().run, apply_tracked, _key) for _key in _wave
+                ]
+                for _future in _futures:
+                    _future.result()
+        else:
+            for _key in _wave:
+                apply_tracked(_key)
+
+    # Restore the order of new keys to what applying them sequentially would have resulted in
+    _order = [ *_keys_before, *sorted(_created, key=_created.get) ]
+    if (list(record) != _order and set(record) == set(_order)):
+        _items = [ (_top_key, record[_top_key]) for _top_key in _order ]
+        record.clear()
+        record.update(_items)
+
     return record
         
\ No newline at end of file
@@ -0,0 +1,670 @@
+"""
+work_queue.py
+
+Extraction of jobs pulled from a shared queue, so that many workers, on one or many machines, can share the work.
+
+A job is a configuration id plus the kwargs to extract it with. Workers lease jobs from the queue, and
+- acknowledge them when done, or
+- return them on failure, to be retried after a delay until max_attempts is reached.
+A leased job that is neither acknowledged nor returned within its visibility timeout, e.g. because its worker died,
+becomes visible to other workers again.
+
+Jobs are sharded by the host name of their url, so that workers can be pointed at a subset of hosts,
+e.g. to keep the load on each host within limits.
+
+- base_queue    : the interface of a queue; implement it to use other backends
+- sqlite_queue  : queue in a single SQLite file, for running on one machine, or a few sharing a file system
+- queue_worker  : pulls jobs from a queue and extracts them
+
+Example:
+    _queue = sqlite_queue("jobs.sqlite")
+    _queue.put_many("specs", ({ "art_no": _art_no } for _art_no in art_nos), config=configs["specs"])
+
+    with ndjson_sink("specs.ndjson") as _sink:
+        queue_worker(_queue, configs, sink=_sink, workers=8).run()
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+from urllib.parse import urlparse
+import uuid
+
+from extract_http.bin import get_rss
+from extract_http.extract import extract, get_fetch_settings
+from extract_http.sink import base_sink, json_default
+
+JOB_STATUSES = ("pending", "leased", "done", "failed")
+
+class QueueLeaseExpired(RuntimeError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+class QueueConfigNotFound(KeyError):
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+def get_shard(
+    config:dict,
+    kwargs:dict,
+)->str:
+    """
+    Shard of a job, being the host name of its url; None for local files or malformed configurations.
+    """
+
+    try:
+        _settings = get_fetch_settings(config, **kwargs)
+    except (KeyError, IndexError, ValueError) as e:
+        return None
+
+    if (_settings["file"] or not _settings["url"]):
+        return None
+
+    return urlparse(_settings["url"]).hostname
+
+
+class queue_job():
+    """
+    A job leased from a queue.
+
+    lease identifies this particular lease; once the visibility timeout has passed and the job leased again,
+    acknowledging the job with the old lease fails.
+    """
+
+    __slots__ = ("id", "config_id", "kwargs", "shard", "attempts", "lease")
+
+    def __init__(
+        self,
+        id:Any,
+        config_id:str,
+        kwargs:dict,
+        shard:str=None,
+        attempts:int=1,
+        lease:str=None,
+    ):
+        self.id = id
+        self.config_id = config_id
+        self.kwargs = kwargs
+        self.shard = shard
+        self.attempts = attempts
+        self.lease = lease
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={self.id!r}, config_id={self.config_id!r}, kwargs={self.kwargs!r}, shard={self.shard!r}, attempts={self.attempts})"
+
+
+class base_queue():
+    """
+    Interface of a job queue.
+
+    All methods must be safe to call from multiple threads and processes at once.
+    """
+
+    def put(
+        self,
+        config_id:str,
+        kwargs:dict,
+        shard:str=None,
+    )->Any:
+        """
+        Add a job; returns its id.
+        """
+        raise NotImplementedError()
+
+    def put_many(
+        self,
+        config_id:str,
+        jobs:Iterable[dict],
+        config:dict=None,
+    )->int:
+        """
+        Add a job for each kwargs in jobs; returns the number of jobs added.
+
+        If config is supplied, jobs are sharded by the host name of their url.
+        """
+
+        _count = 0
+        for _kwargs in jobs:
+            self.put(config_id, _kwargs, shard=get_shard(config, _kwargs) if (config is not None) else None)
+            _count += 1
+
+        return _count
+
+    def get(
+        self,
+        worker:str=None,
+        shards:List[str]=None,
+        visibility_timeout:float=None,
+    )->queue_job:
+        """
+        Lease the next visible job, optionally only of shards; returns None if there is none.
+        """
+        raise NotImplementedError()
+
+    def ack(
+        self,
+        job:queue_job,
+    ):
+        """
+        Mark a leased job as done; raises QueueLeaseExpired if the lease is no longer held.
+        """
+        raise NotImplementedError()
+
+    def nack(
+        self,
+        job:queue_job,
+        error:str=None,
+        delay:float=0,
+    ):
+        """
+        Return a leased job after a failure; it is retried after delay seconds,
+        unless it has been attempted max_attempts times, in which case it is marked as failed.
+        """
+        raise NotImplementedError()
+
+    def extend(
+        self,
+        job:queue_job,
+        visibility_timeout:float,
+    ):
+        """
+        Extend the lease of a job that needs longer than its visibility timeout.
+        """
+        raise NotImplementedError()
+
+    def counts(self)->Dict[str, int]:
+        """
+        Number of jobs in each status.
+        Jobs returned by nack() are pending while they wait for their retry.
+        """
+        raise NotImplementedError()
+
+    def wait_time(
+        self,
+        shards:List[str]=None,
+    )->float:
+        """
+        Seconds until the next pending job, optionally only of shards, becomes visible; 0 if one is visible already,
+        or None if there are no pending jobs, e.g. none waiting for a retry.
+        """
+        return None
+
+
+class sqlite_queue(base_queue):
+    """
+    Job queue in a single SQLite file.
+
+    Each thread uses its own connection; leasing is done in an immediate transaction, so that
+    any number of threads and processes can pull from the same file without leasing the same job twice.
+    """
+
+    def __init__(
+        self,
+        path:str,
+        max_attempts:int=3,
+        visibility_timeout:float=300,
+        timeout:float=30,
+    ):
+        """
+        timeout is the number of seconds to wait for other connections to release the database.
+        """
+
+        self.path = path
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.timeout = timeout
+
+        self.local = threading.local()
+        # Connections of all threads, so that close() can close them all
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+        with self.connection() as _connection:
+            _connection.execute("PRAGMA journal_mode=WAL")
+            _connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    config_id TEXT NOT NULL,
+                    kwargs TEXT NOT NULL,
+                    shard TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    visible_at REAL NOT NULL DEFAULT 0,
+                    lease TEXT,
+                    worker TEXT,
+                    error TEXT
+                )
+            """)
+            _connection.execute("CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (status, shard, visible_at)")
+
+    def connection(self)->sqlite3.Connection:
+        """
+        Connection of the calling thread, opened on first use, or again once close() has closed it.
+        """
+
+        _connection = getattr(self.local, "connection", None)
+
+        if (_connection is None or _connection not in self.connections):
+            # Only ever used by this thread, but close() may be called from any
+            _connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            self.local.connection = _connection
+
+            with self.connections_lock:
+                self.connections.add(_connection)
+
+        return _connection
+
+    def close(self):
+        """
+        Close the connections of all threads, e.g. those of queue_worker; call it once no thread is using the queue.
+        """
+
+        with self.connections_lock:
+            _connections = list(self.connections)
+            self.connections.clear()
+
+        for _connection in _connections:
+            _connection.close()
+
+        self.local.connection = None
+
+    def put(
+        self,
+        config_id:str,
+        kwargs:dict,
+        shard:str=None,
+    )->int:
+        return self.connection().execute(
+            "INSERT INTO jobs (config_id, kwargs, shard) VALUES (?, ?, ?)",
+            (config_id, json.dumps(kwargs, default=json_default), shard),
+        ).lastrowid
+
+    def put_many(
+        self,
+        config_id:str,
+        jobs:Iterable[dict],
+        config:dict=None,
+    )->int:
+        _connection = self.connection()
+
+        _rows = (
+            (
+                config_id,
+                json.dumps(_kwargs, default=json_default),
+                get_shard(config, _kwargs) if (config is not None) else None,
+            ) for _kwargs in jobs
+        )
+
+        # One transaction for all jobs
+        _connection.execute("BEGIN IMMEDIATE")
+        try:
+            _cursor = _connection.executemany(
+                "INSERT INTO jobs (config_id, kwargs, shard) VALUES (?, ?, ?)",
+                _rows,
+            )
+            _connection.execute("COMMIT")
+        except Exception as e:
+            _connection.execute("ROLLBACK")
+            raise e
+
+        return _cursor.rowcount
+
+    def expire_leases(
+        self,
+        connection:sqlite3.Connection,
+        now:float,
+    ):
+        """
+        Mark jobs as failed whose lease expired after their last attempt; called within a transaction.
+        """
+
+        connection.execute(
+            "UPDATE jobs SET status = 'failed', error = COALESCE(error, 'Visibility timeout expired.') "
+            "WHERE status = 'leased' AND visible_at <= ? AND attempts >= ?",
+            (now, self.max_attempts),
+        )
+
+    def get_shard_filter(
+        self,
+        shards:List[str]=None,
+    )->Tuple[str, tuple]:
+        if (shards is not None):
+            return f"AND shard IN ({', '.join('?' for _ in shards)})", tuple(shards)
+        else:
+            return "", ()
+
+    def get(
+        self,
+        worker:str=None,
+        shards:List[str]=None,
+        visibility_timeout:float=None,
+    )->queue_job:
+        _connection = self.connection()
+        _timeout = visibility_timeout if (visibility_timeout is not None) else self.visibility_timeout
+        _lease = uuid.uuid4().hex
+
+        _shard_filter, _shard_params = self.get_shard_filter(shards)
+
+        _connection.execute("BEGIN IMMEDIATE")
+        try:
+            _now = time.time()
+
+            self.expire_leases(_connection, _now)
+
+            _row = _connection.execute(
+                "SELECT id, config_id, kwargs, shard, attempts FROM jobs "
+                f"WHERE status IN ('pending', 'leased') AND visible_at <= ? {_shard_filter} "
+                "ORDER BY visible_at, id LIMIT 1",
+                (_now, *_shard_params),
+            ).fetchone()
+
+            if (_row is not None):
+                _connection.execute(
+                    "UPDATE jobs SET status = 'leased', attempts = attempts + 1, visible_at = ?, lease = ?, worker = ? WHERE id = ?",
+                    (_now + _timeout, _lease, worker, _row[0]),
+                )
+
+            _connection.execute("COMMIT")
+        except Exception as e:
+            _connection.execute("ROLLBACK")
+            raise e
+
+        if (_row is None):
+            return None
+
+        return queue_job(
+            id=_row[0],
+            config_id=_row[1],
+            kwargs=json.loads(_row[2]),
+            shard=_row[3],
+            attempts=_row[4] + 1,
+            lease=_lease,
+        )
+
+    def update_lease(
+        self,
+        job:queue_job,
+        sql:str,
+        params:tuple,
+    ):
+        """
+        Execute an UPDATE of the job, only if its lease is still held.
+        """
+
+        _cursor = self.connection().execute(
+            f"{sql} WHERE id = ? AND lease = ? AND status = 'leased'",
+            (*params, job.id, job.lease),
+        )
+
+        if (_cursor.rowcount <= 0):
+            _exception = QueueLeaseExpired(f"Lease of job {job.id} is no longer held.")
+            raise _exception
+
+    def ack(
+        self,
+        job:queue_job,
+    ):
+        self.update_lease(
+            job,
+            "UPDATE jobs SET status = 'done', lease = NULL, error = NULL",
+            (),
+        )
+
+    def nack(
+        self,
+        job:queue_job,
+        error:str=None,
+        delay:float=0,
+    ):
+        _status = "failed" if (job.attempts >= self.max_attempts) else "pending"
+
+        self.update_lease(
+            job,
+            "UPDATE jobs SET status = ?, visible_at = ?, lease = NULL, error = ?",
+            (_status, time.time() + delay, error),
+        )
+
+    def extend(
+        self,
+        job:queue_job,
+        visibility_timeout:float,
+    ):
+        self.update_lease(
+            job,
+            "UPDATE jobs SET visible_at = ?",
+            (time.time() + visibility_timeout, ),
+        )
+
+    def counts(self)->Dict[str, int]:
+        _connection = self.connection()
+        _counts = { _status:0 for _status in JOB_STATUSES }
+
+        # Expired leases are resolved first, so that jobs past max_attempts are counted as failed without waiting for a get()
+        _connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.expire_leases(_connection, time.time())
+
+            for _status, _count in _connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                _counts[_status] = _count
+
+            _connection.execute("COMMIT")
+        except Exception as e:
+            _connection.execute("ROLLBACK")
+            raise e
+
+        return _counts
+
+    def wait_time(
+        self,
+        shards:List[str]=None,
+    )->float:
+        _shard_filter, _shard_params = self.get_shard_filter(shards)
+
+        _visible_at = self.connection().execute(
+            f"SELECT MIN(visible_at) FROM jobs WHERE status = 'pending' {_shard_filter}",
+            _shard_params,
+        ).fetchone()[0]
+
+        if (_visible_at is None):
+            return None
+
+        return max(_visible_at - time.time(), 0)
+
+    def failures(self)->List[Dict[str, Any]]:
+        """
+        Jobs that have failed permanently, with their last error.
+        """
+
+        return [
+            {
+                "id": _id,
+                "config_id": _config_id,
+                "kwargs": json.loads(_kwargs),
+                "attempts": _attempts,
+                "error": _error,
+            } for _id, _config_id, _kwargs, _attempts, _error in self.connection().execute(
+                "SELECT id, config_id, kwargs, attempts, error FROM jobs WHERE status = 'failed' ORDER BY id"
+            )
+        ]
+
+
+class queue_worker():
+    """
+    Pull jobs from a queue, extract them, and write the results into a sink.
+
+    Each result is written as
+        { "id": job id, "config_id": config_id, "kwargs": kwargs, "data": result }
+    Failed jobs are returned to the queue, and retried after retry_delay * 2 ** (attempts - 1) seconds.
+    """
+
+    def __init__(
+        self,
+        queue:base_queue,
+        configs:Dict[str, dict],
+        sink:base_sink=None,
+        workers:int=1,
+        worker_id:str=None,
+        shards:List[str]=None,
+        visibility_timeout:float=None,
+        retry_delay:float=1,
+        poll_interval:float=1,
+        func:Callable[..., Any]=extract,
+    ):
+        """
+        configs is a dict of { config_id: config }.
+        workers is the number of threads pulling jobs.
+        shards restricts this worker to jobs of these host names.
+        """
+
+        self.queue = queue
+        self.configs = configs
+        self.sink = sink
+        self.workers = workers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.shards = shards
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.func = func
+
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.summary = {
+            "done": 0,
+            "retried": 0,
+            "failed": 0,
+            "expired": 0,
+        }
+        self.recycled = False
+
+    def count(self, key:str):
+        with self.lock:
+            self.summary[key] += 1
+
+    def process(
+        self,
+        job:queue_job,
+    ):
+        """
+        Extract a single job, and acknowledge or return it.
+        """
+
+        try:
+            _config = self.configs.get(job.config_id, None)
+            if (_config is None):
+                _exception = QueueConfigNotFound(f"Configuration '{job.config_id}' not found.")
+                raise _exception
+
+            _data = self.func(_config, **job.kwargs)
+
+            if (self.sink is not None):
+                self.sink.write({
+                    "id": job.id,
+                    "config_id": job.config_id,
+                    "kwargs": job.kwargs,
+                    "data": _data,
+                })
+        except Exception as e:
+            try:
+                self.queue.nack(
+                    job,
+                    error=f"{type(e).__name__}: {e}",
+                    delay=self.retry_delay * 2 ** (job.attempts - 1),
+                )
+                self.count("failed" if (job.attempts >= getattr(self.queue, "max_attempts", job.attempts)) else "retried")
+            except QueueLeaseExpired as e:
+                self.count("expired")
+            return
+
+        try:
+            self.queue.ack(job)
+            self.count("done")
+        except QueueLeaseExpired as e:
+            # Took longer than the visibility timeout; another worker may have done it too
+            self.count("expired")
+
+    def run_thread(
+        self,
+        max_jobs:int=None,
+        stop_when_empty:bool=True,
+        max_rss:int=None,
+    ):
+        _processed = 0
+
+        while (not self.stopped.is_set() and (max_jobs is None or _processed < max_jobs)):
+            _job = self.queue.get(
+                worker=self.worker_id,
+                shards=self.shards,
+                visibility_timeout=self.visibility_timeout,
+            )
+
+            if (_job is None):
+                if (stop_when_empty):
+                    # Jobs waiting out their retry backoff are not done with yet
+                    _wait = self.queue.wait_time(shards=self.shards)
+                    if (_wait is None):
+                        return
+                    self.stopped.wait(min(_wait, self.poll_interval))
+                else:
+                    self.stopped.wait(self.poll_interval)
+                continue
+
+            self.process(_job)
+            _processed += 1
+
+            if (max_rss is not None and (get_rss() or 0) >= max_rss and not self.stopped.is_set()):
+                self.recycled = True
+                self.stopped.set()
+
+    def run(
+        self,
+        max_jobs:int=None,
+        stop_when_empty:bool=True,
+        max_rss_growth:int=None,
+    )->Dict[str, int]:
+        """
+        Process jobs until the queue has no pending jobs left, including those waiting for a retry, or stop() is called.
+
+        max_jobs limits the number of jobs per thread.
+        If stop_when_empty is False, keep polling the queue every poll_interval seconds instead.
+        Returns the number of jobs { "done", "retried", "failed", "expired" } by this worker.
+
+        max_rss_growth stops the worker, after the jobs in progress, once the RSS of this process has grown by that many bytes
+        since run() was called; recycled is then set, and the process should exit and be replaced by a fresh one.
+        Together with max_jobs, this keeps the memory of long running workers flat.
+        """
+
+        _rss = get_rss() if (max_rss_growth is not None) else None
+
+        _threads = [
+            threading.Thread(
+                target=self.run_thread,
+                kwargs={
+                    "max_jobs": max_jobs,
+                    "stop_when_empty": stop_when_empty,
+                    "max_rss": _rss + max_rss_growth if (_rss is not None) else None,
+                },
+                name=f"{type(self).__name__}({self.worker_id})-{_id}",
+                daemon=True,
+            ) for _id in range(self.workers)
+        ]
+
+        for _thread in _threads:
+            _thread.start()
+
+        for _thread in _threads:
+            _thread.join()
+
+        return dict(self.summary)
+
+    def stop(self):
+        """
+        Stop after the jobs in progress.
+        """
+        self.stopped.set()
@@ -12,11 +12,24 @@ import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
-from extract_http.html_node import get_value_array, get_node_value, get_value_table, parse_node_format, html_table, NodeFormatStringInvalid, TableOrientation
-from extract_http.extract import extract
-from extract_http.transform import transform_record, transform_formatter
+from extract_http.html_node import get_value_array, get_node_value, get_value_records, get_value_table, node_values, parse_node_format, html_table, NodeFormatStringInvalid, TableOrientation
+from extract_http.extract import extract, extract_many, iter_extract_archive, do_locate_html, parse_html, teardown_soup
+from extract_http.archive import open_archive, ArchiveRecordNotFound
+from extract_http.transform import transform_record, transform_formatter, get_transform_waves
 from extract_http.record_dict import record_dict, RecordNodeNotFound
+from extract_http.bin import assemble_records, curl, document_bytes, sniff_encoding
+import extract_http.fetch as fetch
+from extract_http.record_group import record_group, MISSING
+import extract_http.export as export
+from extract_http.batch import extract_batch, batch_journal
+from extract_http.files import iter_files, map_file, extract_files, iter_extract_files, extract_file_chunk, load_result, FileExtractionError
+from extract_http.sink import ndjson_sink, csv_sink, open_binary
+from extract_http.work_queue import sqlite_queue, queue_worker, QueueLeaseExpired
 from extract_http.defaults import RECORD_DICT_DELIMITER
+import extract_http.instrument as instrument
+import extract_http.metrics as metrics
+from extract_http.projection import project_config, project_data
+from extract_http.numeric import parse_numbers, NumericParseError
 
 class TestCaseFileIOError(IOError):
     def __bool__(self):
@@ -41,6 +54,163 @@ def read_file(
 
     return _return
 
+class local_server():
+    """
+    Threaded HTTP server on localhost for the duration of a with block.
+
+    routes is a dict of { path: (headers, body, delay) }; hits counts the requests per path.
+    """
+
+    def __init__(self, routes:dict):
+        import http.server
+        import threading
+
+        self.routes = routes
+        self.hits = {}
+        self.requests = []
+
+        _server = self
+
+        class _handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                import time
+
+                _path = self.path.split("?", 1)[0]
+                _server.hits[_path] = _server.hits.get(_path, 0) + 1
+                _server.requests.append(dict(self.headers))
+
+                if (_path not in _server.routes):
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                _headers, _body, _delay = _server.routes[_path]
+                time.sleep(_delay)
+
+                self.send_response(200)
+                for _header, _value in _headers.items():
+                    self.send_header(_header, _value)
+                self.send_header("Content-Length", str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path:str)->str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+class local_h2_server():
+    """
+    HTTP/2 server with prior knowledge (h2c) on localhost for the duration of a with block.
+
+    Every request is answered with body after delay seconds;
+    connections counts the connections accepted, and max_streams the most streams open at once on any of them.
+    """
+
+    def __init__(self, body:bytes, content_type:str="text/html; charset=utf-8", delay:float=0.2):
+        import socket
+        import threading
+
+        self.body = body
+        self.content_type = content_type
+        self.delay = delay
+
+        self.connections = 0
+        self.max_streams = 0
+
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen()
+        self.socket.settimeout(0.05)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def serve(self):
+        import socket
+        import threading
+
+        while (not self.stopped.is_set()):
+            try:
+                _connection, _ = self.socket.accept()
+            except socket.timeout:
+                continue
+
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(_connection, ), daemon=True).start()
+
+    def handle(self, connection):
+        import socket
+        import time
+
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        _h2 = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        _h2.initiate_connection()
+        connection.sendall(_h2.data_to_send())
+        connection.settimeout(0.01)
+
+        _pending = {}
+
+        with connection:
+            while (not self.stopped.is_set()):
+                try:
+                    _data = connection.recv(65536)
+                    if (not _data):
+                        return
+                    _events = _h2.receive_data(_data)
+                except socket.timeout:
+                    _events = []
+                except (ConnectionError, h2.exceptions.ProtocolError):
+                    return
+
+                for _event in _events:
+                    if (isinstance(_event, h2.events.RequestReceived)):
+                        _pending[_event.stream_id] = time.monotonic() + self.delay
+                        self.max_streams = max(self.max_streams, len(_pending))
+
+                for _stream_id, _due in list(_pending.items()):
+                    if (time.monotonic() >= _due):
+                        _h2.send_headers(_stream_id, [
+                            (":status", "200"),
+                            ("content-type", self.content_type),
+                            ("content-length", str(len(self.body))),
+                        ])
+                        _h2.send_data(_stream_id, self.body, end_stream=True)
+                        del _pending[_stream_id]
+
+                connection.sendall(_h2.data_to_send())
+
+    def url(self, path:str)->str:
+        return f"http://127.0.0.1:{self.socket.getsockname()[1]}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        self.socket.close()
+        return False
+
 _test_data = None
 
 def setUpModule() -> None:
@@ -317,6 +487,23 @@ class TestExtractHTTP(unittest.TestCase):
             _tests
         )
         
+    def test_assemble_records(self) -> None:
+        _tests = [
+            { "args": { "args": (["a", "b", "c"], [1, 2, 3]) }, "answer": [("a", 1), ("b", 2), ("c", 3)] },
+            { "args": { "args": (["a", "b", "c"], [1]) }, "answer": [("a", 1), ("b", None), ("c", None)] },
+            { "args": { "args": (["a", "b", "c"], [1]), "repeat_last": True }, "answer": [("a", 1), ("b", 1), ("c", 1)] },
+            { "args": { "args": ("constant", ["a", "b"]) }, "answer": [("constant", "a"), (None, "b")] },
+            { "args": { "args": ("constant", ["a", "b"]), "repeat_last": True }, "answer": [("constant", "a"), ("constant", "b")] },
+            { "args": { "args": (["a", None, "c"], [1, None, 3]) }, "answer": [("a", 1)] },
+            { "args": { "args": ([], None) }, "answer": [] },
+            { "args": { "args": () }, "answer": [] },
+        ]
+
+        self.conduct_tests(
+            lambda args, repeat_last=False: list(assemble_records(*args, repeat_last=repeat_last)),
+            _tests
+        )
+
     def test_transform_formatter(self) -> None:
         _tests = [
             {
@@ -355,6 +542,34 @@ class TestExtractHTTP(unittest.TestCase):
             _tests
         )
 
+    def test_html_table_combine(self) -> None:
+        _tables = BeautifulSoup("""
+            <table>
+                <tr><th>CPU</th><th>Cores</th></tr>
+                <tr><td>i9-12900K</td><td>16</td></tr>
+                <tr><td>i5-12600K</td><td>10</td></tr>
+            </table>
+            <table>
+                <tr><th class="price">CPU</th><th>Price</th></tr>
+                <tr><td>i5-12600K</td><td>289</td></tr>
+                <tr><td>i3-12100</td><td>122</td></tr>
+            </table>
+            <table>
+                <tr><th>Socket</th></tr>
+                <tr><td>LGA1700</td></tr>
+            </table>
+        """, "html.parser").select("table")
+
+        self.assertEqual(
+            html_table.combine([ html_table.from_bs4_node(_table) for _table in _tables ]).export(),
+            [
+                { "CPU":"i9-12900K", "Cores":"16", "Price":None, "Socket":None },
+                { "CPU":"i5-12600K", "Cores":"10", "Price":"289", "Socket":None },
+                { "CPU":"i3-12100", "Cores":None, "Price":"122", "Socket":None },
+                { "CPU":None, "Cores":None, "Price":None, "Socket":"LGA1700" },
+            ]
+        )
+
     def test_get_value_table(self) -> None:
         _tests = [
             {
@@ -381,6 +596,150 @@ class TestExtractHTTP(unittest.TestCase):
         )
 
 
+    def test_get_value_table_typed(self) -> None:
+        _nodes = BeautifulSoup("""
+            <table>
+                <tr><th>CPU</th><th>Cores</th><th>Clock</th><th>Unlocked</th><th>Socket</th><th>Boost</th></tr>
+                <tr><td>i9-12900K</td><td>16</td><td>3.2</td><td>Yes</td><td>LGA1700</td><td>5.2</td></tr>
+                <tr><td>i5-12600K</td><td>10</td><td>3.7</td><td>Yes</td><td>LGA1700</td><td></td></tr>
+                <tr><td>i5-12400</td><td></td><td>2.5</td><td>No</td><td>LGA1700</td><td>4.4</td></tr>
+                <tr><td>i3-12100</td><td>4</td><td>3.3</td><td>No</td><td>LGA1700</td><td>4.3</td></tr>
+            </table>
+        """, "html.parser").select("table")
+
+        _dataframe = get_value_table(
+            {
+                "output":"dataframe",
+                "dtypes":{ "Boost":"str" },
+            },
+            _nodes,
+        )
+
+        self.assertEqual(str(_dataframe["Cores"].dtype), "Int64")
+        self.assertEqual(_dataframe["Cores"].fillna(-1).tolist(), [ 16, 10, -1, 4 ])
+        self.assertEqual(_dataframe["Clock"].dtype, np.float64)
+        self.assertEqual(_dataframe["Unlocked"].tolist(), [ True, True, False, False ])
+        self.assertEqual(_dataframe["Unlocked"].dtype, np.bool_)
+        self.assertEqual(str(_dataframe["Socket"].dtype), "category")
+        self.assertEqual(_dataframe["CPU"].dtype, np.object_)
+        self.assertEqual(_dataframe["Boost"].tolist(), [ "5.2", None, "4.4", "4.3" ])
+
+        if (export.pyarrow is not None):
+            _table = get_value_table({ "output":"arrow" }, _nodes)
+            self.assertEqual(str(_table.schema.field("Cores").type), "int64")
+            self.assertEqual(_table.column("Cores").null_count, 1)
+            self.assertEqual(str(_table.schema.field("Socket").type), "dictionary<values=string, indices=int8, ordered=0>")
+
+        # Explicit int columns are parsed by extract_http.numeric; text that is not a number is missing
+        from extract_http.html_table import get_typed_column
+
+        self.assertEqual(get_typed_column([ "16 cores", "1,200", None, "LGA1700" ], dtype="int").fillna(-1).tolist(), [ 16, 1200, -1, -1 ])
+
+        # Integers are only inferred if they convert back exactly
+
+        self.assertEqual(get_typed_column([ "12345678901234567890", "1" ]).tolist(), [ "12345678901234567890", "1" ])
+        self.assertEqual(get_typed_column([ "00123", "00456", "00789" ]).tolist(), [ "00123", "00456", "00789" ])
+        self.assertEqual(get_typed_column([ "9007199254740993", None ]).tolist()[0], 9007199254740993)
+        self.assertEqual(get_typed_column([ "inf", "1.5" ]).tolist(), [ float("inf"), 1.5 ])
+        self.assertEqual(get_typed_column([ "1.0", "2" ]).dtype, np.float64)
+        self.assertEqual(get_typed_column([ "12345678901234567890", "inf", "5" ], dtype="int").fillna(-1).tolist(), [ -1, -1, 5 ])
+
+        # Typed tables are not compacted
+        from extract_http.extract import do_locate_soup
+
+        _data = do_locate_soup(
+            [ { "search_root":[ "table", ], "table":{ "output":"dataframe", }, "compact":"rows", }, ],
+            BeautifulSoup(str(_nodes[0]), "html.parser"),
+        )
+        self.assertIsInstance(_data[0], pd.DataFrame)
+        self.assertEqual(len(_data[0]), 4)
+
+    def test_numeric(self) -> None:
+        self.assertEqual(
+            parse_numbers([ "1,234.5 kg", "1.234,5 €", "15 %", "CHF 1'299.-", "1,5", "12,345", "−2.5e3", "35", 7.5 ]),
+            [ 1234.5, 1234.5, 15, 1299, 1.5, 12345, -2500, 35, 7.5 ],
+        )
+        self.assertEqual(parse_numbers([ "1.234", "12,345" ], locale="de_DE"), [ 1234, 12.345 ])
+        self.assertEqual(parse_numbers([ "15 %" ], percent=True), [ 0.15 ])
+        self.assertIsInstance(parse_numbers([ "n/a" ])[0], NumericParseError)
+
+        # Only whitespace, a currency and a unit may surround the number; anything else is not numeric
+        _not_numeric = [ "A2000292", "i7-12700K", "2022-05-10", "LGA1700", "pH-7", "5-7", "USD5", "approx. 5 kg", "3.5 out of 5" ]
+        self.assertTrue(all(isinstance(_number, NumericParseError) for _number in parse_numbers(_not_numeric)))
+        self.assertEqual(parse_numbers([ "-$5", "$ -5", " 3.2 GHz ", "10 km/h", "12700K" ]), [ -5, -5, 3.2, 10, 12700 ])
+
+        # and is left unchanged by the type transformation; arithmetic on it fails as it always has
+        self.assertEqual(
+            transform_record(
+                { "Art":{ "type":"int" }, "Socket":{ "type":"int" }, "Date":{ "type":"float" }, "Total":{ "source":"{pH$sum(1)}" } },
+                { "Art":"A2000292", "Socket":"LGA1700", "Date":"2022-05-10", "pH":"pH-7" },
+            ),
+            { "Art":"A2000292", "Socket":"LGA1700", "Date":"2022-05-10", "pH":"pH-7", "Total":None },
+        )
+
+        self.assertEqual(
+            transform_record(
+                {
+                    "Weight":{ "type":"float", "locale":"de" },
+                    "Stock":{ "type":"int" },
+                    "Sizes":{ "split":";", "type":"int" },
+                    "Total":{ "source":"{Price:.2f$mul(2),sum(1000)}" },
+                },
+                {
+                    "Weight":"1.234,5 g",
+                    "Stock":"3.5",
+                    "Sizes":"1,000; n/a; 12",
+                    "Price":"1,299.50 USD",
+                },
+            ),
+            {
+                "Weight":1234.5,
+                "Stock":"3.5",
+                "Sizes":[ 1000, "n/a", 12 ],
+                "Price":"1,299.50 USD",
+                "Total":"3599.00",
+            }
+        )
+
+    def test_transform_waves(self) -> None:
+        _transform = {
+            "Name":{ "source":"{First} {Last}" },
+            "Image":{ "source":"http://127.0.0.1:9/{Sku}.png", "embed":"url" },
+            "Label":{ "source":"{Name} ({Sku})" },
+            "Thumbnail":{ "source":"http://127.0.0.1:9/{Sku}_s.png", "embed":"url" },
+            "Sku":{ "type":"int" },
+            "Meta>>>sku":{ "source":"{Sku}" },
+        }
+
+        self.assertEqual(
+            get_transform_waves(_transform),
+            [
+                [ "Name", "Image", "Thumbnail" ],
+                [ "Label" ],
+                [ "Sku" ],
+                [ "Meta>>>sku" ],
+            ]
+        )
+
+        _record = transform_record(
+            _transform,
+            { "First":"John", "Last":"Doe", "Sku":"0042" },
+        )
+
+        self.assertEqual(
+            list(_record.items()),
+            [
+                ("First", "John"),
+                ("Last", "Doe"),
+                ("Sku", 42),
+                ("Name", "John Doe"),
+                ("Image", None),
+                ("Label", "John Doe (0042)"),
+                ("Thumbnail", None),
+                ("Meta", { "sku":"42" }),
+            ]
+        )
+
     def test_record_dict_get(self) -> None:
         _dict = record_dict({
             "root":json.loads(_test_data["ridi_sku_list_zug.json"])
@@ -415,6 +774,1108 @@ class TestExtractHTTP(unittest.TestCase):
             _dict.get,
             _tests
         )
-    
+
+    def test_instrument(self) -> None:
+        _config = {
+            "type":"html",
+            "file":self.get_testdata_path("intel_alderlake_table.html"),
+            "locate":[
+                {
+                    "search_root":[
+                        "table",
+                    ],
+                    "table":{
+                        "orient":"rows",
+                        "key_index":0,
+                        "keys":{
+                            "CPU":"$innerText",
+                            "URL":"a$attr[href]"
+                        }
+                    },
+                },
+            ],
+        }
+
+        self.assertIs(instrument.stage("parse"), instrument.NULL_STAGE)
+
+        with instrument.stage_stats() as _stats:
+            _data = extract(_config)
+
+        self.assertIs(instrument.stage("parse"), instrument.NULL_STAGE)
+
+        _report = _stats.report()
+        _records = len(json.loads(_test_data["intel_alderlake_table.json"]))
+
+        self.assertEqual(_report["stages"]["parse"]["calls"], 1)
+        self.assertEqual(_report["stages"]["find_all_nodes"]["count"], 2)
+        self.assertEqual(_report["stages"]["html_table"]["calls"], 2)
+        self.assertEqual(_report["stages"]["transform_record"]["count"], _records)
+        self.assertEqual(_report["groups"][0]["get_value_table"]["count"], len(_data[0]))
+
+    def test_profiler(self) -> None:
+        _config = {
+            "type":"html",
+            "file":self.get_testdata_path("intel_alderlake_table.html"),
+            "locate":[
+                {
+                    "search_root":[ "table", ],
+                    "table":{ "orient":"rows", "key_index":0, "keys":{ "CPU":"$innerText" } },
+                },
+                {
+                    "search_root":[ "table tr", ],
+                    "values":{ "cells":"td", "links":"a$attr[href]" },
+                    "transform":{
+                        "cells":{ "source":"{cells}", "substitute":{ "pattern":"\\s+", "rep":" " } },
+                    },
+                },
+            ],
+        }
+
+        self.assertIs(instrument.detail("select", "key"), instrument.NULL_STAGE)
+
+        # stage_stats does not ask for detail() stages
+        with instrument.stage_stats() as _stats:
+            self.assertIs(instrument.detail("select", "key"), instrument.NULL_STAGE)
+
+        with instrument.profiler(memory=True) as _profiler:
+            _data = extract(_config)
+            extract(_config)
+
+        self.assertIs(instrument.detail("select", "key"), instrument.NULL_STAGE)
+
+        _report = _profiler.report()
+        _rows = len(_data[1])
+
+        self.assertTrue({
+            "parse",
+            "locate[0].search_root",
+            "locate[0].table",
+            "locate[1].search_root",
+            "locate[1].values.cells",
+            "locate[1].values.links",
+            "locate[1].transform.cells.source",
+            "locate[1].transform.cells.substitute",
+        } <= set(_report))
+        self.assertEqual(_report["parse"]["calls"], 2)
+        self.assertEqual(_report["locate[1].transform.cells.substitute"]["calls"], 2 * _rows)
+        self.assertEqual(_report["locate[1].values.cells"]["stage"], "select")
+
+        _top = _profiler.top(3)
+        self.assertEqual(len(_top), 3)
+        self.assertEqual([ _stat["self"] for _stat in _top ], sorted((_stat["self"] for _stat in _report.values()), reverse=True)[:3])
+        self.assertTrue(all(_stat["self"] <= _stat["wall"] + 1e-9 for _stat in _report.values()))
+
+    def test_memory_tracer(self) -> None:
+        import tracemalloc
+
+        _config = lambda name: {
+            "type":"html",
+            "file":self.get_testdata_path(name),
+            "locate":[
+                {
+                    "search_root":[ "table", ],
+                    "table":{ "orient":"rows", "key_index":0, "keys":{ "CPU":"$innerText" } },
+                },
+            ],
+        }
+        _large = self.get_testdata_path("intel_alderlake_table.html")
+        _flags = []
+
+        self.assertFalse(tracemalloc.is_tracing())
+
+        with instrument.memory_tracer(threshold=100 * 1024, on_flag=lambda url, document: _flags.append(url)) as _tracer:
+            extract(_config("intel_alderlake_table.html"))
+            extract(_config("intel_alderlake_table.html"))
+
+        self.assertFalse(tracemalloc.is_tracing())
+
+        _report = _tracer.report()
+
+        self.assertTrue({ "parse", "html_table", "get_value_table", "transform_record" } <= set(_report["stages"]))
+        self.assertEqual(_report["stages"]["parse"]["calls"], 2)
+        self.assertGreater(_report["stages"]["parse"]["peak"], 0)
+        self.assertTrue(_report["stages"]["parse"]["sites"])
+        self.assertTrue(all(":" in _site["site"] and _site["size"] > 0 for _site in _report["stages"]["parse"]["sites"]))
+        # Per-record stages take no snapshots
+        self.assertEqual(_report["stages"]["transform_record"]["sites"], [])
+
+        # Each extraction is a document of its own, even of the same file twice in a row
+        self.assertEqual([ _document["url"] for _document in _report["documents"] ], [ _large, _large, ])
+        self.assertEqual(_report["stages"]["extract"]["calls"], 2)
+        for _document in _report["documents"]:
+            self.assertGreaterEqual(_document["peak"], _document["stages"]["get_value_table"])
+            self.assertGreaterEqual(_document["peak"], _document["stages"]["extract"])
+        self.assertEqual(_flags, [ _large, _large, ])
+        self.assertEqual([ _document["url"] for _document in _report["flagged"] ], [ _large, _large, ])
+
+        # Configurations of the same page in extract_many() are separate documents too
+        with instrument.memory_tracer(sites=0) as _tracer:
+            extract_many([ _config("intel_alderlake_table.html"), _config("intel_alderlake_table.html") ])
+
+        self.assertEqual([ _document["url"] for _document in _tracer.report()["documents"] ], [ _large, _large, ])
+
+        # Without tracemalloc.reset_peak(), as on Python 3.8, a stage is not charged an earlier stage's peak
+        _reset_peak = instrument._reset_peak
+        instrument._reset_peak = None
+        try:
+            with instrument.memory_tracer(sites=0) as _tracer:
+                with instrument.stage("large"):
+                    _large_data = bytearray(4 * 1024 * 1024)
+                    del _large_data
+                with instrument.stage("small"):
+                    _small_data = bytearray(64 * 1024)
+                    del _small_data
+        finally:
+            instrument._reset_peak = _reset_peak
+
+        _report = _tracer.report()
+        self.assertGreaterEqual(_report["stages"]["large"]["peak"], 4 * 1024 * 1024)
+        self.assertLess(_report["stages"]["small"]["peak"], 1024 * 1024)
+
+    def test_metrics(self) -> None:
+        import urllib.request
+
+        _html = b'<ul><li><a href="/missing.png">A</a></li><li><a href="/logo.png">B</a></li></ul>'
+
+        with local_server({
+            "/page":({ "Content-Type":"text/html; charset=utf-8" }, _html, 0),
+            "/logo.png":({ "Content-Type":"image/png" }, b"\x89PNG", 0),
+        }) as _server:
+            _config = {
+                "type":"html",
+                "url":_server.url("/page"),
+                "locate":[
+                    {
+                        "search_root":[ "li", ],
+                        "values":{ "name":"a", "img":"a$attr[href]" },
+                        "transform":{ "img":{ "embed":"url" } },
+                    },
+                ],
+            }
+
+            with metrics.metrics_collector() as _collector:
+                self.assertEqual(len(extract(_config)[0]), 2)
+
+            _registry = _collector.registry
+            _host = "127.0.0.1"
+
+            self.assertEqual(_registry.metrics["extract_http_records_total"].get(group=0), 2)
+            self.assertEqual(_registry.metrics["extract_http_stage_errors_total"].get(stage="embed_base64"), 1)
+            self.assertEqual(
+                _registry.metrics["extract_http_fetch_seconds"].values[(_host, 200)][-1] + \
+                _registry.metrics["extract_http_fetch_seconds"].values[(_host, 404)][-1],
+                3,
+            )
+            self.assertEqual(_registry.metrics["extract_http_fetch_bytes"].values[(_host, )][-2], len(_html) + 4)
+
+            _snapshot = _registry.snapshot()
+            self.assertEqual(
+                { _sample["labels"]["cache"] for _sample in _snapshot["extract_http_cache_hit_ratio"] },
+                { "coalescer", "row_class" },
+            )
+
+            _endpoint = _registry.serve(port=0)
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{_endpoint.server_address[1]}/metrics") as _response:
+                    self.assertTrue(_response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+                    _text = _response.read().decode("utf-8")
+            finally:
+                _endpoint.shutdown()
+                _endpoint.server_close()
+
+            _lines = _text.splitlines()
+            self.assertIn("# TYPE extract_http_fetch_seconds histogram", _lines)
+            self.assertIn('extract_http_records_total{group="0"} 2', _lines)
+            self.assertIn(f'extract_http_fetch_bytes_bucket{{host="{_host}",le="+Inf"}} 2', _lines)
+            self.assertIn('extract_http_stage_seconds_count{stage="parse"} 1', _lines)
+
+    def test_extract_many(self) -> None:
+        _html_config = lambda keys: {
+            "type":"html",
+            "file":self.get_testdata_path("{name}.html"),
+            "locate":[
+                {
+                    "search_root":[ "table", ],
+                    "table":{
+                        "orient":"rows",
+                        "key_index":0,
+                        "keys":keys,
+                    },
+                },
+            ],
+        }
+
+        _configs = {
+            "cpu":_html_config({ "CPU":"$innerText", "URL":"a$attr[href]" }),
+            "names":_html_config({ "CPU":"$innerText" }),
+            "missing":{ "type":"html", "file":self.get_testdata_path("{name}.html"), },
+        }
+
+        with instrument.stage_stats() as _stats:
+            _results = extract_many(_configs, name="intel_alderlake_table")
+
+        self.assertEqual(list(_results), [ "cpu", "names", "missing" ])
+        self.assertEqual(_results["cpu"], extract(_configs["cpu"], name="intel_alderlake_table"))
+        self.assertEqual(
+            [ _record["CPU"] for _record in _results["names"][0] ],
+            [ _record["CPU"] for _record in _results["cpu"][0] ],
+        )
+        self.assertFalse(_results["missing"])
+
+        # Parsed once for both configurations
+        self.assertEqual(_stats.report()["stages"]["parse"]["calls"], 1)
+
+    def test_projection(self) -> None:
+        import tempfile
+
+        _html = "<ul>" + "".join(
+            f'<li><a href="/{_id}">Item {_id}</a><span>{_id}.50</span><img src="/{_id}.png"></li>' for _id in range(3)
+        ) + "</ul>"
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "list.html")
+            with open(_path, "w", encoding="utf-8") as _fHnd:
+                _fHnd.write(_html)
+
+            _config = {
+                "type":"html",
+                "file":_path,
+                "url":"http://127.0.0.1:9/",
+                "locate":[
+                    {
+                        "search_root":[ "li", ],
+                        "values":{ "name":"a", "href":"a$attr[href]", "price":"span", "image":"img$attr[src]" },
+                        "transform":{
+                            "price":{ "type":"float" },
+                            "label":{ "source":"{name} at {price}" },
+                            "image":{ "embed":"url" },
+                            "info>>>name":{ "source":"{name}" },
+                        },
+                    },
+                    {
+                        "search_root":[ "li", ],
+                        "values":{ "image":"img$attr[src]" },
+                    },
+                ],
+            }
+
+            _compiled = project_config(_config, [ "label", "info>>>name" ])
+            self.assertEqual(list(_compiled["locate"][0]["values"]), [ "name", "price" ])
+            self.assertEqual(list(_compiled["locate"][0]["transform"]), [ "price", "label", "info>>>name" ])
+            self.assertIsNone(_compiled["locate"][1])
+            self.assertEqual(len(_config["locate"][0]["values"]), 4)
+
+            # No embeds fetched, and the records only hold the fields
+            with instrument.stage_stats() as _stats:
+                _data = extract(_config, project_fields=[ "label", "info>>>name" ])
+
+            self.assertNotIn("embed_base64", _stats.report()["stages"])
+            self.assertEqual(_data[0][2], { "label":"Item 2 at 2.5", "info":{ "name":"Item 2" } })
+            self.assertEqual(_data[1], [])
+
+            # Pruned selectors still decide the number of records
+            self.assertEqual(_compiled["locate"][0]["counted"], { "href":"a$attr[href]", "image":"img$attr[src]" })
+
+            _counts_html = "<ul>" + "".join(f"<li>L{_id}</li>" for _id in range(3)) + "</ul><span>S0</span>"
+            with open(_path, "w", encoding="utf-8") as _fHnd:
+                _fHnd.write(_counts_html)
+
+            for _locate_group, _fields in (
+                ({ "values":{ "a":"li", "b":"span" } }, [ "b" ]),
+                ({ "values":{ "a":"li", "b":"span" } }, [ "a" ]),
+                ({ "values":{ "a":"li" }, "transform":{ "src":{ "source":"site-A" } } }, [ "src" ]),
+                ({ "values":{ "a":"li" }, "transform":{ "page":{ "source":"{url}" } } }, [ "page" ]),
+                ({ "lists":{ "a":"li", "b":"span" }, "transform":{ "src":{ "source":"site-A" } } }, [ "src", "b" ]),
+            ):
+                _counts_config = { "type":"html", "file":_path, "url":"http://127.0.0.1:9/", "locate":[ _locate_group, ] }
+                _full = extract(_counts_config)
+
+                self.assertTrue(_full[0])
+                self.assertEqual(extract(_counts_config, project_fields=_fields), [ project_data(_group, _fields) for _group in _full ])
+
+            self.assertEqual(
+                extract({ "type":"html", "file":_path, "locate":[ { "values":{ "a":"li", "b":"span" } }, ] }, project_fields=[ "b" ]),
+                [ [ { "b":"S0" }, { "b":None }, { "b":None }, ], ],
+            )
+
+            # Values only extracted where the number of records depends on them
+            _soup = parse_html("<div><p>x</p><p></p><p></p><i>a</i><i>b</i><i>c</i><i>d</i></div>")
+            self.assertEqual(get_value_records({ "p":"p" }, _soup.find_all("div"), counted={ "i":"i" }), [ { "p":"x" }, { "p":None }, { "p":None }, { "p":None } ])
+            self.assertIsInstance(get_node_value("i", _soup.find("div"), lazy=True), node_values)
+
+            _extracted = []
+            _values = node_values(_soup.find_all("i"), lambda node: _extracted.append(node.text) or node.text)
+            self.assertEqual(list(assemble_records([ "x", "", "" ], counted=[ _values, ])), [ ("x", ), ("", ), ("", ), (None, ) ])
+            self.assertEqual(_extracted, [ "b", "c", "d" ])
+            self.assertEqual(list(assemble_records(counted=[ [ 1, 2, 0 ], ])), [ (), () ])
+
+        self.assertEqual(
+            project_data([ { "a":1, "b":{ "c":[ { "d":2, "e":3 } ], "f":4 } } ], [ "b>>>c>>>d", "a", "missing" ]),
+            [ { "b":{ "c":[ { "d":2 } ] }, "a":1 } ],
+        )
+
+        # Table columns that are not requested are never exported
+        _table_config = {
+            "type":"html",
+            "file":self.get_testdata_path("intel_alderlake_table.html"),
+            "locate":[ { "search_root":[ "table", ], "table":{ "orient":"rows", "key_index":0, }, }, ],
+        }
+
+        _full = extract(_table_config)[0]
+        _projected = extract(_table_config, project_fields=[ "CPU", "IGP" ])[0]
+        self.assertEqual(_projected, [ { "CPU":_record["CPU"], "IGP":_record["IGP"] } for _record in _full ])
+
+        # "fields" is a URL parameter like any other
+        with local_server({
+            "/specs/":({ "Content-Type":"text/html; charset=utf-8" }, b"<ul><li><a>A</a><span>1</span></li></ul>", 0),
+        }) as _server:
+            _url_config = {
+                "type":"html",
+                "url":_server.url("/{fields}/"),
+                "locate":[ { "search_root":[ "li", ], "values":{ "name":"a", "price":"span" } }, ],
+            }
+
+            self.assertEqual(extract(_url_config, fields="specs", project_fields=[ "name" ]), [ [ { "name":"A" } ] ])
+            self.assertEqual(_server.hits, { "/specs/":1 })
+
+    def test_teardown_soup(self) -> None:
+        import gc
+        import tempfile
+
+        _html = "<ul>" + "".join(f'<li><a href="/{_id}">Item {_id}</a></li>' for _id in range(50)) + "</ul>"
+        _locate = [ { "search_root":[ "li", ], "values":{ "name":"a", "href":"a$attr[href]" } }, ]
+
+        # Values are plain strings, and outlive the tree
+        _records = do_locate_html(_locate, _html)[0]
+        self.assertEqual(len(_records), 50)
+        self.assertEqual(_records[49], { "name":"Item 49", "href":"/49" })
+        self.assertIs(type(_records[0]["name"]), str)
+
+        # Nothing is left for the cyclic garbage collector
+        gc.collect()
+        gc.disable()
+        try:
+            _soup = parse_html(_html)
+            teardown_soup(_soup)
+            del _soup
+            self.assertEqual(gc.collect(), 0)
+        finally:
+            gc.enable()
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _files = []
+            for _id in range(6):
+                _files.append(os.path.join(_dir, f"{_id}.html"))
+                with open(_files[-1], "w", encoding="utf-8") as _fHnd:
+                    _fHnd.write(f'<ul><li><a href="/{_id}">{_id}</a></li></ul>')
+
+            # Workers recycled after every chunk of 2 documents
+            _results = list(iter_extract_files({ "type":"html", "url":"", "locate":_locate, }, _files, processes=2, chunksize=2, max_documents=2))
+            self.assertEqual(
+                sorted(_result[0][0]["href"] for _path, _kwargs, _result in _results),
+                [ f"/{_id}" for _id in range(6) ],
+            )
+
+            _queue = sqlite_queue(os.path.join(_dir, "jobs.sqlite"))
+            _queue.put_many("page", [ { "id":_id } for _id in range(3) ], config={ "type":"html", "file":os.path.join(_dir, "{id}.html"), "locate":_locate, })
+
+            # Any growth at all recycles the worker after its first job
+            _worker = queue_worker(_queue, { "page":{ "type":"html", "file":os.path.join(_dir, "{id}.html"), "locate":_locate, } }, workers=1)
+            _summary = _worker.run(max_rss_growth=-1)
+            self.assertTrue(_worker.recycled)
+            self.assertEqual(_summary["done"], 1)
+            self.assertEqual(_queue.counts()["pending"], 2)
+
+    def test_extract_files(self) -> None:
+        import tempfile
+        import unittest.mock
+
+        _config = {
+            "type":"html",
+            "url":"https://www.example.com/{page}/",
+            "locate":[ { "search_root":[ "li", ], "values":{ "name":"a", "href":"a$attr[href]" } }, ],
+        }
+
+        with tempfile.TemporaryDirectory() as _dir:
+            os.makedirs(os.path.join(_dir, "pages", "sub"))
+            _pages = {
+                "pages/a.html":('<ul><li><a href="/x">\u201cA\u201d</a></li><li><a href="y">B</a></li></ul>', "utf-8"),
+                "pages/sub/b.html":('<meta charset="windows-1252"><ul><li><a href="/z">\u20ac</a></li></ul>', "cp1252"),
+                "pages/empty.html":("", "utf-8"),
+                "pages/skip.txt":("<ul><li><a>Skip</a></li></ul>", "utf-8"),
+            }
+            for _name, (_html, _encoding) in _pages.items():
+                with open(os.path.join(_dir, _name), "wb") as _fHnd:
+                    _fHnd.write(_html.encode(_encoding))
+
+            _document = map_file(os.path.join(_dir, "pages/sub/b.html"))
+            self.assertIsInstance(_document, document_bytes)
+            self.assertEqual((_document.content, _document.encoding), (_pages["pages/sub/b.html"][0].encode("cp1252"), "cp1252"))
+            self.assertEqual(_document.text, _pages["pages/sub/b.html"][0])
+            self.assertEqual(map_file(os.path.join(_dir, "pages/empty.html")).content, b"")
+
+            _html_files = [ os.path.join(_dir, _name) for _name in ("pages/a.html", "pages/empty.html", "pages/sub/b.html") ]
+            self.assertEqual([ _path for _path, _ in iter_files(os.path.join(_dir, "pages"), pattern="*.html") ], _html_files)
+            self.assertEqual(sorted(_path for _path, _ in iter_files(os.path.join(_dir, "pages", "**", "*.html"))), sorted(_html_files))
+
+            with open(os.path.join(_dir, "manifest.txt"), "w") as _fHnd:
+                _fHnd.write('# pages\n{"file": "pages/a.html", "page": "a"}\n\n{"file": "pages/sub/b.html", "page": "b"}\n{"file": "pages/missing.html", "page": "c"}\n')
+
+            _path = os.path.join(_dir, "output.ndjson")
+            with ndjson_sink(_path) as _sink:
+                _summary = extract_files(_config, os.path.join(_dir, "manifest.txt"), _sink, group=0, with_path=True, processes=2, chunksize=1)
+
+            self.assertEqual((_summary["files"], _summary["records"]), (3, 3))
+            self.assertEqual([ _path for _path, _ in _summary["errors"] ], [ os.path.join(_dir, "pages/missing.html"), ])
+            self.assertFalse(_summary["errors"][0][1])
+
+            with open(_path, "r", encoding="utf-8") as _fHnd:
+                _records = sorted((json.loads(_line) for _line in _fHnd), key=lambda record: record["href"])
+
+            self.assertEqual(
+                [ (_record["page"], _record["name"], _record["href"]) for _record in _records ],
+                [
+                    ("a", "\u201cA\u201d", "/x"),
+                    ("b", "\u20ac", "/z"),
+                    ("a", "B", "y"),
+                ],
+            )
+            self.assertEqual(_records[0]["file"], os.path.join(_dir, "pages/a.html"))
+
+            # Compacted groups are sent back from the workers whole
+            for _layout in ("rows", "slots"):
+                _compact_config = { **_config, "locate":[ { **_config["locate"][0], "compact":_layout }, ] }
+                _results = { _path:_result for _path, _, _result in iter_extract_files(_compact_config, [ { "file":_path, "page":"a" } for _path in _html_files ], processes=2, chunksize=1) }
+
+                self.assertIsInstance(_results[_html_files[0]][0], record_group)
+                self.assertEqual(_results[_html_files[0]][0].layout, _layout)
+                self.assertEqual(_results[_html_files[0]][0].to_list(), [ { "name":"\u201cA\u201d", "href":"/x" }, { "name":"B", "href":"y" } ])
+
+            # A result that cannot be sent between processes is an error of its own file only
+            _unpicklable = lambda: None
+            with unittest.mock.patch("extract_http.files.extract_file", lambda config, path, **kwargs: _unpicklable if (path == "b") else [ path ]):
+                _results = [ (_path, load_result(_pickled)) for _path, _, _pickled in extract_file_chunk(_config, [ ("a", {}), ("b", {}), ("c", {}) ]) ]
+
+            self.assertEqual([ _result for _path, _result in _results if _path != "b" ], [ [ "a" ], [ "c" ] ])
+            self.assertIsInstance(_results[1][1], FileExtractionError)
+
+    def test_archive(self) -> None:
+        import base64
+        import gzip
+        import tempfile
+
+        def _page(name:str)->bytes:
+            return f'<html><body><h1>{name}</h1><a href="/{name}.pdf">PDF</a></body></html>'.encode("utf-8")
+
+        def _warc_record(url:str, block:bytes, type:str="response")->bytes:
+            _content_type = "application/http; msgtype=response" if (type == "response") else "text/html"
+            return (
+                f"WARC/1.0\r\nWARC-Type: {type}\r\nWARC-Target-URI: {url}\r\n"
+                f"Content-Type: {_content_type}\r\nContent-Length: {len(block)}\r\n\r\n"
+            ).encode("utf-8") + block + b"\r\n\r\n"
+
+        def _http(body:bytes, headers:str="Content-Type: text/html; charset=utf-8\r\n", status:str="200 OK")->bytes:
+            return f"HTTP/1.1 {status}\r\n{headers}\r\n".encode("utf-8") + body
+
+        _records = [
+            _warc_record("https://www.example.com/A1/en/", _http(_page("A1"))),
+            _warc_record("https://www.example.com/robots.txt", _http(b"User-agent: *", "Content-Type: text/plain\r\n")),
+            _warc_record(
+                "https://www.example.com/A2/en/",
+                _http(
+                    b"%x\r\n%s\r\n0\r\n\r\n" % (len(gzip.compress(_page("A2"))), gzip.compress(_page("A2"))),
+                    "Content-Type: text/html\r\nTransfer-Encoding: chunked\r\nContent-Encoding: gzip\r\n",
+                ),
+            ),
+            _warc_record("https://www.example.com/A3/en/", _page("A3"), type="resource"),
+            _warc_record("https://www.example.com/A4/en/", _http(b"Gone", status="404 Not Found")),
+        ]
+
+        _config = {
+            "type":"html",
+            "url":"https://www.example.com/{art_no}/en/",
+            "locate":[ { "search_root":[ "body", ], "values":{ "name":"h1", "pdf":"a$attr[href]" } }, ],
+        }
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _paths = {
+                "plain":os.path.join(_dir, "crawl.warc"),
+                "gzip":os.path.join(_dir, "crawl.warc.gz"),
+            }
+            with open(_paths["plain"], "wb") as _fHnd:
+                _fHnd.write(b"".join(_records))
+            with open(_paths["gzip"], "wb") as _fHnd:
+                _fHnd.write(b"".join(gzip.compress(_record) for _record in _records))
+
+            for _kind, _path in _paths.items():
+                _archive = open_archive(_path, index_path=_path + ".idx")
+                self.assertEqual(len(_archive.urls()), 5)
+                self.assertEqual(_archive.get("https://www.example.com/A2/en/#top").content, _page("A2"))
+                with self.assertRaises(ArchiveRecordNotFound):
+                    _archive.get("https://www.example.com/A9/en/")
+
+                # The index is reused from disk
+                self.assertEqual(open_archive(_path, index_path=_path + ".idx").get_index(), _archive.get_index())
+
+                self.assertEqual(
+                    extract({ **_config, "archive":_path, }, art_no="A3"),
+                    [ [ { "name":"A3", "pdf":"/A3.pdf" } ] ],
+                )
+
+                _results = list(iter_extract_archive({ "spec":_config, }, _path))
+                self.assertEqual(
+                    [ (_name, _kwargs, _result) for _name, _url, _kwargs, _result in _results[:3] ],
+                    [
+                        ("spec", { "art_no":"A1" }, [ [ { "name":"A1", "pdf":"/A1.pdf" } ] ]),
+                        ("spec", { "art_no":"A2" }, [ [ { "name":"A2", "pdf":"/A2.pdf" } ] ]),
+                        ("spec", { "art_no":"A3" }, [ [ { "name":"A3", "pdf":"/A3.pdf" } ] ]),
+                    ],
+                )
+                self.assertEqual(len(_results), 4)
+                self.assertFalse(_results[3][3])
+                self.assertEqual(_results[3][3].err_code, 404)
+
+            _har = {
+                "log":{
+                    "entries":[
+                        {
+                            "request":{ "url":"https://www.example.com/A5/en/" },
+                            "response":{ "status":200, "headers":[], "content":{ "mimeType":"text/html", "text":_page("A5").decode("utf-8") } },
+                        },
+                        {
+                            "request":{ "url":"https://www.example.com/A6/en/" },
+                            "response":{ "status":200, "headers":[], "content":{ "mimeType":"text/html", "encoding":"base64", "text":base64.b64encode(_page("A6")).decode("ascii") } },
+                        },
+                    ],
+                },
+            }
+            _path = os.path.join(_dir, "session.har")
+            with open(_path, "w") as _fHnd:
+                json.dump(_har, _fHnd)
+
+            self.assertEqual(
+                [ _result for _name, _url, _kwargs, _result in iter_extract_archive([ _config, ], _path) ],
+                [ [ [ { "name":"A5", "pdf":"/A5.pdf" } ] ], [ [ { "name":"A6", "pdf":"/A6.pdf" } ] ] ],
+            )
+
+    def test_work_queue(self) -> None:
+        import sqlite3
+        import tempfile
+
+        _configs = {
+            "table":{
+                "type":"html",
+                "file":self.get_testdata_path("{name}.html"),
+                "locate":[
+                    {
+                        "search_root":[ "table", ],
+                        "table":{ "orient":"rows", "key_index":0, "keys":{ "CPU":"$innerText" } },
+                    },
+                ],
+            },
+            "api":{ "type":"json", "url":"https://api.example.com/{name}", },
+        }
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _queue = sqlite_queue(os.path.join(_dir, "jobs.sqlite"), max_attempts=2)
+
+            _queue.put_many("table", [ { "name":"intel_alderlake_table" }, { "name":"missing" } ], config=_configs["table"])
+            _queue.put_many("api", [ { "name":"sku" } ], config=_configs["api"])
+
+            # Sharded by host; local files have no shard
+            _job = _queue.get(shards=[ "api.example.com" ], visibility_timeout=0)
+            self.assertEqual((_job.config_id, _job.kwargs, _job.shard), ("api", { "name":"sku" }, "api.example.com"))
+
+            # Visibility timeout of 0 - the job is immediately visible again, and the old lease is void
+            _job_again = _queue.get(shards=[ "api.example.com" ])
+            self.assertEqual((_job_again.id, _job_again.attempts), (_job.id, 2))
+            with self.assertRaises(QueueLeaseExpired):
+                _queue.ack(_job)
+            _queue.nack(_job_again, error="Unreachable")
+            self.assertIsNone(_queue.get(shards=[ "api.example.com" ]))
+
+            with ndjson_sink(os.path.join(_dir, "output.ndjson")) as _sink:
+                _summary = queue_worker(_queue, _configs, sink=_sink, workers=2, retry_delay=0).run()
+
+            self.assertEqual(_summary, { "done":1, "retried":1, "failed":1, "expired":0 })
+            self.assertEqual(_queue.counts(), { "pending":0, "leased":0, "done":1, "failed":2 })
+            self.assertEqual(
+                [ (_failure["kwargs"], _failure["attempts"]) for _failure in _queue.failures() ],
+                [ ({ "name":"missing" }, 2), ({ "name":"sku" }, 2) ],
+            )
+
+            with open(os.path.join(_dir, "output.ndjson")) as _fHnd:
+                _output = [ json.loads(_line) for _line in _fHnd ]
+
+            self.assertEqual(len(_output), 1)
+            self.assertEqual(_output[0]["kwargs"], { "name":"intel_alderlake_table" })
+            self.assertEqual(_output[0]["data"], extract(_configs["table"], name="intel_alderlake_table"))
+
+            # The connections of the worker threads are closed too
+            _connections = list(_queue.connections)
+            self.assertGreater(len(_connections), 1)
+            _queue.close()
+            self.assertEqual(_queue.connections, set())
+            for _connection in _connections:
+                with self.assertRaises(sqlite3.ProgrammingError):
+                    _connection.execute("SELECT 1")
+
+            # and the queue reconnects when used again
+            self.assertEqual(_queue.counts()["done"], 1)
+            _queue.close()
+
+            # Retries waiting out their backoff are run within the same run()
+            _queue = sqlite_queue(os.path.join(_dir, "retries.sqlite"), max_attempts=3)
+            _queue.put_many("flaky", [ { "id":_id } for _id in range(2) ])
+            _attempts = {}
+
+            def _flaky(config, id):
+                _attempts[id] = _attempts.get(id, 0) + 1
+                if (_attempts[id] < 2):
+                    raise ValueError(f"Job {id} failed.")
+                return id
+
+            _summary = queue_worker(_queue, { "flaky":{} }, workers=2, retry_delay=0.2, poll_interval=0.05, func=_flaky).run()
+            self.assertEqual(_summary, { "done":2, "retried":2, "failed":0, "expired":0 })
+            self.assertEqual(_queue.counts(), { "pending":0, "leased":0, "done":2, "failed":0 })
+            self.assertIsNone(_queue.wait_time())
+
+            # A lease that expires after the last attempt is counted as failed without another get()
+            _queue.put("flaky", { "id":2 })
+            for _ in range(3):
+                _job = _queue.get(visibility_timeout=0)
+            self.assertEqual(_job.attempts, 3)
+            self.assertEqual(_queue.counts(), { "pending":0, "leased":0, "done":2, "failed":1 })
+
+            _queue.close()
+
+    def test_curl_coalescing(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with local_server({
+            "/sku.json":({ "Content-Type":"application/json" }, b'{"sku": 42, "sizes": [1, 2]}', 0.2),
+        }) as _server:
+            fetch.COALESCER.reset()
+
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                _results = list(executor.map(
+                    lambda _params: curl(_server.url("/sku.json"), _params),
+                    [ { "a":1, "b":2 }, ] * 4 + [ { "b":2, "a":1 }, ],
+                ))
+
+            self.assertEqual(_server.hits["/sku.json"], 1)
+            self.assertEqual(_results, [ { "sku":42, "sizes":[ 1, 2 ] } ] * 5)
+
+            # Each caller gets its own copy of the decoded data
+            _results[0]["sizes"].append(3)
+            self.assertEqual(_results[1]["sizes"], [ 1, 2 ])
+
+            self.assertEqual(fetch.COALESCER.stats(), { "requests":5, "fetches":1, "coalesced":4, "bytes_saved":4 * 28 })
+
+            # Not in flight any more
+            curl(_server.url("/sku.json"), { "a":1, "b":2 })
+            self.assertEqual(_server.hits["/sku.json"], 2)
+
+    @unittest.skipIf(fetch.httpx is None or fetch.h2 is None, "httpx and h2 are not installed.")
+    def test_curl_http2(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _html = "<html><body><p>HTTP/2</p></body></html>"
+        _transport = fetch.httpx_transport(max_streams=8, prior_knowledge=True)
+        _previous = fetch.set_transport(_transport)
+
+        try:
+            with local_h2_server(_html.encode("utf-8")) as _server:
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    _results = list(executor.map(
+                        lambda _id: curl(_server.url(f"/page/{_id}")),
+                        range(16),
+                    ))
+
+                self.assertEqual(_results, [ _html ] * 16)
+
+                # All requests multiplexed over one connection, at most max_streams at a time
+                self.assertEqual(_server.connections, 1)
+                self.assertGreater(_server.max_streams, 1)
+                self.assertLessEqual(_server.max_streams, 8)
+
+            # Falls back to HTTP/1.1 for servers without HTTP/2
+            with local_server({
+                "/page":({ "Content-Type":"text/html; charset=utf-8" }, _html.encode("utf-8"), 0),
+            }) as _server:
+                self.assertEqual(curl(_server.url("/page")), _html)
+                self.assertEqual(curl(_server.url("/page")), _html)
+                self.assertIn(f"127.0.0.1:{_server.server.server_port}", _transport.http1_hosts)
+        finally:
+            fetch.set_transport(_previous)
+            _transport.close()
+
+    def test_curl_compression(self) -> None:
+        import gzip
+
+        _html = ("<html><body>" + "<p>Compressed</p>" * 1000 + "</body></html>").encode("utf-8")
+        _encoded = {
+            "gzip":gzip.compress(_html),
+        }
+        if (fetch.brotli is not None):
+            _encoded["br"] = fetch.brotli.compress(_html)
+        if (fetch.zstandard is not None):
+            _encoded["zstd"] = fetch.zstandard.ZstdCompressor().compress(_html)
+
+        with local_server({
+            f"/{_encoding}":({ "Content-Type":"text/html; charset=utf-8", "Content-Encoding":_encoding }, _body, 0) \
+                for _encoding, _body in _encoded.items()
+        }) as _server:
+            for _encoding in _encoded:
+                self.assertEqual(curl(_server.url(f"/{_encoding}")), _html.decode("utf-8"))
+
+            self.assertEqual(
+                _server.requests[0]["Accept-Encoding"].split(", "),
+                [ _encoding for _encoding in ("zstd", "br") if _encoding in _encoded ] + [ "gzip", "deflate" ],
+            )
+
+            _previous = fetch.set_transport(fetch.requests_transport(keep_compressed=True))
+            try:
+                for _encoding, _body in _encoded.items():
+                    _response = fetch.fetch_response(_server.url(f"/{_encoding}"))
+                    self.assertEqual(_response.content, _html)
+                    self.assertEqual((_response.compressed, _response.content_encoding, _response.nbytes), (_body, _encoding, len(_body)))
+            finally:
+                fetch.set_transport(_previous)
+
+    def test_curl_as_bytes(self) -> None:
+        import tempfile
+
+        _meta = '<html><head><meta charset="windows-1252"></head><body><p>\u201cSale\u201d \u20ac5</p></body></html>'
+        _plain = "<html><body><p>\u201cSale\u201d \u20ac5</p></body></html>"
+
+        # The bytes are kept as they are, not copied
+        _content = _plain.encode("utf-8")
+        self.assertIs(document_bytes(_content, "utf-8").content, _content)
+        self.assertEqual(document_bytes(_content, "utf-8").text, _plain)
+
+        self.assertEqual(sniff_encoding(b"\xef\xbb\xbf<p>"), "utf-8")
+        self.assertEqual(sniff_encoding(b"<p>", "ISO-8859-1"), "cp1252")
+        self.assertEqual(sniff_encoding(_meta.encode("cp1252")), "cp1252")
+        self.assertEqual(sniff_encoding(_plain.encode("utf-8")), "utf-8")
+        self.assertEqual(sniff_encoding(_plain.encode("cp1252")), "cp1252")
+        # <meta> beyond the limit is not scanned
+        self.assertEqual(sniff_encoding(b" " * 100 + _meta.encode("cp1252"), limit=50), "utf-8")
+
+        with local_server({
+            "/declared":({ "Content-Type":"text/html; charset=shift_jis" }, "<p>\u65e5\u672c</p>".encode("shift_jis"), 0),
+            "/meta":({ "Content-Type":"text/html" }, _meta.encode("cp1252"), 0),
+        }) as _server:
+            _declared = curl(_server.url("/declared"), as_bytes=True)
+            self.assertIsInstance(_declared, document_bytes)
+            self.assertEqual(len(_declared), len("<p>\u65e5\u672c</p>".encode("shift_jis")))
+            self.assertEqual((_declared.encoding, _declared.text), ("shift_jis", "<p>\u65e5\u672c</p>"))
+
+            _config = {
+                "type":"html",
+                "url":_server.url("/meta"),
+                "bytes":True,
+                "locate":[ { "search_root":[ "body", ], "values":{ "text":"p" } }, ],
+            }
+            self.assertEqual(extract(_config)[0][0]["text"], "\u201cSale\u201d \u20ac5")
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "page.html")
+            with open(_path, "wb") as _fHnd:
+                _fHnd.write(_meta.encode("cp1252"))
+
+            _config = {
+                "type":"html",
+                "url":"https://www.example.com/",
+                "file":_path,
+                "bytes":True,
+                "locate":[ { "search_root":[ "body", ], "values":{ "text":"p" } }, ],
+            }
+            self.assertEqual(extract(_config)[0][0]["text"], "\u201cSale\u201d \u20ac5")
+
+    def test_record_group(self) -> None:
+        _records = [
+            {
+                "Name":"John Doe",
+                "Age":35,
+                "Employment":{
+                    "Role":"Backend Developer",
+                    "Salary":40000,
+                },
+            },
+            {
+                "Name":"Jane Doe",
+                "Employment":{
+                    "Role":"Data Engineer",
+                    "Salary":52000,
+                },
+            },
+        ]
+
+        for _layout in ("rows", "columns", "slots"):
+            _group = record_group.from_records(_records, layout=_layout)
+
+            self.assertEqual(len(_group), 2)
+            self.assertEqual(_group.keys, ("Name", "Age", "Employment"))
+            self.assertEqual(_group.to_list(), _records)
+            self.assertEqual(_group[1], _records[1])
+            self.assertEqual(_group.get("Employment>>>Salary", delimiter=RECORD_DICT_DELIMITER), [40000, 52000])
+            self.assertEqual(_group.get("Age", None), [35, None])
+
+        self.assertEqual(record_group.from_records(_records, layout="slots").data[0].Name, "John Doe")
+
+        # MISSING is restored as itself, so keys absent from a record stay absent
+        _group = pickle.loads(pickle.dumps(record_group.from_records([ { "a":1 }, { "a":2, "b":3 } ], layout="rows")))
+        self.assertIs(_group.data[0][1], MISSING)
+        self.assertEqual(_group.to_list(), [ { "a":1 }, { "a":2, "b":3 } ])
+
+        # Rows of generated classes are pickled by their schema
+        for _keys in (("a", "b"), ("a b", "c")):
+            _group = record_group.from_records([ dict(zip(_keys, (1, 2))), { _keys[0]:3 } ], layout="slots")
+            _unpickled = pickle.loads(pickle.dumps(_group))
+            self.assertIs(type(_unpickled.data[0]), type(_group.data[0]))
+            self.assertEqual(_unpickled.to_list(), _group.to_list())
+
+        # Records are consumed one at a time; rows made before a key first appeared are padded
+        _group = record_group.from_records(iter(reversed(_records)), layout="rows")
+        self.assertEqual(_group.keys, ("Name", "Employment", "Age"))
+        self.assertEqual(_group.to_list(), list(reversed(_records)))
+
+        # Compacting while transforming lowers the peak, not only the memory retained
+        import tracemalloc
+        from extract_http.extract import do_locate_soup
+
+        _soup = parse_html("<ul>" + "".join(f"<li><a>Item {_id}</a><span>{_id}</span></li>" for _id in range(2000)) + "</ul>")
+        _locate_group = {
+            "search_root":[ "li", ],
+            "values":{ "name":"a", "price":"span", },
+            "transform":{ "price":{ "type":"float" }, "label":{ "source":"{name}: {price}" } },
+        }
+
+        _peaks = []
+        for _compact in (None, "rows"):
+            tracemalloc.start()
+            _data = do_locate_soup([ { **_locate_group, "compact":_compact }, ], _soup)
+            _peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        self.assertEqual(_data[0][1999], { "name":"Item 1999", "price":1999.0, "label":"Item 1999: 1999.0" })
+        self.assertLess(_peaks[1], _peaks[0])
+        teardown_soup(_soup)
+
+    def test_export_numpy(self) -> None:
+        _records = [
+            { "art_no":"A2000292", "Weight":1.38, "Pieces":4, },
+            { "art_no":"A2000293", "Weight":None, "Pieces":2, },
+        ]
+        _config = {
+            "transform":{
+                "Weight":{ "type":"float" },
+                "Pieces":{ "type":"int" },
+            }
+        }
+
+        for _group in (_records, record_group.from_records(_records, layout="columns")):
+            _array = export.to_numpy(_group, config=_config)
+
+            self.assertEqual(_array.dtype.names, ("art_no", "Weight", "Pieces"))
+            self.assertEqual(_array["Pieces"].dtype, np.int64)
+            np.testing.assert_array_equal(_array["art_no"], np.array(["A2000292", "A2000293"]))
+            np.testing.assert_allclose(_array["Weight"], np.array([1.38, np.nan]))
+
+    @unittest.skipIf(export.pyarrow is None, "pyarrow is not installed.")
+    def test_export_arrow_writer(self) -> None:
+        import tempfile
+        import pyarrow.parquet
+
+        _config = {
+            "transform":{
+                "Pieces":{ "type":"int" },
+            }
+        }
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "output.parquet")
+
+            with export.arrow_writer(_path, config=_config) as _writer:
+                _writer.write([ { "art_no":"A2000292", "Pieces":"4" }, ])
+                _writer.write([ { "art_no":"A2000293", "Pieces":2 }, { "art_no":"A2000294" }, ])
+
+            self.assertEqual(
+                pyarrow.parquet.read_table(_path).to_pylist(),
+                [
+                    { "art_no":"A2000292", "Pieces":"4" },
+                    { "art_no":"A2000293", "Pieces":"2" },
+                    { "art_no":"A2000294", "Pieces":None },
+                ]
+            )
+
+    def test_gzip_sink_close(self) -> None:
+        import gc
+        import gzip
+        import tempfile
+        import warnings
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "output.ndjson.gz")
+
+            # Closing the stream closes the file underneath, after flushing the gzip trailer into it
+            _file = open_binary(_path, compression="gzip")
+            _raw = _file.raw.fileobj
+            _file.write(b"{}\n")
+            _file.close()
+            self.assertTrue(_raw.closed)
+            with gzip.open(_path, "rb") as _fHnd:
+                self.assertEqual(_fHnd.read(), b"{}\n")
+
+            with warnings.catch_warnings(record=True) as _warnings:
+                warnings.simplefilter("always", ResourceWarning)
+
+                with ndjson_sink(_path) as _sink:
+                    for _id in range(1000):
+                        _sink.write({ "id":_id })
+                del _sink
+                gc.collect()
+
+            self.assertEqual([ _warning for _warning in _warnings if issubclass(_warning.category, ResourceWarning) ], [])
+
+            # Everything is flushed and the gzip stream is complete
+            with gzip.open(_path, "rt") as _fHnd:
+                self.assertEqual([ json.loads(_line)["id"] for _line in _fHnd ], list(range(1000)))
+
+    def test_batch_journal(self) -> None:
+        import gzip
+        import tempfile
+        import warnings
+
+        _jobs = [ { "id":_id } for _id in range(10) ]
+
+        def _flaky(config, id):
+            if (id % 3 == 0):
+                raise ValueError(f"Job {id} failed.")
+            return [ [ { "id":id, "part":_part } for _part in range(2) ] ]
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "output.ndjson.gz")
+            _journal_path = os.path.join(_dir, "journal.ndjson")
+
+            with batch_journal(_journal_path, sync_every=3) as _journal, \
+                ndjson_sink(_path) as _sink:
+                _summary = extract_batch({}, _jobs, _sink, group=0, workers=2, func=_flaky, journal=_journal)
+
+            self.assertEqual((_summary["jobs"], _summary["skipped"], len(_summary["errors"])), (10, 0, 4))
+
+            # Simulate a crash halfway through writing an entry
+            with open(_journal_path, "ab") as _fHnd:
+                _fHnd.write(b'{"job":"{\\"id\\":1')
+
+            # Resume; only the failed jobs are extracted again, and now succeed
+            with batch_journal(_journal_path) as _journal, \
+                ndjson_sink(_path, append=True) as _sink:
+                self.assertEqual(_journal.counts(), { "done":6, "failed":4 })
+                _summary = extract_batch({}, _jobs, _sink, group=0, func=lambda config, id: [ [ { "id":id, "part":0 } ] ], journal=_journal)
+
+            self.assertEqual((_summary["jobs"], _summary["skipped"], len(_summary["errors"])), (4, 6, 0))
+            with batch_journal(_journal_path) as _journal:
+                self.assertEqual(_journal.counts(), { "done":10, "failed":0 })
+                self.assertEqual(_journal.runs, 2)
+
+            with gzip.open(_path, "rt") as _fHnd:
+                _output = [ json.loads(_line) for _line in _fHnd ]
+                _ids = sorted(_record["id"] for _record in _output)
+
+            self.assertEqual(_ids, sorted([ _id for _id in range(10) if _id % 3 ] * 2 + [ 0, 3, 6, 9 ]))
+
+            # Positions are absolute in the sink, across both runs
+            _positions = {}
+            with open(_journal_path, "rb") as _fHnd:
+                for _line in _fHnd:
+                    try:
+                        _entry = json.loads(_line)
+                    except ValueError as e:
+                        continue
+                    if (_entry.get("status", None) == "done"):
+                        _positions[json.loads(_entry["job"])["id"]] = _entry["records"]
+
+            self.assertEqual(sorted(_positions), list(range(10)))
+            for _id, (_first, _count) in _positions.items():
+                self.assertEqual([ _record["id"] for _record in _output[_first:_first + _count] ], [ _id, ] * _count)
+
+            with batch_journal(_journal_path) as _journal:
+                self.assertEqual(_journal.records, len(_output))
+
+            # A journal that cannot be synced does not hide the error that stopped the batch
+            class _failing_sink(ndjson_sink):
+                def write(self, record):
+                    raise ValueError("Disk full.")
+
+                def flush(self, *args, **kwargs):
+                    raise OSError("Sink is broken.")
+
+            with batch_journal(os.path.join(_dir, "failing.ndjson")) as _journal, \
+                _failing_sink(os.path.join(_dir, "failing.ndjson.gz")) as _sink, \
+                warnings.catch_warnings(record=True) as _warnings:
+                warnings.simplefilter("always")
+
+                with self.assertRaises(ValueError):
+                    extract_batch({}, _jobs, _sink, group=0, func=lambda config, id: [ [ { "id":id } ] ], journal=_journal)
+
+            self.assertTrue(any("could not be synced" in str(_warning.message) for _warning in _warnings))
+
+    def test_extract_batch(self) -> None:
+        import csv
+        import gzip
+        import tempfile
+
+        _config = {
+            "type":"html",
+            "file":"{path}",
+            "locate":[
+                {
+                    "search_root":[
+                        "table",
+                    ],
+                    "table":{
+                        "orient":"rows",
+                        "key_index":0,
+                        "keys":{
+                            "CPU":"$innerText",
+                            "URL":"a$attr[href]"
+                        }
+                    },
+                },
+            ],
+        }
+        _answer = json.loads(_test_data["intel_alderlake_table.json"])
+
+        _jobs = [
+            { "path":self.get_testdata_path("intel_alderlake_table.html") },
+            { "path":self.get_testdata_path("does_not_exist.html") },
+        ] * 3
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "output.ndjson.gz")
+
+            # max_queue of 1 forces extraction to wait for the writer
+            with ndjson_sink(_path, max_queue=1) as _sink:
+                _summary = extract_batch(_config, _jobs, _sink, group=0, workers=2)
+
+            self.assertEqual(_summary["jobs"], 6)
+            self.assertEqual(len(_summary["errors"]), 3)
+            self.assertEqual(_summary["records"], len(_answer) * 3)
+
+            with gzip.open(_path, "rt") as _fHnd:
+                self.assertEqual([ json.loads(_line) for _line in _fHnd ], _answer * 3)
+
+            _path = os.path.join(_dir, "output.csv")
+
+            with csv_sink(_path) as _sink:
+                extract_batch(_config, _jobs[:1], _sink, group=0)
+
+            with open(_path, "r", newline="") as _fHnd:
+                _rows = list(csv.DictReader(_fHnd))
+
+            self.assertEqual([ _row["CPU"] for _row in _rows ], [ _record["CPU"] for _record in _answer ])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file